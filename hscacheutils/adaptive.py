@@ -0,0 +1,243 @@
+"""
+Cost-aware adaptive caching for gen_cache.wrap'd functions (opt in with adaptive=True, or
+adaptive=AdaptivePolicy(...) to change the bounds).
+
+Each adaptive function measures its compute time, value size, hit ratio and how often its
+generations are invalidated. Every so many calls the policy looks at those numbers and decides:
+
+  - to bypass the cache when computing is cheaper than fetching (eg. microsecond functions
+    with big values), or when values are invalidated faster than they are re-read. Bypassing
+    is only a probation: after bypass_probation seconds the function is cached (and measured)
+    again.
+  - the tier: small values that are read often are also kept (pickled) in a process local LRU,
+    so that hits skip the value fetch. Each hit still unpickles a copy of its own, so callers
+    mutating their value don't affect the others (immutable=True functions share frozen values
+    instead, see hscacheutils.immutable). They still are keyed by generations, so invalidation
+    works as usual.
+  - the timeout: about twice the average time between invalidations (values rarely outlive
+    their generations, no point in keeping them), kept between min_timeout and max_timeout. It
+    never goes above the configured timeout, which bounds the staleness the generations don't
+    cover (so it's the configured timeout when the generations are rarely invalidated).
+
+Decisions can be looked at with hscacheutils.adaptive.describe() (or gen_cache.adaptive_decisions()).
+"""
+
+import cPickle as pickle
+import threading
+
+from time import time
+
+from hscacheutils.local_cache import PickledLocalCache
+from hscacheutils.raw_cache import MAX_MEMCACHE_TIMEOUT
+
+
+MEMCACHE_TIER = 'memcache'
+LOCAL_TIER = 'local'
+
+# Weight of the newest sample in the moving averages
+EWMA_WEIGHT = 0.1
+
+
+class Decision(object):
+
+    def __init__(self, bypass=False, tier=MEMCACHE_TIER, timeout=None, reason='default'):
+        self.bypass = bypass
+        self.tier = tier
+        self.timeout = timeout
+        self.reason = reason
+        self.decided_at = time()
+
+    def as_dict(self):
+        return dict(bypass=self.bypass, tier=self.tier, timeout=self.timeout, reason=self.reason,
+                    decided_at=self.decided_at)
+
+
+class FunctionStats(object):
+    """
+    What an adaptive function measured since its last decision. Updated without locking,
+    losing an increment now and then doesn't matter here.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.compute_time = None
+        self.value_size = None
+        self.since = time()
+
+    @property
+    def reads(self):
+        return self.hits + self.misses
+
+    @property
+    def hit_ratio(self):
+        if not self.reads:
+            return None
+        return float(self.hits) / self.reads
+
+    def record_miss(self, compute_time, value_size):
+        self.misses += 1
+        self.compute_time = _ewma(self.compute_time, compute_time)
+        self.value_size = _ewma(self.value_size, value_size)
+
+    def as_dict(self):
+        return dict(hits=self.hits, misses=self.misses, hit_ratio=self.hit_ratio, invalidations=self.invalidations,
+                    compute_time=self.compute_time, value_size=self.value_size, since=self.since)
+
+
+def _ewma(average, sample):
+    if average is None:
+        return sample
+    return (1 - EWMA_WEIGHT) * average + EWMA_WEIGHT * sample
+
+
+class AdaptivePolicy(object):
+    """
+    round_trip_cost and transfer_rate (bytes per second) estimate what fetching a value costs,
+    to compare with what computing it costs.
+    """
+
+    def __init__(self, min_timeout=60, max_timeout=MAX_MEMCACHE_TIMEOUT, min_samples=100, reevaluate_every=500,
+                 round_trip_cost=0.0005, transfer_rate=50 * 1024 * 1024, min_hit_ratio=0.1,
+                 max_local_value_size=16 * 1024, min_local_hit_ratio=0.8, local_max_items=5000,
+                 bypass_probation=600):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.min_samples = min_samples
+        self.reevaluate_every = reevaluate_every
+        self.round_trip_cost = round_trip_cost
+        self.transfer_rate = transfer_rate
+        self.min_hit_ratio = min_hit_ratio
+        self.max_local_value_size = max_local_value_size
+        self.min_local_hit_ratio = min_local_hit_ratio
+        self.bypass_probation = bypass_probation
+        self.local_tier = PickledLocalCache(max_items=local_max_items)
+
+    def fetch_cost(self, value_size):
+        return self.round_trip_cost + float(value_size) / self.transfer_rate
+
+    def clamp_timeout(self, timeout):
+        return int(max(self.min_timeout, min(self.max_timeout, timeout)))
+
+    def decide(self, stats, configured_timeout):
+        default_timeout = configured_timeout if configured_timeout is not None else self.max_timeout
+
+        if stats.reads < self.min_samples or stats.compute_time is None:
+            return Decision(timeout=default_timeout, reason='not enough samples')
+
+        fetch_cost = self.fetch_cost(stats.value_size)
+        if stats.compute_time < fetch_cost:
+            return Decision(bypass=True, reason='computing (%.6fs) is cheaper than fetching (%.6fs)' % (stats.compute_time, fetch_cost))
+
+        if stats.hit_ratio < self.min_hit_ratio:
+            return Decision(bypass=True, reason='hit ratio %.2f is below %.2f' % (stats.hit_ratio, self.min_hit_ratio))
+
+        # Never above the configured timeout, which bounds the staleness the generations don't cover
+        elapsed = time() - stats.since
+        if stats.invalidations:
+            timeout = min(self.clamp_timeout(2 * elapsed / stats.invalidations), default_timeout)
+            reason = 'invalidated every %.1fs' % (elapsed / stats.invalidations)
+        else:
+            timeout = default_timeout
+            reason = 'never invalidated'
+
+        tier = MEMCACHE_TIER
+        if stats.value_size <= self.max_local_value_size and stats.hit_ratio >= self.min_local_hit_ratio:
+            tier = LOCAL_TIER
+            reason += ', small and hot'
+
+        return Decision(tier=tier, timeout=timeout, reason=reason)
+
+
+DEFAULT_POLICY = AdaptivePolicy()
+
+
+class AdaptiveState(object):
+    """
+    The stats and current decision of one adaptive function.
+    """
+
+    def __init__(self, name, generations, configured_timeout, policy=None):
+        self.name = name
+        self.generations = tuple(generations)
+        self.configured_timeout = configured_timeout
+        self.policy = policy or DEFAULT_POLICY
+        self.stats = FunctionStats()
+        self.decision = Decision(timeout=configured_timeout, reason='not enough samples')
+
+        register(self)
+
+    @property
+    def local_tier(self):
+        return self.policy.local_tier
+
+    def record_hit(self):
+        self.stats.hits += 1
+        self._maybe_reevaluate()
+
+    def record_miss(self, compute_time, value):
+        self.stats.record_miss(compute_time, len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        self._maybe_reevaluate()
+
+    def record_invalidation(self):
+        self.stats.invalidations += 1
+
+    def check_bypass(self):
+        """
+        Whether to skip the cache for this call. Ends the bypass once its probation is over.
+        """
+        decision = self.decision
+        if not decision.bypass:
+            return False
+        if time() - decision.decided_at < self.policy.bypass_probation:
+            return True
+
+        self.stats.reset()
+        self.decision = Decision(timeout=self.configured_timeout, reason='bypass probation over')
+        return False
+
+    def _maybe_reevaluate(self):
+        reads = self.stats.reads
+        if reads >= self.policy.min_samples and reads % self.policy.reevaluate_every == 0:
+            self.reevaluate()
+
+    def reevaluate(self):
+        self.decision = self.policy.decide(self.stats, self.configured_timeout)
+        return self.decision
+
+    def describe(self):
+        return dict(name=self.name, generations=self.generations, configured_timeout=self.configured_timeout,
+                    stats=self.stats.as_dict(), decision=self.decision.as_dict())
+
+
+_states = []
+_states_by_generation = dict()
+_lock = threading.Lock()
+
+
+def register(state):
+    with _lock:
+        _states.append(state)
+        for generation in state.generations:
+            _states_by_generation.setdefault(generation, []).append(state)
+
+
+def record_invalidation(generation):
+    """
+    Called on every gen_cache.invalidate, to count invalidations per adaptive function.
+    """
+    for state in _states_by_generation.get(generation, ()):
+        state.record_invalidation()
+
+
+def describe():
+    """
+    Returns the stats and current decision of every adaptive function, by name.
+    """
+    with _lock:
+        states = list(_states)
+    return dict((state.name, state.describe()) for state in states)
@@ -0,0 +1,94 @@
+"""
+Micro-batches the gets of concurrent threads: lookups (get and get_many) arriving within a short
+window are merged into a single get_many on the backend, and the results handed back to each
+waiting thread. Trades up to `window` seconds of added latency per lookup for far fewer round
+trips (syscalls, packets) in highly threaded processes.
+
+    from hscacheutils import raw_cache
+
+    raw_cache.install_batching_client(window=0.0005, max_batch=200)
+
+Or set RAW_CACHE_BATCHING to a dict of those keyword arguments in your settings.
+
+The first thread to look something up leads the batch: it waits for the window to pass (or for
+max_batch keys to be collected) and then fetches every key for everybody. Everything but get and
+get_many goes straight to the backend. Batches and batched lookups are counted in
+hscacheutils.metrics as "batching.batches" and "batching.lookups".
+"""
+
+import threading
+
+from hscacheutils import metrics
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.keys = set()
+        self.lookups = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchingCache(object):
+
+    def __init__(self, backend, window=0.0005, max_batch=200):
+        self.backend = backend
+        self.window = window
+        self.max_batch = max_batch
+        self._current = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Anything but lookups goes straight to the backend
+        return getattr(self.backend, name)
+
+    def get(self, key, default=None):
+        value = self.get_many([key]).get(key)
+        if value is None:
+            return default
+        return value
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+
+        with self._lock:
+            batch = self._current
+            leader = batch is None
+            if leader:
+                batch = self._current = _Batch()
+
+            batch.keys.update(keys)
+            batch.lookups += 1
+            if len(batch.keys) >= self.max_batch:
+                # Closed to newcomers, they start the next one
+                self._current = None
+                batch.full.set()
+
+        if leader:
+            self._fetch(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return dict((key, batch.result[key]) for key in keys if batch.result.get(key) is not None)
+
+    def _fetch(self, batch):
+        batch.full.wait(self.window)
+        with self._lock:
+            if self._current is batch:
+                self._current = None
+
+        metrics.incr('batching.batches')
+        metrics.incr('batching.lookups', batch.lookups)
+        try:
+            batch.result = self.backend.get_many(list(batch.keys))
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
@@ -0,0 +1,178 @@
+"""
+A circuit breaker (with per-operation latency budgets) around the raw cache backend calls made
+by the generational cache, so that a slow or dead memcache degrades us to uncached speed
+instead of making every request wait on it.
+
+    from hscacheutils.circuit_breaker import CircuitBreaker, install_circuit_breaker
+
+    install_circuit_breaker(CircuitBreaker(
+        failure_threshold=5,       # consecutive failures before the breaker opens
+        reset_timeout=10,          # seconds before letting a trial call through again
+        budgets={'get': 0.02, 'get_many': 0.05},   # calls slower than this count as failures
+        local_copies=1000))        # keep recent gen_cache.wrap results to serve while open
+
+Or set GEN_CACHE_CIRCUIT_BREAKER to a dict of those keyword arguments in your settings.
+
+While the breaker is open, gen_cache.wrap'd functions skip the cache entirely and are computed
+directly (or a recent local copy of their result is served, if local_copies is set),
+gen_cache.get returns None and gen_cache.set/delete do nothing. Invalidations are always
+attempted, since dropping them would serve stale data once the cache is back.
+
+A call can't be interrupted once it has started, so budgets only decide whether a call counts
+as a failure. Pair them with socket timeouts on the memcache client to bound the slowest call.
+
+Trips and the rest are counted in hscacheutils.metrics under "circuit_breaker.*".
+"""
+
+import logging
+import threading
+
+from time import time
+
+from hscacheutils import metrics
+from hscacheutils.local_cache import LocalLRUCache
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CacheUnavailable(Exception):
+    """
+    Raised by CircuitBreaker.call when the breaker is open or the backend call failed.
+    """
+    pass
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=5, reset_timeout=10, budgets=None, local_copies=0,
+                 local_copy_timeout=300):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budgets = dict(budgets or {})
+
+        self.local_copies = None
+        if local_copies:
+            self.local_copies = LocalLRUCache(max_items=local_copies, default_timeout=local_copy_timeout)
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """
+        Whether a backend call may be made right now. When the reset timeout has passed on an
+        open breaker, a single trial call is let through (the half open state).
+        """
+        if self.state == CLOSED:
+            return True
+
+        with self._lock:
+            if self.state == OPEN and time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+
+        metrics.incr('circuit_breaker.rejected')
+        return False
+
+    def call(self, op, func, *args, **kwargs):
+        """
+        Calls func (the backend's `op` method) through the breaker, raising CacheUnavailable
+        instead of calling it when the breaker is open, or when it raised an error.
+        """
+        if not self.allow_request():
+            raise CacheUnavailable("Circuit breaker is open, skipping cache %s" % op)
+
+        start = time()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record_failure()
+            metrics.incr('circuit_breaker.errors')
+            logging.warning("Cache %s failed: %s" % (op, e))
+            raise CacheUnavailable("Cache %s failed: %s" % (op, e))
+
+        budget = self.budgets.get(op)
+        if budget is not None and time() - start > budget:
+            metrics.incr('circuit_breaker.slow_calls')
+            self.record_failure()
+        else:
+            self.record_success()
+
+        return result
+
+    def record_success(self):
+        if self.state == CLOSED and not self.consecutive_failures:
+            return
+
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("Cache circuit breaker closed")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time()
+                self._trial_in_flight = False
+                metrics.incr('circuit_breaker.trips')
+                logging.warning("Cache circuit breaker opened after %s failures" % self.consecutive_failures)
+
+    def remember(self, key, value):
+        if self.local_copies is not None:
+            self.local_copies.set(key, value)
+
+    def recall(self, key):
+        """
+        Returns a recent local copy for key (or None).
+        """
+        if self.local_copies is None:
+            return None
+
+        value = self.local_copies.get(key)
+        if value is not None:
+            metrics.incr('circuit_breaker.local_copies_served')
+        return value
+
+
+_circuit_breaker = None
+
+
+def install_circuit_breaker(breaker):
+    """
+    Installs the breaker used for all generational cache backend calls (None to remove it),
+    returning the previous one.
+    """
+    global _circuit_breaker
+    previous, _circuit_breaker = _circuit_breaker, breaker
+    return previous
+
+
+def current_circuit_breaker():
+    return _circuit_breaker
+
+
+def _install_from_settings():
+    breaker_kwargs = get_setting_default('GEN_CACHE_CIRCUIT_BREAKER', None)
+    if breaker_kwargs:
+        install_circuit_breaker(CircuitBreaker(**breaker_kwargs))
+
+_install_from_settings()
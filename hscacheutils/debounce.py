@@ -0,0 +1,169 @@
+"""
+Debounces noisy generation invalidations. For a generation with a minimum interval, the first
+invalidation is done right away and any others within the interval are coalesced into a
+single trailing invalidation, done when the interval is over. So a value is never served more
+than the interval after it was invalidated, however many times the generation gets bumped.
+
+    gen_cache.debounce_invalidations('contacts_import:portal_id', 0.5)
+
+Or in your settings:
+
+    GEN_CACHE_INVALIDATION_DEBOUNCE = {'contacts_import:portal_id': 0.5}
+
+Debouncing is per process (each process coalesces the invalidations it makes). Trailing
+invalidations are done by a single scheduler thread, and flushed at exit (atexit), so a job
+exiting right after its last burst of invalidations doesn't drop the trailing one. Absorbed and
+trailing invalidations are counted in hscacheutils.metrics under "invalidation_debounce.*".
+"""
+
+import atexit
+import heapq
+import logging
+import os
+import threading
+
+from time import time
+
+from hscacheutils import metrics
+
+
+class _Pending(object):
+    __slots__ = ('last_invalidated_at', 'due_at', 'generation', 'kwargs')
+
+    def __init__(self, last_invalidated_at):
+        self.last_invalidated_at = last_invalidated_at
+        self.due_at = None  # when a trailing invalidation is scheduled
+        self.generation = None
+        self.kwargs = None
+
+
+class InvalidationDebouncer(object):
+    """
+    invalidate_now is what actually bumps a generation, called with (generation, **kwargs).
+    """
+
+    def __init__(self, invalidate_now, intervals=None):
+        self.invalidate_now = invalidate_now
+        self.intervals = dict(intervals or {})
+        self._pending = dict()
+        self._schedule = []  # heap of (due_at, key)
+        self._condition = threading.Condition(threading.Lock())
+        self._scheduler = None
+        self._scheduler_pid = None
+        self._stopped = False
+        atexit.register(self._shutdown)
+
+    def set_interval(self, generation, min_interval):
+        """
+        Sets the minimum interval (in seconds) between two invalidations of generation (None or
+        0 to stop debouncing it).
+        """
+        if min_interval:
+            self.intervals[generation] = min_interval
+        else:
+            self.intervals.pop(generation, None)
+
+    def invalidate(self, generation, key, **kwargs):
+        """
+        Invalidates generation (whose full generation key is key) now, or later if it was
+        invalidated less than its interval ago. Returns whatever invalidate_now returned, or None
+        if the invalidation was deferred.
+        """
+        interval = self.intervals.get(generation)
+        if not interval:
+            return self.invalidate_now(generation, **kwargs)
+
+        now = time()
+        with self._condition:
+            pending = self._pending.get(key)
+
+            if pending is None or (pending.due_at is None and now - pending.last_invalidated_at >= interval):
+                self._pending[key] = _Pending(now)
+                defer = False
+            else:
+                defer = True
+                pending.generation = generation
+                pending.kwargs = kwargs
+                if pending.due_at is None:
+                    pending.due_at = pending.last_invalidated_at + interval
+                    heapq.heappush(self._schedule, (pending.due_at, key))
+                    self._ensure_scheduler()
+                    self._condition.notify()
+
+        if defer:
+            metrics.incr('invalidation_debounce.absorbed')
+            return None
+
+        return self.invalidate_now(generation, **kwargs)
+
+    def _ensure_scheduler(self):
+        # Must be called with the lock held. Threads don't survive a fork, hence the pid
+        if self._scheduler_pid != os.getpid():
+            self._scheduler_pid = os.getpid()
+            self._scheduler = threading.Thread(target=self._run_scheduler, name='hscacheutils-invalidation-debounce')
+            self._scheduler.daemon = True
+            self._scheduler.start()
+
+    def _run_scheduler(self):
+        while True:
+            with self._condition:
+                while not self._stopped and (not self._schedule or self._schedule[0][0] > time()):
+                    self._condition.wait(self._schedule[0][0] - time() if self._schedule else None)
+                if self._stopped:
+                    return
+                due_at, key = heapq.heappop(self._schedule)
+                due = self._take(key, due_at)
+
+            if due is not None:
+                self._trailing_invalidate(key, *due)
+                self._forget_old(time())
+
+    def _take(self, key, due_at=None):
+        """
+        Returns the (generation, kwargs) of the trailing invalidation of key, marking it done, or
+        None if there is none (or it isn't the one due at due_at anymore). Called with the lock held.
+        """
+        pending = self._pending.get(key)
+        if pending is None or pending.due_at is None or (due_at is not None and pending.due_at != due_at):
+            return None
+        pending.due_at = None
+        pending.last_invalidated_at = time()
+        return pending.generation, pending.kwargs
+
+    def _trailing_invalidate(self, key, generation, kwargs):
+        metrics.incr('invalidation_debounce.trailing')
+        try:
+            self.invalidate_now(generation, **kwargs)
+        except Exception:
+            logging.exception("Error doing the trailing invalidation of %s" % key)
+
+    def _forget_old(self, now):
+        # Keeps the pending dict from growing forever with dynamic generations
+        with self._condition:
+            if len(self._pending) < 1000:
+                return
+            longest = max(self.intervals.values() or [0])
+            for key, pending in self._pending.items():
+                if pending.due_at is None and now - pending.last_invalidated_at > longest:
+                    del self._pending[key]
+
+    def _shutdown(self):
+        # At exit: the trailing invalidations are done now, and the scheduler stopped before the
+        # interpreter tears down the modules it uses
+        self.flush()
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._scheduler is not None and self._scheduler_pid == os.getpid():
+            self._scheduler.join(1)
+
+    def flush(self):
+        """
+        Does every deferred invalidation right away (eg. in tests, it's done at exit already).
+        """
+        with self._condition:
+            to_flush = [(key, self._take(key)) for key in self._pending.keys()]
+
+        for key, due in to_flush:
+            if due is not None:
+                self._trailing_invalidate(key, *due)
@@ -0,0 +1,89 @@
+"""
+Dependency tracking for nested wrapped calls (opt in with gen_cache.wrap(..., track_dependencies=True)).
+
+While a tracked function computes its value, the generations consumed by the wrapped calls it
+makes (and by gen_cache.get, CustomUseGenCache, etc) are recorded, and stored along with its
+value. Reading the value back checks those generations in one batched fetch, and treats the
+value as a miss if any of them was bumped since. So the outer function only needs to list its
+own, coarse, generations:
+
+    @gen_cache.wrap('contact:contact_id')
+    def get_contact(contact_id):
+        ...
+
+    @gen_cache.wrap('contacts_portal:portal_id', track_dependencies=True)
+    def get_dashboard(portal_id, contact_ids):
+        return [get_contact(contact_id) for contact_id in contact_ids]
+
+    # Also invalidates the dashboards that used contact 53
+    gen_cache.invalidate('contact:contact_id', contact_id=53)
+
+Dependencies carry over: a tracked value read inside another tracked function adds its own
+dependencies to the outer one's. Stale dependencies are counted in hscacheutils.metrics as
+"dependencies.stale".
+"""
+
+import threading
+
+
+class DependentValue(object):
+    """
+    What's cached for a tracked function: its value, and the (generation suffix, affinity,
+    generation value) tuples it was computed from.
+    """
+
+    def __init__(self, value, dependencies):
+        self.value = value
+        self.dependencies = dependencies
+
+
+_local = threading.local()
+
+
+def _collectors():
+    if not hasattr(_local, 'collectors'):
+        _local.collectors = []
+    return _local.collectors
+
+
+def start():
+    """
+    Starts collecting the generations consumed in this thread (nested in the current
+    collections, if any).
+    """
+    collector = dict()
+    _collectors().append(collector)
+    return collector
+
+
+def stop(collector):
+    """
+    Stops collector (the innermost one), returning the (suffix, affinity, value) tuples it collected.
+    """
+    collectors = _collectors()
+    # By identity, nested collectors often are equal
+    if not collectors or collectors[-1] is not collector:
+        raise ValueError("Stopping a collector that isn't the innermost one")
+    collectors.pop()
+    return tuple((suffix, affinity, value) for (suffix, affinity), value in collector.items())
+
+
+def record(gen_values, affinity=None):
+    """
+    Records a dict of generation suffix => value (with its affinity) in every active collector.
+    """
+    collectors = _collectors()
+    if not collectors:
+        return
+    for collector in collectors:
+        for suffix, value in gen_values.items():
+            collector[(suffix, affinity)] = value
+
+
+def record_dependencies(dependencies):
+    """
+    Records the dependencies of a tracked value read while collecting.
+    """
+    for collector in _collectors():
+        for suffix, affinity, value in dependencies:
+            collector[(suffix, affinity)] = value
@@ -0,0 +1,162 @@
+"""
+Conditional responses for django views, from their generations: a view declares the
+generations its response depends on, and gets an ETag derived from their current values (plus
+the view, its url and arguments). Requests revalidating with a matching If-None-Match are
+answered 304 before the view runs, and with cache_response=True the whole response is served
+from the cache until one of the generations is invalidated.
+
+    from hscacheutils.etag import generation_etag
+
+    @generation_etag('cms', 'cms_portal:portal_id', cache_response=True, timeout=600)
+    def page(request, portal_id, page_id):
+        ...
+
+Dynamic generations take their parameter from the view's keyword arguments. Responses that
+depend on anything else (the user, cookies, headers) need it in vary_on, a function of the
+request returning what to add to the key:
+
+    @generation_etag('contacts_portal:portal_id', vary_on=lambda request: request.user.id)
+
+Views you can't decorate can be declared in the GEN_CACHE_ETAG_VIEWS setting (dotted view name
+=> keyword arguments, including 'generations') when 'hscacheutils.etag.GenerationETagMiddleware'
+is in your MIDDLEWARE_CLASSES:
+
+    GEN_CACHE_ETAG_VIEWS = {
+        'cms.views.page': {'generations': ['cms', 'cms_portal:portal_id'], 'cache_response': True},
+    }
+
+Only GET and HEAD requests are handled, and only 200 responses get an ETag (or are cached). Not
+modified responses and cached responses are counted in hscacheutils.metrics as
+"etag.not_modified" and "etag.response_hits".
+"""
+
+from hashlib import md5
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.functional import wraps
+
+from hscacheutils import metrics
+from hscacheutils.circuit_breaker import CacheUnavailable
+from hscacheutils.generational_cache import _cache_call, gen_cache
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+def parse_if_none_match(header):
+    """
+    Returns the (unquoted, weak or not) entity tags of an If-None-Match header.
+    """
+    etags = []
+    for etag in header.split(','):
+        etag = etag.strip()
+        if etag.startswith('W/'):
+            etag = etag[2:]
+        etags.append(etag.strip('"'))
+    return etags
+
+
+class GenerationETag(object):
+
+    def __init__(self, generations, cache_response=False, timeout=300, vary_on=None):
+        self.generations = list(generations)
+        self.cache_response = cache_response
+        self.timeout = timeout
+        self.vary_on = vary_on
+
+    def build_key(self, view, request, args, kwargs):
+        add_to_key = ['etag', '%s.%s' % (view.__module__, view.__name__), request.get_full_path()]
+        add_to_key.extend(repr(arg) for arg in args)
+        add_to_key.extend('%s=%r' % item for item in sorted(kwargs.items()))
+        if self.vary_on is not None:
+            add_to_key.append(repr(self.vary_on(request)))
+        return gen_cache.build_key(*self.generations, add_to_key=tuple(add_to_key), **kwargs)
+
+    def respond(self, view, request, args, kwargs):
+        """
+        Answers the request, with a 304 or a cached response if possible, or by calling the view.
+        """
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+
+        try:
+            key = self.build_key(view, request, args, kwargs)
+        except CacheUnavailable:
+            return view(request, *args, **kwargs)
+        etag = md5(key).hexdigest()
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (etag in parse_if_none_match(if_none_match) or if_none_match.strip() == '*'):
+            metrics.incr('etag.not_modified')
+            response = HttpResponseNotModified()
+            response['ETag'] = '"%s"' % etag
+            return response
+
+        if self.cache_response:
+            try:
+                cached = _cache_call('get', key)
+            except CacheUnavailable:
+                cached = None
+            if cached is not None:
+                metrics.incr('etag.response_hits')
+                return self._unpack(cached)
+            metrics.incr('etag.response_misses')
+
+        response = view(request, *args, **kwargs)
+        if response.status_code != 200 or getattr(response, 'streaming', False):
+            return response
+
+        response['ETag'] = '"%s"' % etag
+        if self.cache_response:
+            try:
+                _cache_call('set', key, self._pack(response), self.timeout)
+            except CacheUnavailable:
+                pass
+        return response
+
+    def _pack(self, response):
+        return (response.status_code, response.content, response.items())
+
+    def _unpack(self, packed):
+        status_code, content, headers = packed
+        response = HttpResponse(content, status=status_code)
+        for header, value in headers:
+            response[header] = value
+        return response
+
+
+def generation_etag(*generations, **options):
+    """
+    Decorates a view to answer with ETags derived from generations (see the module docstring).
+    Takes the keyword arguments of GenerationETag.
+    """
+    etag = GenerationETag(generations, **options)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return etag.respond(view, request, args, kwargs)
+
+        wrapper.generation_etag = etag
+        return wrapper
+    return decorator
+
+
+class GenerationETagMiddleware(object):
+    """
+    Handles the views declared in the GEN_CACHE_ETAG_VIEWS setting.
+    """
+
+    def __init__(self):
+        self.etags = dict()
+        for view_name, options in get_setting_default('GEN_CACHE_ETAG_VIEWS', {}).items():
+            options = dict(options)
+            self.etags[view_name] = GenerationETag(options.pop('generations'), **options)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        etag = self.etags.get('%s.%s' % (view_func.__module__, view_func.__name__))
+        if etag is None:
+            return None
+        return etag.respond(view_func, request, view_args, view_kwargs)
@@ -0,0 +1,203 @@
+"""
+An in-process stand-in for a redis server (and a redis-py StrictRedis client talking to it), so
+that hscacheutils.redis_cache can be tested without redis.
+
+Supports the commands RedisCache uses: get, mget, set (with ex, px, nx and xx), delete, exists,
+incrby, flushdb, non-transactional and transactional pipelines, and lua scripts. Since there is
+no lua interpreter here, scripts have to be registered with a python emulation, called with
+(client, keys, args) while the whole store is locked (so they are atomic, like real scripts):
+
+    client = FakeRedis()
+    script = client.register_emulated_script(LUA_SOURCE, python_emulation)
+    script(keys=['a'], args=[1])
+
+    from hscacheutils.redis_cache import RedisCache
+    cache = RedisCache(client=FakeRedis())
+
+Like redis-py, values come back as (byte) strings, and missing keys as None.
+"""
+
+import threading
+
+from hashlib import sha1
+from time import time
+
+
+class FakeRedis(object):
+
+    def __init__(self):
+        self._data = dict()
+        self._expires_at = dict()
+        self._lock = threading.RLock()
+        self._scripts = dict()
+        self.commands = 0
+
+    def _live(self, key):
+        expires_at = self._expires_at.get(key)
+        if expires_at is not None and expires_at <= time():
+            self._data.pop(key, None)
+            del self._expires_at[key]
+        return self._data.get(key)
+
+    def _count(self):
+        self.commands += 1
+
+    def get(self, name):
+        with self._lock:
+            self._count()
+            return self._live(name)
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args)
+        with self._lock:
+            self._count()
+            return [self._live(key) for key in keys]
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        with self._lock:
+            self._count()
+            exists = self._live(name) is not None
+            if (nx and exists) or (xx and not exists):
+                return None
+
+            self._data[name] = str(value)
+            if ex is not None:
+                self._expires_at[name] = time() + ex
+            elif px is not None:
+                self._expires_at[name] = time() + px / 1000.0
+            else:
+                self._expires_at.pop(name, None)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            self._count()
+            deleted = 0
+            for name in names:
+                if self._live(name) is not None:
+                    deleted += 1
+                self._data.pop(name, None)
+                self._expires_at.pop(name, None)
+            return deleted
+
+    def exists(self, name):
+        with self._lock:
+            self._count()
+            return self._live(name) is not None
+
+    def incrby(self, name, amount=1):
+        with self._lock:
+            self._count()
+            current = self._live(name)
+            try:
+                value = int(current or 0) + amount
+            except ValueError:
+                raise ResponseError("value is not an integer or out of range")
+            self._data[name] = str(value)
+            return value
+
+    def incr(self, name, amount=1):
+        return self.incrby(name, amount)
+
+    def flushdb(self):
+        with self._lock:
+            self._count()
+            self._data.clear()
+            self._expires_at.clear()
+            return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self, transaction)
+
+    def register_emulated_script(self, source, emulation):
+        script = FakeScript(self, source, emulation)
+        self._scripts[script.sha] = script
+        return script
+
+    def register_script(self, source):
+        raise NotImplementedError("FakeRedis can't run lua, use register_emulated_script")
+
+    def _run_script(self, script, keys, args):
+        with self._lock:
+            self._count()
+            return script.emulation(_UncountedClient(self), list(keys), list(args))
+
+
+class _UncountedClient(object):
+    """
+    What emulated scripts get as their client: the commands they run are part of the single
+    script call, not round trips of their own.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def uncounted(*args, **kwargs):
+            result = method(*args, **kwargs)
+            self._client.commands -= 1
+            return result
+        return uncounted
+
+
+class ResponseError(Exception):
+    pass
+
+
+class FakeScript(object):
+
+    def __init__(self, client, source, emulation):
+        self.registered_client = client
+        self.source = source
+        self.sha = sha1(source).hexdigest()
+        self.emulation = emulation
+
+    def __call__(self, keys=[], args=[], client=None):
+        if client is None:
+            client = self.registered_client
+        if isinstance(client, FakePipeline):
+            client._queue(lambda: self.registered_client._run_script(self, keys, args))
+            return client
+        return client._run_script(self, keys, args)
+
+
+class FakePipeline(object):
+    """
+    Queues commands and runs them all (as a single round trip) on execute.
+    """
+
+    def __init__(self, client, transaction=True):
+        self._client = client
+        self.transaction = transaction
+        self._commands = []
+
+    def _queue(self, command):
+        self._commands.append(command)
+        return self
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+
+        def queued(*args, **kwargs):
+            return self._queue(lambda: method(*args, **kwargs))
+        return queued
+
+    def execute(self):
+        commands, self._commands = self._commands, []
+        client = self._client
+        with client._lock:
+            results = [command() for command in commands]
+            # One round trip for the whole pipeline
+            client.commands -= len(commands) - 1 if commands else 0
+        return results
+
+    def reset(self):
+        self._commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
@@ -0,0 +1,201 @@
+"""
+Pluggable generation values: how new generations are initialized, and how their values are
+written in value keys.
+
+Generations start off as microseconds since 1970 (MicrosecondValues, the default): wide (16
+digits), and two hosts initializing a generation in the same microsecond (or with skewed clocks)
+can mint the same value. A HybridLogicalClock instead packs, into a 63 bit integer (so that
+memcached can still incr it):
+
+    | milliseconds since 2024-01-01 (41 bits) | logical counter (4) | host id (10) | bumps (8) |
+
+The clock never goes backwards, even if the host's clock does (the logical counter and, when
+exhausted, the milliseconds move forward instead), and it moves past the generation values this
+process reads, so a host with a lagging clock still mints values newer than the ones it has seen.
+The host id keeps hosts minting at the same moment apart, and invalidations increment the low
+bits. Set GEN_CACHE_HOST_ID to a distinct 0-1023 id per process: otherwise it's derived from the
+hostname and process id, which is best effort only (with a few hundred processes, some will share
+an id), and a warning is logged.
+
+    GEN_CACHE_GENERATION_VALUES = 'hlc'        # or 'microseconds', the default
+    GEN_CACHE_COMPACT_GENERATION_KEYS = True   # base36 values in keys (12 characters instead of 19)
+
+Or from code, with generation_values.set_scheme(HybridLogicalClock(compact=True)).
+
+Migrating: existing (microsecond) generations keep their values and are incremented as usual,
+only new generations get clock values. Clock values (minted after mid 2024) are all above
+2 ** 56, while microsecond values stay far below it, so both can be told apart (see describe)
+and never collide. Switching schemes doesn't change any key, turning compact keys on (or off)
+changes them all once, like bumping every generation. Keys resolved server side (see
+redis_cache.RedisCache.get_with_generations) keep decimal values.
+"""
+
+import logging
+import os
+import socket
+import threading
+import zlib
+
+from time import time
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+MICROSECONDS = 'microseconds'
+HLC = 'hlc'
+
+# 2024-01-01 00:00:00 UTC, in milliseconds
+EPOCH_MS = 1704067200000
+
+PHYSICAL_BITS = 41
+LOGICAL_BITS = 4
+HOST_BITS = 10
+BUMP_BITS = 8
+
+# Microsecond values are below this, clock values above it
+LEGACY_LIMIT = 1 << 56
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def base36(value):
+    if value < 0:
+        return '-' + base36(-value)
+    digits = []
+    while True:
+        value, digit = divmod(value, 36)
+        digits.append(_DIGITS[digit])
+        if not value:
+            return ''.join(reversed(digits))
+
+
+def describe(value):
+    """
+    What a generation value is made of, as a dict (with a 'scheme' of MICROSECONDS or HLC).
+    """
+    value = int(value)
+    if value < LEGACY_LIMIT:
+        return dict(scheme=MICROSECONDS, timestamp=value / 1000000.0)
+
+    bumps = value & ((1 << BUMP_BITS) - 1)
+    host_id = (value >> BUMP_BITS) & ((1 << HOST_BITS) - 1)
+    logical = (value >> (BUMP_BITS + HOST_BITS)) & ((1 << LOGICAL_BITS) - 1)
+    physical = value >> (BUMP_BITS + HOST_BITS + LOGICAL_BITS)
+    return dict(scheme=HLC, timestamp=(physical + EPOCH_MS) / 1000.0, logical=logical, host_id=host_id,
+                bumps=bumps)
+
+
+class MicrosecondValues(object):
+    """
+    Microseconds since 1970. The generation would have to be incremented a million times in
+    order to collide with a generation invalidation that happened a second later.
+    """
+
+    def __init__(self, compact=False):
+        self.compact = compact
+
+    def new_value(self):
+        return int(time() * 1000000)
+
+    def observe(self, values):
+        pass
+
+    def key_value(self, value):
+        """
+        How value is written in value keys.
+        """
+        if self.compact and isinstance(value, (int, long)):
+            return base36(value)
+        return value
+
+
+class HybridLogicalClock(MicrosecondValues):
+
+    def __init__(self, compact=False, host_id=None):
+        super(HybridLogicalClock, self).__init__(compact)
+        self._host_id = host_id
+        self._host_pid = None
+        self.physical = 0
+        self.logical = 0
+        self._lock = threading.Lock()
+
+    @property
+    def host_id(self):
+        if self._host_id is not None:
+            return self._host_id
+        # Forked processes get their own
+        if self._host_pid != os.getpid():
+            self._host_pid = os.getpid()
+            self._derived_host_id = zlib.crc32('%s:%s' % (socket.gethostname(), self._host_pid)) % (1 << HOST_BITS)
+        return self._derived_host_id
+
+    def new_value(self):
+        now = int(time() * 1000) - EPOCH_MS
+        with self._lock:
+            if now > self.physical:
+                self.physical, self.logical = now, 0
+            else:
+                self.logical += 1
+                if self.logical >= 1 << LOGICAL_BITS:
+                    self.physical, self.logical = self.physical + 1, 0
+            physical, logical = self.physical, self.logical
+
+        return (((physical << LOGICAL_BITS | logical) << HOST_BITS | self.host_id) << BUMP_BITS)
+
+    def observe(self, values):
+        """
+        Moves the clock past the (clock) generation values read from the cache.
+        """
+        latest = None
+        for value in values:
+            if isinstance(value, (int, long)) and value >= LEGACY_LIMIT and (latest is None or value > latest):
+                latest = value
+        if latest is None:
+            return
+
+        physical = latest >> (BUMP_BITS + HOST_BITS + LOGICAL_BITS)
+        logical = (latest >> (BUMP_BITS + HOST_BITS)) & ((1 << LOGICAL_BITS) - 1)
+        with self._lock:
+            if (physical, logical) > (self.physical, self.logical):
+                self.physical, self.logical = physical, logical
+
+
+_scheme = None
+_lock = threading.Lock()
+
+
+def _scheme_from_settings():
+    name = get_setting_default('GEN_CACHE_GENERATION_VALUES', MICROSECONDS)
+    compact = get_setting_default('GEN_CACHE_COMPACT_GENERATION_KEYS', False)
+    if name == MICROSECONDS:
+        return MicrosecondValues(compact=compact)
+    if name == HLC:
+        host_id = get_setting_default('GEN_CACHE_HOST_ID', None)
+        if host_id is None:
+            logging.warning("GEN_CACHE_HOST_ID isn't set, hybrid logical clock host ids derived from the "
+                            "hostname and process id can collide across processes")
+        return HybridLogicalClock(compact=compact, host_id=host_id)
+    raise ValueError("Unknown GEN_CACHE_GENERATION_VALUES %r (expected %r or %r)" % (name, MICROSECONDS, HLC))
+
+
+def current_scheme():
+    global _scheme
+    if _scheme is None:
+        with _lock:
+            if _scheme is None:
+                _scheme = _scheme_from_settings()
+    return _scheme
+
+
+def set_scheme(scheme):
+    """
+    Installs a new scheme (None to go back to the settings), returning the previous one. A scheme
+    has new_value(), observe(values) and key_value(value) methods, see MicrosecondValues.
+    """
+    global _scheme
+    previous = _scheme
+    _scheme = scheme
+    return previous
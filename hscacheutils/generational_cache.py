@@ -9,7 +9,13 @@ from django.utils.encoding import smart_str
 from cache_utils.utils import _cache_key, _func_info
 from cache_utils.utils import sanitize_memcached_key as orig_sanitize_memcached_key
 
-from hscacheutils.raw_cache import cache as raw_cache, MAX_MEMCACHE_TIMEOUT
+from hscacheutils.raw_cache import cache as raw_cache, generation_cache, get_backend as get_raw_cache_backend, MAX_MEMCACHE_TIMEOUT
+from hscacheutils.circuit_breaker import CacheUnavailable, current_circuit_breaker
+from hscacheutils import adaptive, dependencies, generation_values, immutable as immutable_values, metrics, paging, registry, request_tracing, trace
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.debounce import InvalidationDebouncer
+from hscacheutils.affinity import affine_key
+from hscacheutils.dependencies import DependentValue
 
 try:
     from hubspot.hsutils import get_setting_default
@@ -20,6 +26,58 @@ except ImportError:
 def in_gen_cache_debug_mode():
     return get_setting_default('DEBUG_GENERATIONAL_CACHE', False)
 
+def _backend_method(cache, op):
+    """
+    cache.<op>, recording its calls if the current request is traced (see request_tracing).
+    """
+    method = getattr(cache, op)
+    tracer = request_tracing.current_tracer()
+    if tracer is not None:
+        method = tracer.wrap(op, method)
+    return method
+
+def _cache_call(op, *args, **kwargs):
+    """
+    Calls raw_cache.<op>, through the circuit breaker if one is installed (in which case
+    CacheUnavailable is raised when the breaker is open or the call failed).
+    """
+    breaker = current_circuit_breaker()
+    if breaker is None:
+        return _backend_method(raw_cache, op)(*args, **kwargs)
+    return breaker.call(op, _backend_method(raw_cache, op), *args, **kwargs)
+
+def _resolves_generations_server_side():
+    """
+    Whether the raw_cache backend can resolve the generations of a wrapped call and fetch its
+    value in a single round trip (eg. redis_cache.RedisCache, unless resolve_generations=False).
+    Only when generations aren't stored separately. Looked up on the class, so that wrappers
+    delegating everything with __getattr__ (eg. TieredCache) aren't mistaken for it.
+    """
+    backend = get_raw_cache_backend()
+    return generation_cache._backend is None and \
+        getattr(type(backend), 'get_with_generations', None) is not None and \
+        getattr(backend, 'resolve_generations', True)
+
+def _generation_backend_has(op):
+    """
+    Whether the backend holding the generation keys implements op. Looked up on the class of the
+    backend at the end of the chain of wrappers (BatchingCache, TieredCache, which keep the one
+    they wrap in .backend and forward op to it), eg. the AffineCache behind them.
+    """
+    backend = generation_cache._backend if generation_cache._backend is not None else get_raw_cache_backend()
+    while getattr(backend, '__dict__', {}).get('backend') is not None:
+        backend = backend.backend
+    return getattr(type(backend), op, None) is not None
+
+def _generation_cache_call(op, *args, **kwargs):
+    """
+    Same as _cache_call, for the cache holding the generation keys.
+    """
+    breaker = current_circuit_breaker()
+    if breaker is None:
+        return _backend_method(generation_cache, op)(*args, **kwargs)
+    return breaker.call(op, _backend_method(generation_cache, op), *args, **kwargs)
+
 # Take from cache_utils and extended (new check for klass and Klass)
 # Relying on the name of an agument to determine the type of
 # function is quite fragile, but still I think it is a good heruristic
@@ -42,15 +100,42 @@ def _func_type(func):
 # Used mostly for debugging sake to make sure we are actually talking
 # to the memcache boxes that we think we should be talking to.
 def current_raw_caching_servers():
-    return raw_cache.__dict__['_servers']
+    return get_raw_cache_backend().__dict__['_servers']
+
+
+class GenCacheNamespaceCollision(Exception):
+    pass
+
+
+# namespace => "module.function" of the wrapped function using it
+_wrapped_namespaces = dict()
+
+
+def register_namespace(namespace, func):
+    """
+    Makes sure no two wrapped functions share a namespace (they would share cache keys). Since
+    functions are wrapped at import time, collisions are caught at startup.
+    """
+    owner = '%s.%s' % (func.__module__, func.__name__)
+    existing_owner = _wrapped_namespaces.setdefault(namespace, owner)
+
+    # The same function being wrapped again (eg. a reloaded module) is fine
+    if existing_owner != owner:
+        raise GenCacheNamespaceCollision("Both %s and %s use the gen_cache namespace %r" % (existing_owner, owner, namespace))
 
 
 class GenCachedBuilder(object):
 
-    def __init__(self, timeout, generations, exclude=None):
+    def __init__(self, timeout, generations, exclude=None, namespace=None, version=None, affinity=None):
         self.timeout = timeout
         self.generations = generations
         self.exclude = set(exclude or [])
+        self.namespace = namespace
+        self.version = version
+        self.affinity = affinity
+
+        if version is not None and namespace is None:
+            raise TypeError("A version can only be used along with a namespace")
 
         # Gather all the dynamic generational args (eg. "cms:user_id")
         self.dynamic_gen_tuples = [parse_generation(gen) for gen in self.generations if ':' in gen]
@@ -68,6 +153,13 @@ class GenFuncHelper(object):
         self.builder = builder
         self.func = func
 
+        if builder.namespace is not None:
+            register_namespace(builder.namespace, func)
+            if builder.version is None:
+                self._full_name = builder.namespace
+            else:
+                self._full_name = '%s:v%s' % (builder.namespace, builder.version)
+
         self.func_type = _func_type(func)
         self.arg_names, self.varargs_name, self.keywords_name, self.defaults = getargspec(func)
         self.num_specced_args = len(self.arg_names)
@@ -90,10 +182,28 @@ class GenFuncHelper(object):
             name, _args = _func_info(self.func, args)
             self._full_name = name
 
-    def build_wrapped_cache_key_with_generations(self, args, kwargs):
+    def all_args_by_name(self, args, kwargs):
+        # Capture all args by name, including the positional ones (via argspec)
+        all_args_by_name = dict(zip(self.arg_names, args))
+        all_args_by_name.update(kwargs)
+        return all_args_by_name
+
+    def affinity_token(self, args, kwargs):
+        """
+        The token this call's keys are placed by (see hscacheutils.affinity), or None.
+        """
+        if self.builder.affinity is None:
+            return None
+        return build_affinity_token(self.builder.affinity, self.all_args_by_name(args, kwargs))
 
-        self._cache_func_name(args)
+    def generation_suffixes(self, args, kwargs):
+        """
+        The generation key suffixes this call depends on, so that callers can fetch the
+        generations of many calls at once (see generation_values_for_suffixes).
+        """
+        return build_generation_cache_key_suffixes(self.builder.generations, **self.all_args_by_name(args, kwargs))
 
+    def _rest_of_cache_key(self, args, kwargs):
         args_in_rest_of_cache_key = [arg for arg, ignored in zip(args, self.ignored_args) if not ignored]
         kwargs_in_rest_of_cache_key = dict()
 
@@ -103,15 +213,115 @@ class GenFuncHelper(object):
         if not self.ignore_keywords:
             kwargs_in_rest_of_cache_key = dict(((name, val) for name, val in kwargs.items() if name not in self.builder.exclude))
 
-        # Capture all args by name, including the positional ones (via argspec)
-        all_args_by_name = dict(zip(self.arg_names, args))
-        all_args_by_name.update(kwargs)
+        return args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key
 
-        # Multi-get the generation values
-        all_gen_values = multi_generation_values(*self.builder.generations, **all_args_by_name)
+    def build_wrapped_cache_key_with_generations(self, args, kwargs, all_gen_values=None):
+        """
+        Builds the cache key for this call. If all_gen_values (a dict of generation suffix
+        to value) is passed in, it is used instead of fetching the generations again.
+        """
+
+        self._cache_func_name(args)
+        args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key = self._rest_of_cache_key(args, kwargs)
+
+        affinity = self.affinity_token(args, kwargs)
+
+        if all_gen_values is None:
+            # Multi-get the generation values
+            all_gen_values = generation_values_for_suffixes(self.generation_suffixes(args, kwargs), affinity)
+
+        if self.builder.generations and _resolves_generations_server_side():
+            suffixes = self.generation_suffixes(args, kwargs)
+            return self.server_side_key_prefix(args, kwargs) + ','.join(str(all_gen_values[suffix]) for suffix in suffixes)
 
         # Add the generations to the kwargs in the cache key
-        kwargs_in_rest_of_cache_key.update(all_gen_values)
+        kwargs_in_rest_of_cache_key.update(_key_generation_values(all_gen_values))
+
+        return affine_key(self.get_key(self._full_name, self.func_type, args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key), affinity)
+
+    def server_side_key_prefix(self, args, kwargs):
+        """
+        With a backend resolving generations server side, value keys are this prefix followed by
+        the comma separated generation values (so that the backend can build them on its own).
+        """
+        return sanitize_memcached_key(self.build_local_copy_key(args, kwargs)) + GENERATIONS_SEPARATOR
+
+    def fetch_server_side(self, args, kwargs):
+        """
+        Resolves the generations and fetches the value of this call in a single round trip.
+        Returns (key, value).
+        """
+        generation_keys = map(build_generation_cache_key, self.generation_suffixes(args, kwargs))
+        new_values = [new_generation_value() for key in generation_keys]
+
+        prefix = self.server_side_key_prefix(args, kwargs)
+        key, value, initialized = _cache_call('get_with_generations', prefix, generation_keys, new_values)
+        for generation_key in initialized:
+            _count_missing_generation(generation_key)
+        _seen_generation_keys.set_many(dict((generation_key, True) for generation_key in generation_keys))
+
+        # The key ends with the generation values
+        values = key[len(prefix):].split(',')
+        generation_values.current_scheme().observe(int(value) for value in values if value.isdigit())
+        dependencies.record(dict(zip(self.generation_suffixes(args, kwargs), values)))
+        return key, value
+
+    def build_local_copy_key(self, args, kwargs):
+        """
+        A key for this call that doesn't depend on the generations (so it can be built without
+        talking to the cache), used for the local copies kept by the circuit breaker.
+        """
+        self._cache_func_name(args)
+        args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key = self._rest_of_cache_key(args, kwargs)
+        return smart_str(_cache_key(self._full_name, self.func_type, args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key))
+
+
+class BatchGenFuncHelper(GenFuncHelper):
+    """
+    Builds per-element cache keys for functions wrapped with gen_cache.wrap_batch, where one
+    argument (batch_arg) is a list of ids and each id is cached on its own.
+    """
+
+    def __init__(self, builder, func, batch_arg, element_arg):
+        self.batch_arg = batch_arg
+        self.element_arg = element_arg
+        super(BatchGenFuncHelper, self).__init__(builder, func)
+
+        if batch_arg in self.arg_names:
+            self.batch_arg_index = self.arg_names.index(batch_arg)
+        elif self.keywords_name:
+            self.batch_arg_index = None
+        else:
+            raise Exception("%s has no %s argument to batch on" % (func.__name__, batch_arg))
+
+    def batch_ids(self, args, kwargs):
+        if self.batch_arg_index is not None and self.batch_arg_index < len(args):
+            return args[self.batch_arg_index]
+        return kwargs[self.batch_arg]
+
+    def with_batch_ids(self, args, kwargs, ids):
+        """
+        Returns (args, kwargs) for calling the wrapped function with only the passed in ids.
+        """
+        if self.batch_arg_index is not None and self.batch_arg_index < len(args):
+            args = list(args)
+            args[self.batch_arg_index] = ids
+            return tuple(args), kwargs
+        kwargs = dict(kwargs)
+        kwargs[self.batch_arg] = ids
+        return args, kwargs
+
+    def element_args_by_name(self, all_args_by_name, element_id):
+        element_args = dict(all_args_by_name)
+        element_args[self.element_arg] = element_id
+        return element_args
+
+    def build_element_cache_key(self, args, kwargs, element_id, all_gen_values):
+        self._cache_func_name(args)
+        args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key = self._rest_of_cache_key(args, kwargs)
+
+        kwargs_in_rest_of_cache_key[self.element_arg] = element_id
+        kwargs_in_rest_of_cache_key.update(_key_generation_values(all_gen_values))
 
         return self.get_key(self._full_name, self.func_type, args_in_rest_of_cache_key, kwargs_in_rest_of_cache_key)
 
@@ -139,7 +349,8 @@ def parse_generation(generation):
         return tuple(parts)
 
 
-def _gen_cached(timeout, generations, exclude=None, log_misses=False):
+def _gen_cached(timeout, generations, exclude=None, log_misses=False, adaptive_policy=None, namespace=None, version=None,
+                affinity=None, track_dependencies=False, page_size=None, immutable=False):
     """
     Generational Caching decorator. Can be applied to function, method or classmethod.
 
@@ -150,47 +361,410 @@ def _gen_cached(timeout, generations, exclude=None, log_misses=False):
     same arguments as function and the result for these arguments will be
     invalidated.
 
+    adaptive_policy (an adaptive.AdaptivePolicy) turns on adaptive caching, see hscacheutils.adaptive.
+
+    namespace (and optionally version) replace the module, function name and line number in the
+    cache key, see gen_cache.wrap.
+
+    affinity (an argument name) places all the keys of a call by the value of that argument, see
+    hscacheutils.affinity.
+
+    track_dependencies stores the generations consumed by nested calls along with the value, and
+    checks them when reading it back, see hscacheutils.dependencies.
+
+    page_size stores lists longer than that as pages read lazily, see hscacheutils.paging.
+
+    immutable keeps values frozen in a process wide local tier, shared by every caller, see
+    hscacheutils.immutable.
+
     Note: based on (and built re-using) django-cache-utils.
     """
 
-    builder = GenCachedBuilder(timeout, generations, exclude=exclude)
+    builder = GenCachedBuilder(timeout, generations, exclude=exclude, namespace=namespace, version=version, affinity=affinity)
 
     def _cached(func):
 
         func_helper = builder.func_helper(func)
+        name = _registry_name(func, namespace)
+        entry = registry.register(name, 'wrap', generations, timeout)
+
+        adaptive_state = None
+        if adaptive_policy is not None:
+            adaptive_state = adaptive.AdaptiveState(name, generations, timeout, adaptive_policy)
+
+        def compute(args, kwargs):
+            """
+            Calls func, returning its value and (when tracking them) its nested dependencies.
+            """
+            if not track_dependencies:
+                return func(*args, **kwargs), None
+            collector = dependencies.start()
+            try:
+                value = func(*args, **kwargs)
+            finally:
+                consumed = dependencies.stop(collector)
+            return value, _nested_dependencies(func_helper, args, kwargs, consumed)
+
+        def store_value(key, value, deps, value_timeout):
+            """
+            Caches a computed value (as pages if it's paged), returning what's stored under key.
+            """
+            cached = value
+            if page_size is not None and paging.pageable(value, page_size):
+                cached = paging.store_pages(key, value, page_size, value_timeout)
+            if deps is not None:
+                cached = DependentValue(cached, deps)
+            _cache_call('set', key, cached, value_timeout)
+            return cached
+
+        def share(cached):
+            """
+            Returns cached frozen for sharing, or None if it can't be frozen.
+            """
+            try:
+                return immutable_values.freeze_cached(cached)
+            except immutable_values.UnfreezableValue:
+                metrics.incr('immutable.unfreezable')
+                return None
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = func_helper.build_wrapped_cache_key_with_generations(args, kwargs)
-            value = raw_cache.get(key)
+            local_tier = immutable_values.local_tier() if immutable else None
+            value_timeout = timeout
+
+            if adaptive_state is not None:
+                if adaptive_state.check_bypass():
+                    return func(*args, **kwargs)
+
+                decision = adaptive_state.decision
+                value_timeout = decision.timeout
+                if decision.tier == adaptive.LOCAL_TIER and not immutable:
+                    local_tier = adaptive_state.local_tier
+
+            # Live overrides (see hscacheutils.registry) win over adaptive decisions
+            if entry.overridden:
+                if entry.bypassed():
+                    return func(*args, **kwargs)
+                value_timeout = entry.effective_timeout(value_timeout)
+                if entry.tier is not None:
+                    local_tier = entry.local_tier
+
+            wanted_local_tier = local_tier
+            shared = False
+            try:
+                if local_tier is None and builder.generations and _resolves_generations_server_side():
+                    # A single round trip for the generations and the value
+                    key, value = func_helper.fetch_server_side(args, kwargs)
+                else:
+                    key = func_helper.build_wrapped_cache_key_with_generations(args, kwargs)
+
+                    value = None
+                    if local_tier is not None:
+                        value = local_tier.get(key)
+                        if value is None:
+                            value = _cache_call('get', key)
+                        else:
+                            local_tier = None  # no need to put it back
+                            shared = True
+                    else:
+                        value = _cache_call('get', key)
+
+                if immutable and value is not None and not shared:
+                    frozen = share(value)
+                    if frozen is None:
+                        local_tier = wanted_local_tier = None
+                    else:
+                        value = frozen
+
+                if isinstance(value, DependentValue):
+                    if _dependencies_current(value.dependencies):
+                        dependencies.record_dependencies(value.dependencies)
+                    else:
+                        metrics.incr('dependencies.stale')
+                        local_tier = wanted_local_tier  # to replace the stale copy
+                        value = None
+            except CacheUnavailable:
+                return _uncached_fallback(func_helper, args, kwargs)
+
+            cached = value
 
             # in case of cache miss recalculate the value and put it to the cache
             if value is None:
-                value = func(*args, **kwargs)
-                raw_cache.set(key, value, timeout)
+                entry.misses += 1
+                start = time()
+                value, deps = compute(args, kwargs)
+                compute_time = time() - start
+
+                if adaptive_state is not None:
+                    adaptive_state.record_miss(compute_time, value)
+                if trace.recorder is not None:
+                    trace.recorder.record(trace.GET_MISS, key, value, compute_time,
+                                          sample_key=func_helper.build_local_copy_key(args, kwargs))
+
+                cached = value
+                try:
+                    cached = store_value(key, value, deps, value_timeout)
+                except CacheUnavailable:
+                    pass
+
+                # Paged values are returned as PagedLists on misses too, as on hits
+                if page_size is not None and paging.pageable(value, page_size):
+                    value = paging.PagedList.of(key, value, page_size, lambda: recompute_pages(key, args, kwargs, value_timeout))
+
+                if immutable:
+                    frozen = share(cached)
+                    if frozen is None:
+                        local_tier = None
+                    else:
+                        cached = frozen
+                        frozen_value = frozen.value if isinstance(frozen, DependentValue) else frozen
+                        if not isinstance(frozen_value, paging.PagedManifest):
+                            value = frozen_value
 
                 if log_misses is True or in_gen_cache_debug_mode():
                     logging.debug("Cache miss for gen_cache.wrap: %s \n    key = %s" % (generations, func_helper.full_key or key))
 
+            else:
+                entry.hits += 1
+                if isinstance(value, DependentValue):
+                    value = value.value
+                if isinstance(value, paging.PagedManifest):
+                    value = paging.PagedList(key, value, lambda: recompute_pages(key, args, kwargs, value_timeout))
+                if adaptive_state is not None:
+                    adaptive_state.record_hit()
+                if trace.recorder is not None:
+                    trace.recorder.record(trace.GET_HIT, key, sample_key=func_helper.build_local_copy_key(args, kwargs))
+
+            if local_tier is not None:
+                local_tier.set(key, cached, value_timeout)
+
+            breaker = current_circuit_breaker()
+            if breaker is not None and breaker.local_copies is not None:
+                breaker.remember(func_helper.build_local_copy_key(args, kwargs), value)
+
+            return value
+
+        def recompute_pages(key, args, kwargs, value_timeout):
+            # Some pages of a paged value went missing, store it again
+            value, deps = compute(args, kwargs)
+            try:
+                store_value(key, value, deps, value_timeout)
+            except CacheUnavailable:
+                pass
             return value
 
+        def store(key, value, deps=None):
+            """
+            Caches a value computed outside of wrapper (eg. by hscacheutils.warm) under key, as
+            a miss would: with the same envelope, pages, timeout and local tier.
+            """
+            value_timeout = timeout
+            local_tier = None
+            if adaptive_state is not None:
+                value_timeout = adaptive_state.decision.timeout
+                if adaptive_state.decision.tier == adaptive.LOCAL_TIER and not immutable:
+                    local_tier = adaptive_state.local_tier
+            if entry.overridden:
+                value_timeout = entry.effective_timeout(value_timeout)
+                if entry.tier is not None:
+                    local_tier = entry.local_tier
+
+            cached = store_value(key, value, deps, value_timeout)
+            if local_tier is not None:
+                local_tier.set(key, cached, value_timeout)
+
         def invalidate(*args, **kwargs):
             ''' invalidates cache result for function called with passed arguments '''
             if not hasattr(func_helper, '_full_name'):
                 return
-            key = func_helper.build_wrapped_cache_key_with_generations(args, kwargs)
-            raw_cache.delete(key)
+            try:
+                key = func_helper.build_wrapped_cache_key_with_generations(args, kwargs)
+            except CacheUnavailable:
+                logging.warning("Cache unavailable, could not invalidate %s for %s" % (generations, func_helper._full_name))
+                return
+            _backend_method(raw_cache, 'delete')(key)
+
+            # Hits are served from the local tiers before the backend
+            if immutable:
+                immutable_values.local_tier().delete(key)
+            if adaptive_state is not None:
+                adaptive_state.local_tier.delete(key)
+            if entry.local_tier is not None:
+                entry.local_tier.delete(key)
 
             if in_gen_cache_debug_mode():
                 logging.info('Invalidating key: %s' % key)
 
         wrapper.invalidate = invalidate
+        wrapper.func_helper = func_helper
+        wrapper.uncached = func
+        wrapper.compute = compute
+        wrapper.store = store
+        wrapper.adaptive = adaptive_state
+        wrapper.track_dependencies = track_dependencies
+        wrapper.page_size = page_size
+        wrapper.immutable = immutable
+        wrapper.registry_entry = entry
+        return wrapper
+    return _cached
+
+
+def _registry_name(func, namespace):
+    """
+    The name of a wrapped function in hscacheutils.registry: its namespace, or "module.function:line".
+    """
+    if namespace:
+        return namespace
+    code = getattr(func, 'func_code', None)
+    return '%s.%s:%s' % (func.__module__, func.__name__, code.co_firstlineno if code is not None else '?')
+
+
+def _nested_dependencies(func_helper, args, kwargs, consumed):
+    """
+    The consumed (suffix, affinity, value) dependencies, minus the call's own generations
+    (already in its key).
+    """
+    affinity = func_helper.affinity_token(args, kwargs)
+    own = set((suffix, affinity) for suffix in func_helper.generation_suffixes(args, kwargs))
+    return tuple(dependency for dependency in consumed if (dependency[0], dependency[1]) not in own)
+
+
+def _gen_cached_batch(timeout, generations, batch_arg, element_arg=None, result_key=None, exclude=None, log_misses=False,
+                      namespace=None, version=None):
+    """
+    Generational Caching decorator for functions taking a list of ids (see gen_cache.wrap_batch).
+    """
+
+    if element_arg is None:
+        # eg. contact_ids => contact_id
+        element_arg = batch_arg[:-1] if batch_arg.endswith('s') else batch_arg
+
+    # The ids are part of each element's key on their own, not as a list
+    builder = GenCachedBuilder(timeout, generations, exclude=list(exclude or []) + [batch_arg],
+                               namespace=namespace, version=version)
+
+    def _cached(func):
+
+        func_helper = BatchGenFuncHelper(builder, func, batch_arg, element_arg)
+        entry = registry.register(_registry_name(func, namespace), 'wrap_batch', generations, timeout)
+
+        def results_by_id(result):
+            if result_key is None:
+                return result
+            return dict((result_key(item), item) for item in result)
+
+        def build_result(ids, values_by_id):
+            if result_key is None:
+                return dict((element_id, values_by_id[element_id]) for element_id in ids if element_id in values_by_id)
+            return [values_by_id[element_id] for element_id in ids if element_id in values_by_id]
+
+        def element_keys(args, kwargs, ids):
+            all_args_by_name = func_helper.all_args_by_name(args, kwargs)
+
+            suffixes_by_id = dict()
+            for element_id in ids:
+                element_args = func_helper.element_args_by_name(all_args_by_name, element_id)
+                suffixes_by_id[element_id] = build_generation_cache_key_suffixes(builder.generations, **element_args)
+
+            # A single get_many for the generations of every element
+            all_gen_values = generation_values_for_suffixes(list(set(
+                suffix for suffixes in suffixes_by_id.values() for suffix in suffixes)))
+
+            keys_by_id = dict()
+            for element_id in ids:
+                gen_values = dict((suffix, all_gen_values[suffix]) for suffix in suffixes_by_id[element_id])
+                keys_by_id[element_id] = func_helper.build_element_cache_key(args, kwargs, element_id, gen_values)
+            return keys_by_id
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            ids = func_helper.batch_ids(args, kwargs)
+
+            # Dedupe, but keep the order
+            seen = set()
+            unique_ids = [element_id for element_id in ids if not (element_id in seen or seen.add(element_id))]
+            if not unique_ids:
+                return func(*args, **kwargs)
+            if entry.overridden and entry.bypassed():
+                return func(*args, **kwargs)
+
+            try:
+                keys_by_id = element_keys(args, kwargs, unique_ids)
+                cached = _cache_call('get_many', keys_by_id.values())
+            except CacheUnavailable:
+                return func(*args, **kwargs)
+
+            values_by_id = dict()
+            missing_ids = []
+            for element_id in unique_ids:
+                value = cached.get(keys_by_id[element_id])
+                if value is None:
+                    missing_ids.append(element_id)
+                else:
+                    values_by_id[element_id] = value
+            entry.hits += len(values_by_id)
+            entry.misses += len(missing_ids)
+
+            if missing_ids:
+                missing_args, missing_kwargs = func_helper.with_batch_ids(args, kwargs, type(ids)(missing_ids) if isinstance(ids, tuple) else missing_ids)
+                computed = results_by_id(func(*missing_args, **missing_kwargs))
+
+                to_set = dict()
+                for element_id in missing_ids:
+                    value = computed.get(element_id)
+                    if value is not None:
+                        values_by_id[element_id] = to_set[keys_by_id[element_id]] = value
+
+                if to_set:
+                    try:
+                        _cache_call('set_many', to_set, entry.effective_timeout(timeout))
+                    except CacheUnavailable:
+                        pass
+
+                if log_misses is True or in_gen_cache_debug_mode():
+                    logging.debug("Cache misses for gen_cache.wrap_batch: %s \n    %s = %s" % (generations, batch_arg, missing_ids))
+
+            return build_result(unique_ids, values_by_id)
+
+        def invalidate(*args, **kwargs):
+            ''' invalidates the cached results of every id passed in '''
+            ids = func_helper.batch_ids(args, kwargs)
+            if not hasattr(func_helper, '_full_name') or not ids:
+                return
+            try:
+                keys_by_id = element_keys(args, kwargs, list(ids))
+            except CacheUnavailable:
+                logging.warning("Cache unavailable, could not invalidate %s for %s" % (generations, func_helper._full_name))
+                return
+            _backend_method(raw_cache, 'delete_many')(keys_by_id.values())
+
+        wrapper.invalidate = invalidate
+        wrapper.func_helper = func_helper
+        wrapper.uncached = func
+        wrapper.registry_entry = entry
         return wrapper
     return _cached
 
 
+def _uncached_fallback(func_helper, args, kwargs):
+    """
+    What a wrapped function returns when the cache is unavailable: a recent local copy if the
+    circuit breaker kept one, otherwise the freshly computed value.
+    """
+    breaker = current_circuit_breaker()
+    if breaker is not None:
+        value = breaker.recall(func_helper.build_local_copy_key(args, kwargs))
+        if value is not None:
+            return value
+    return func_helper.func(*args, **kwargs)
+
+
 GENERATION_KEY = "_gen_%s"
 
+# Between the rest of a value key and its generation values, when generations are resolved
+# server side (see GenFuncHelper.server_side_key_prefix)
+GENERATIONS_SEPARATOR = '@'
+
 
 def build_generation_cache_key_suffix(generation, **kwargs):
     generation_name, dynamic_param = parse_generation(generation)
@@ -213,36 +787,134 @@ def build_generation_cache_key_full(generation, **kwargs):
 
 def new_generation_value():
     """
-    Creates an intial value for a generation. Starts off as microseconds since 1970 to be unique.
-    With that, the generation would have to incremented a million times in order to collide with
-    a generation invalidation that happened a second later.
+    Creates an intial value for a generation. Microseconds since 1970 by default, or a hybrid
+    logical clock value, see hscacheutils.generation_values.
     """
-    microseconds = int(time() * 1000000)
-    return microseconds
+    return generation_values.current_scheme().new_value()
+
+
+def _key_generation_values(all_gen_values):
+    """
+    The generation values (a dict of suffix => value) as written in value keys.
+    """
+    scheme = generation_values.current_scheme()
+    return dict((suffix, scheme.key_value(value)) for suffix, value in all_gen_values.items())
+
+
+def _trace_sample_key(suffixes, add_to_key=None):
+    """
+    What hscacheutils.trace samples a gen_cache.get/set on: its generations and add_to_key,
+    without the generation values, so that it stays sampled (or not) across invalidations.
+    """
+    return '%s|%s' % (','.join(smart_str(suffix) for suffix in suffixes), smart_str(add_to_key))
+
+
+def _variant_kwargs(kwargs, variant):
+    """
+    The kwargs of a variant of gen_cache.get_many/set_many, see GenerationalCache.build_keys.
+    """
+    variant_kwargs = dict(kwargs)
+    if isinstance(variant, dict):
+        variant_kwargs.update(variant)
+    else:
+        variant_kwargs['add_to_key'] = variant
+    return variant_kwargs
+
+
+def build_affinity_token(affinity, kwargs):
+    if affinity not in kwargs:
+        raise Exception("Tried to place keys by %s without passing it" % affinity)
+    return "%s:%s" % (affinity, smart_str(kwargs[affinity]))
+
+
+def build_generation_cache_key_suffixes(generations, **kwargs):
+    return [build_generation_cache_key_suffix(gen, **kwargs) for gen in generations]
 
 
 def multi_generation_values(*generations, **kwargs):
-    keys_suffix = [build_generation_cache_key_suffix(gen, **kwargs) for gen in generations]
-    keys = map(build_generation_cache_key, keys_suffix)
-    result_values = raw_cache.get_many(keys)
+    return generation_values_for_suffixes(build_generation_cache_key_suffixes(generations, **kwargs))
+
+
+def generation_values_for_suffixes(keys_suffix, affinity=None):
+    """
+    Multi-gets (and initializes if needed) the generations for a list of generation key
+    suffixes, placed by the affinity token if there is one. Returns a dict of suffix =>
+    generation value.
+    """
+    keys = [affine_key(build_generation_cache_key(suffix), affinity) for suffix in keys_suffix]
+    # Lets CacheUnavailable through, since minting new generations when we couldn't read the
+    # current ones would invalidate everything under them.
+    result_values = _generation_cache_call('get_many', keys)
     if in_gen_cache_debug_mode():
         logging.debug('Fetching generations %s => %s' % (keys, result_values))
+    if result_values:
+        # Including the generations other processes created, so their evictions are counted too
+        _seen_generation_keys.set_many(dict((key, True) for key, value in result_values.items() if value is not None))
 
     # Create new values for all the generations that are empty
-    newly_initialized_gens = dict()
+    missing_keys = [key for key in keys if result_values.get(key) is None]
+    if missing_keys:
+        result_values.update(initialize_generations(missing_keys))
+
+    gen_values = dict([(keys_suffix[i], result_values.get(key)) for i, key in enumerate(keys)])
+    generation_values.current_scheme().observe(gen_values.values())
+    dependencies.record(gen_values, affinity)
+    return gen_values
+
+
+def _dependencies_current(dependency_list):
+    """
+    Whether the generations a tracked value was computed from (see hscacheutils.dependencies)
+    still have the same values, checked in a single fetch.
+    """
+    if not dependency_list:
+        return True
+    keys = [affine_key(build_generation_cache_key(suffix), affinity) for suffix, affinity, value in dependency_list]
+    current_values = _generation_cache_call('get_many', keys)
+    return all(str(current_values.get(key)) == str(value) for key, (suffix, affinity, value) in zip(keys, dependency_list))
+
+
+# Generation keys this process has seen (read or created), to tell evicted generations apart from new ones
+_seen_generation_keys = LocalLRUCache(max_items=10000)
+
+
+def _count_missing_generation(key):
+    if _seen_generation_keys.get(key) is not None:
+        metrics.incr('generations.evicted')
+    else:
+        metrics.incr('generations.initialized')
+
+
+def initialize_generations(keys):
+    """
+    Creates new values for the passed in (missing) generation keys. Uses add, so that when
+    several processes initialize the same generation at once they all end up with the value
+    of whichever got there first. Returns a dict of key => generation value.
+    """
+    values = dict()
+    lost = []
 
     for key in keys:
-        if result_values.get(key) is None:
-            new_value = new_generation_value()
-            result_values[key] = newly_initialized_gens[key] = new_value
+        _count_missing_generation(key)
+        new_value = new_generation_value()
+        if _generation_cache_call('add', key, new_value, MAX_MEMCACHE_TIMEOUT):
+            values[key] = new_value
+        else:
+            lost.append(key)
 
-    if newly_initialized_gens:
-        raw_cache.set_many(newly_initialized_gens, MAX_MEMCACHE_TIMEOUT)
+    if lost:
+        winners = _generation_cache_call('get_many', lost)
+        for key in lost:
+            # If the winner is already gone again, our value is as good as any
+            values[key] = winners.get(key) or new_generation_value()
 
-        if in_gen_cache_debug_mode():
-            logging.debug('Creating new generations %s => %s' % (newly_initialized_gens, new_value))
+    for key in values:
+        _seen_generation_keys.set(key, True)
+
+    if in_gen_cache_debug_mode():
+        logging.debug('Creating new generations %s' % values)
 
-    return dict([(keys_suffix[i], result_values.get(key)) for i, key in enumerate(keys)])
+    return values
 
 def identity_decorator(f):
     return f
@@ -261,12 +933,26 @@ class GenerationalCache(object):
         gen_cache.invalidate(('nav', 'nav_portal:user_id'), user_id=1)
 
     """
-    def build_key(self, *generations, **kwargs):
-        all_gen_values = multi_generation_values(*generations, **kwargs)
-        gen_list = ["%s:%s" % (gen, value) for gen, value in all_gen_values.items()] 
+    def __init__(self):
+        self.debouncer = InvalidationDebouncer(self._invalidate_now,
+                                               get_setting_default('GEN_CACHE_INVALIDATION_DEBOUNCE', None))
 
+    def build_key(self, *generations, **kwargs):
+        # Places the keys by the value of that keyword argument (see hscacheutils.affinity)
+        affinity = kwargs.pop('affinity', None)
         add_to_key = kwargs.pop('add_to_key', None)
 
+        affinity_token = build_affinity_token(affinity, kwargs) if affinity else None
+        all_gen_values = generation_values_for_suffixes(build_generation_cache_key_suffixes(generations, **kwargs), affinity_token)
+        return affine_key(self.build_key_with_generation_values(all_gen_values, add_to_key), affinity_token)
+
+    def build_key_with_generation_values(self, all_gen_values, add_to_key=None):
+        """
+        Same as build_key, but with generation values that were already fetched (a dict of
+        generation suffix => value, see generation_values_for_suffixes).
+        """
+        gen_list = ["%s:%s" % (gen, value) for gen, value in _key_generation_values(all_gen_values).items()]
+
         if add_to_key is None:
             add_to_key = []
         elif isinstance(add_to_key, basestring):
@@ -288,12 +974,19 @@ class GenerationalCache(object):
         # TODO, docs! (don't forget the add_to_key param)
 
         if not self.should_ignore_caching(kwargs):
-            key = self.build_key(*generations, **kwargs)
-            result = raw_cache.get(key)
+            try:
+                key = self.build_key(*generations, **kwargs)
+                result = _cache_call('get', key)
+            except CacheUnavailable:
+                return None
 
             if in_gen_cache_debug_mode():
                 logging.debug("gen_cache.get: %s => %s" % (key, result))
 
+            if trace.recorder is not None:
+                trace.recorder.record(trace.GET_MISS if result is None else trace.GET_HIT, key,
+                                      sample_key=self._trace_sample_key(generations, kwargs))
+
             return result
 
 
@@ -309,31 +1002,214 @@ class GenerationalCache(object):
         if 'timeout' in kwargs:
             timeout = kwargs.pop('timeout')
 
-        key = self.build_key(*generations, **kwargs)
-        raw_cache.set(key, value, timeout=timeout)
+        try:
+            key = self.build_key(*generations, **kwargs)
+            _cache_call('set', key, value, timeout=timeout)
+        except CacheUnavailable:
+            return
+
+        if trace.recorder is not None:
+            trace.recorder.record(trace.SET, key, value, sample_key=self._trace_sample_key(generations, kwargs))
 
         if in_gen_cache_debug_mode():
             logging.debug("gen_cache.set: %s to %s" % (key, value))
 
+    def _trace_sample_key(self, generations, kwargs):
+        return _trace_sample_key(build_generation_cache_key_suffixes(generations, **kwargs), kwargs.get('add_to_key'))
+
+    def build_keys(self, generations, variants, **kwargs):
+        """
+        Same as build_key, for many variants at once: each variant is a dict of keyword arguments
+        (dynamic parameters, add_to_key, affinity) added to kwargs, or an add_to_key value. The
+        union of their generations is fetched once (once per affinity token). Returns the keys,
+        in order.
+        """
+        resolved = []
+        suffixes_by_affinity = dict()
+        for variant in variants:
+            variant_kwargs = _variant_kwargs(kwargs, variant)
+            add_to_key = variant_kwargs.pop('add_to_key', None)
+            affinity = variant_kwargs.pop('affinity', None)
+            affinity_token = build_affinity_token(affinity, variant_kwargs) if affinity else None
+            suffixes = build_generation_cache_key_suffixes(generations, **variant_kwargs)
+
+            resolved.append((suffixes, affinity_token, add_to_key))
+            suffixes_by_affinity.setdefault(affinity_token, set()).update(suffixes)
+
+        gen_values_by_affinity = dict((affinity_token, generation_values_for_suffixes(list(suffixes), affinity_token))
+                                      for affinity_token, suffixes in suffixes_by_affinity.items())
+
+        keys = []
+        for suffixes, affinity_token, add_to_key in resolved:
+            gen_values = dict((suffix, gen_values_by_affinity[affinity_token][suffix]) for suffix in suffixes)
+            keys.append(affine_key(self.build_key_with_generation_values(gen_values, add_to_key), affinity_token))
+        return keys
+
+    def get_many(self, generations, variants, **kwargs):
+        """
+        Same as get, for many variants of the same generations (see build_keys), eg. the
+        fragments of a page:
+
+            gen_cache.get_many(['cms', 'cms_portal:portal_id'], ['header', 'footer', {'add_to_key': 'nav', 'user_id': 1}],
+                               portal_id=53)
+
+        Returns the values (None for misses) in the order of variants, with a single fetch of the
+        generations and a single get_many of the values.
+        """
+        kwargs.pop('use_raw', None)
+        variants = list(variants)
+        if self.should_ignore_caching(kwargs) or not variants:
+            return [None] * len(variants)
+
+        try:
+            keys = self.build_keys(generations, variants, **kwargs)
+            results = _cache_call('get_many', list(set(keys)))
+        except CacheUnavailable:
+            return [None] * len(variants)
+
+        values = [results.get(key) for key in keys]
+        if in_gen_cache_debug_mode():
+            logging.debug("gen_cache.get_many: %s => %s" % (keys, values))
+        if trace.recorder is not None:
+            for key, value, variant in zip(keys, values, variants):
+                trace.recorder.record(trace.GET_MISS if value is None else trace.GET_HIT, key,
+                                      sample_key=self._trace_sample_key(generations, _variant_kwargs(kwargs, variant)))
+        return values
+
+    def set_many(self, generations, values_by_variant, **kwargs):
+        """
+        Same as set, for many variants at once: values_by_variant is a list of (variant, value)
+        (see build_keys). A single fetch of the generations and a single set_many.
+        """
+        kwargs.pop('use_raw', None)
+        timeout = kwargs.pop('timeout', None)
+        values_by_variant = list(values_by_variant)
+        if not values_by_variant:
+            return
+
+        try:
+            keys = self.build_keys(generations, [variant for variant, value in values_by_variant], **kwargs)
+            _cache_call('set_many', dict((key, value) for key, (variant, value) in zip(keys, values_by_variant)), timeout)
+        except CacheUnavailable:
+            return
+
+        if trace.recorder is not None:
+            for key, (variant, value) in zip(keys, values_by_variant):
+                trace.recorder.record(trace.SET, key, value,
+                                      sample_key=self._trace_sample_key(generations, _variant_kwargs(kwargs, variant)))
+        if in_gen_cache_debug_mode():
+            logging.debug("gen_cache.set_many: %s" % keys)
+
     def delete(self, *generations, **kwargs):
-        key = self.build_key(*generations, **kwargs)
-        raw_cache.delete(key) 
+        try:
+            key = self.build_key(*generations, **kwargs)
+            _cache_call('delete', key)
+        except CacheUnavailable:
+            return
+
+        if trace.recorder is not None:
+            trace.recorder.record(trace.DELETE, key, sample_key=self._trace_sample_key(generations, kwargs))
         if in_gen_cache_debug_mode():
             logging.debug("gen_cache.remove: %s " % (key))
 
 
     def invalidate(self, generation, **kwargs):
+        """
+        Bumps the generation, invalidating everything cached under it. Generations with a
+        debounce interval (see debounce_invalidations) might get bumped a little later instead,
+        in which case None is returned.
+        """
+        if not self.debouncer.intervals:
+            return self._invalidate_now(generation, **kwargs)
         key = build_generation_cache_key_full(generation, **kwargs)
-        c = raw_cache
+        return self.debouncer.invalidate(generation, key, **kwargs)
+
+    def debounce_invalidations(self, generation, min_interval):
+        """
+        Coalesces the invalidations of generation made less than min_interval seconds apart
+        into a single trailing invalidation. See hscacheutils.debounce.
+        """
+        self.debouncer.set_interval(generation, min_interval)
+
+    def invalidate_many(self, invalidations):
+        """
+        Invalidates many generations at once. invalidations is a list of generations and/or of
+        (generation, kwargs) tuples, eg.
+
+            gen_cache.invalidate_many(['contacts', ('contact:contact_id', {'contact_id': 1})])
+
+        With a generation backend that has incr_many (eg. redis_cache.RedisCache), the bumps are
+        pipelined in a single round trip. Returns the new generation values, in order (None for
+        the debounced ones).
+        """
+        results = []
+        to_bump = []
+
+        for invalidation in invalidations:
+            if isinstance(invalidation, basestring):
+                generation, kwargs = invalidation, {}
+            else:
+                generation, kwargs = invalidation
+
+            if generation in self.debouncer.intervals:
+                results.append(self.invalidate(generation, **kwargs))
+            else:
+                results.append(None)
+                to_bump.append((len(results) - 1, generation, build_generation_cache_key_full(generation, **kwargs)))
+
+        if not _generation_backend_has('incr_many'):
+            for index, generation, key in to_bump:
+                results[index] = self._bump(generation, key)
+            return results
+
+        for index, generation, key in to_bump:
+            self._record_invalidation(generation, key)
+
+        new_values = _backend_method(generation_cache, 'incr_many')([key for index, generation, key in to_bump])
+        for index, generation, key in to_bump:
+            results[index] = new_values.get(key)
+            if results[index] is None:
+                results[index] = self._initialize_invalidated(key)
+
+        return results
+
+    def _invalidate_now(self, generation, **kwargs):
+        return self._bump(generation, build_generation_cache_key_full(generation, **kwargs))
+
+    def _record_invalidation(self, generation, key):
+        adaptive.record_invalidation(generation)
+
+        if trace.recorder is not None:
+            trace.recorder.record(trace.INVALIDATE, key)
 
         if in_gen_cache_debug_mode():
             logging.debug("gen_cache.invalidate: %s" % (key))
 
+    def _bump(self, generation, key):
+        self._record_invalidation(generation, key)
+
+        # Affine generations have a copy on the node of every tenant using them, bump them all
+        incr = 'incr_everywhere' if _generation_backend_has('incr_everywhere') else 'incr'
+
         try:
-            val = c.incr(key)
+            val = _backend_method(generation_cache, incr)(key)
             return val
         except ValueError:
-            return c.set(key, new_generation_value())
+            pass
+
+        return self._initialize_invalidated(key)
+
+    def _initialize_invalidated(self, key):
+        # The generation doesn't exist (anymore), so any new value invalidates it. Unless somebody
+        # else just created it, in which case it has to be bumped.
+        _count_missing_generation(key)
+        new_value = new_generation_value()
+        if _backend_method(generation_cache, 'add')(key, new_value, MAX_MEMCACHE_TIMEOUT):
+            return new_value
+        try:
+            return _backend_method(generation_cache, 'incr')(key)
+        except ValueError:
+            return None
 
     def wrap(self, *generations, **kwargs):
         """
@@ -392,6 +1268,16 @@ class GenerationalCache(object):
 
         (Note, I'm not sure this file/function name magic is worth keeping)
 
+        To keep the cache across deploys that move code around, give the function a stable
+        namespace instead (and bump its version when its results change shape):
+
+            @gen_cache.wrap('contacts', 'contact:contact_id', namespace='contacts.get_contact', version=2)
+            def get_contact(contact_id):
+                ...
+
+        Two wrapped functions using the same namespace raise a GenCacheNamespaceCollision when the
+        second one is wrapped (ie. at import time).
+
 
         ## REAL CACHE KEY EXAMPLE
 
@@ -415,6 +1301,27 @@ class GenerationalCache(object):
 
         ignore_locally=True (False by default) will disable this caching when ENV == 'local'
 
+        namespace='contacts.get_contact' (defaults to None) replaces the module name, function name and
+        line number in the cache key, so that only bumping version=N invalidates it
+
+        adaptive=True (False by default) measures compute time, value size, hit ratio and
+        invalidations, and adjusts the timeout, tier or bypasses caching based on them (pass an
+        adaptive.AdaptivePolicy instead of True to change its bounds). See hscacheutils.adaptive.
+
+        affinity='portal_id' (defaults to None) places the generations and value of each call on
+        the cache node of its portal_id, when raw_cache routes by affinity. See hscacheutils.affinity.
+
+        track_dependencies=True (False by default) records the generations used by the wrapped calls
+        made while computing the value, stores them with it, and treats the value as stale when one
+        of them was invalidated. See hscacheutils.dependencies.
+
+        page_size=500 (defaults to None) stores list results longer than that as pages, and returns
+        a lazy sequence fetching them as they're read. See hscacheutils.paging.
+
+        immutable=True (False by default) keeps the values frozen in a process wide local tier,
+        bounded by bytes, and hands the same read-only value to every caller instead of unpickling
+        a copy per call. See hscacheutils.immutable.
+
 
         ## EXTRAS
 
@@ -435,12 +1342,71 @@ class GenerationalCache(object):
         if 'timeout' in kwargs:
             timeout = kwargs.pop('timeout')
 
+        adaptive_policy = kwargs.pop('adaptive', None)
+        if adaptive_policy is True:
+            adaptive_policy = adaptive.DEFAULT_POLICY
+        elif not adaptive_policy:
+            adaptive_policy = None
+
         if self.should_ignore_caching(kwargs):
             return identity_decorator
         else:
             # Only doing a simple function call for simiplicity of the review
             # diff for now. Will move the code over here later.
-            return _gen_cached(timeout, generations, **kwargs)
+            return _gen_cached(timeout, generations, adaptive_policy=adaptive_policy, **kwargs)
+
+    def adaptive_decisions(self):
+        """
+        The stats and current decisions of every adaptive=True wrapped function, by name.
+        """
+        return adaptive.describe()
+
+    def wrap_batch(self, *generations, **kwargs):
+        """
+        Generational Caching decorator for functions that take a list of ids and return a dict of
+        id => result. Each id is cached on its own (so overlapping calls share their cached ids),
+        and only the ids that missed are passed on to the wrapped function.
+
+            @gen_cache.wrap_batch('contacts', 'contacts_portal:portal_id', 'contact:contact_id',
+                                  batch_arg='contact_ids')
+            def get_contacts(portal_id, contact_ids):
+                return dict((contact.id, contact) for contact in load_contacts(portal_id, contact_ids))
+
+            get_contacts(53, [1, 2, 3])   -> Computes 1, 2 and 3
+            get_contacts(53, [2, 3, 4])   -> Only calls get_contacts(53, [4])
+
+            gen_cache.invalidate('contact:contact_id', contact_id=2)   -> Only invalidates contact 2
+
+        Generations can depend on each element via element_arg (which defaults to batch_arg
+        without its trailing "s", so "contact_id" for "contact_ids").
+
+        ## KEYWORD OPTIONS
+
+        batch_arg='contact_ids' (required) is the argument holding the list of ids
+
+        element_arg='contact_id' is the name each id goes by in the generations
+
+        result_key=lambda contact: contact.id, if the wrapped function returns a list instead of a
+        dict, is how to get the id of each item (and the wrapper then returns a list too)
+
+        timeout, exclude, log_misses, ignore_locally and ignore_if_setting_is_true are the same as
+        for gen_cache.wrap
+
+        Ids that the wrapped function returns no result (or None) for aren't cached.
+        """
+
+        timeout = None
+
+        if 'timeout' in kwargs:
+            timeout = kwargs.pop('timeout')
+
+        if 'batch_arg' not in kwargs:
+            raise TypeError("gen_cache.wrap_batch needs a batch_arg")
+
+        if self.should_ignore_caching(kwargs):
+            return identity_decorator
+        else:
+            return _gen_cached_batch(timeout, generations, **kwargs)
 
     def should_ignore_caching(self, dict_of_args):
         ignore_locally = dict_of_args.pop('ignore_locally', None)
@@ -477,27 +1443,123 @@ class CustomUseGenCache(object):
     @my_gen_cache.wrap()
     def get_template(user_id, path):
         pass
+
+    With packed=True, small values are stored together in a few bucket items per generation
+    vector (see hscacheutils.packed_cache).
+
+    With affinity='user_id', all the keys for a user_id are placed on the same cache node (see
+    hscacheutils.affinity).
+
+    It shows up in hscacheutils.registry under name (or "custom:" followed by its generations and timeout),
+    where its timeout can be overridden or its gets and sets bypassed.
     '''
 
-    def __init__(self, generation_names, timeout=300):
+    def __init__(self, generation_names, timeout=300, packed=False, packed_buckets=16, max_packed_size=512,
+                 affinity=None, name=None):
         self.generation_names = generation_names
         self.timeout = timeout
+        self.affinity = affinity
+        self.registry_entry = registry.register(name or 'custom:%s:%s' % (','.join(generation_names), timeout), 'custom',
+                                                generation_names, timeout)
+
+        self.packed = None
+        if packed:
+            from hscacheutils.packed_cache import PackedBuckets
+            self.packed = PackedBuckets(generation_names, buckets=packed_buckets, max_packed_size=max_packed_size,
+                                        timeout=timeout)
 
     def build_key(self, **kwargs):
         return gen_cache.build_key(*self.generation_names, **kwargs)
 
     def get(self, **kwargs):
+        entry = self.registry_entry
+        if entry.overridden and entry.bypassed():
+            return None
+
         self._adjust_kwargs(kwargs)
-        return gen_cache.get(*self.generation_names, **kwargs)
+        if self.packed is not None:
+            kwargs.pop('use_raw', None)
+            if gen_cache.should_ignore_caching(kwargs):
+                return None
+            value = self.packed.get(**kwargs)
+        else:
+            value = gen_cache.get(*self.generation_names, **kwargs)
+
+        if value is None:
+            entry.misses += 1
+        else:
+            entry.hits += 1
+        return value
 
     def set(self, value, **kwargs):
+        entry = self.registry_entry
+        if entry.overridden and entry.bypassed():
+            return None
+
         if 'timeout' not in kwargs:
-            kwargs['timeout'] = self.timeout
+            kwargs['timeout'] = entry.effective_timeout(self.timeout)
         self._adjust_kwargs(kwargs)
+        if self.packed is not None:
+            kwargs.pop('use_raw', None)
+            return self.packed.set(value, **kwargs)
         gen_cache.set(value, *self.generation_names, **kwargs)
 
+    def get_many(self, variants, **kwargs):
+        """
+        Gets many variants at once (see GenerationalCache.get_many): each variant is a dict of
+        keyword arguments (cache_key, dynamic parameters) added to kwargs, or a cache_key.
+        Returns the values in order.
+
+            fragments_cache.get_many(['header', 'footer', 'nav'], portal_id=53)
+        """
+        variants = [self._adjust_variant(variant) for variant in variants]
+        entry = self.registry_entry
+        if entry.overridden and entry.bypassed():
+            return [None] * len(variants)
+
+        self._adjust_kwargs(kwargs)
+        if self.packed is not None:
+            kwargs.pop('use_raw', None)
+            if gen_cache.should_ignore_caching(kwargs):
+                return [None] * len(variants)
+            values = self.packed.get_many([dict(kwargs, **variant) for variant in variants])
+        else:
+            values = gen_cache.get_many(self.generation_names, variants, **kwargs)
+        misses = values.count(None)
+        entry.misses += misses
+        entry.hits += len(values) - misses
+        return values
+
+    def set_many(self, values_by_variant, **kwargs):
+        """
+        Sets many variants at once: values_by_variant is a list of (variant, value), see get_many.
+        """
+        values_by_variant = [(self._adjust_variant(variant), value) for variant, value in values_by_variant]
+        if self.packed is not None:
+            for variant, value in values_by_variant:
+                self.set(value, **dict(kwargs, **variant))
+            return
+
+        entry = self.registry_entry
+        if entry.overridden and entry.bypassed():
+            return None
+
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = entry.effective_timeout(self.timeout)
+        self._adjust_kwargs(kwargs)
+        gen_cache.set_many(self.generation_names, values_by_variant, **kwargs)
+
+    def _adjust_variant(self, variant):
+        if not isinstance(variant, dict):
+            variant = {'cache_key': variant}
+        variant = dict(variant)
+        self._adjust_kwargs(variant)
+        return variant
+
     def delete(self, **kwargs):
         self._adjust_kwargs(kwargs)
+        if self.packed is not None:
+            return self.packed.delete(**kwargs)
         return gen_cache.delete(*self.generation_names, **kwargs)
 
     def _adjust_kwargs(self, kwargs):
@@ -505,6 +1567,8 @@ class CustomUseGenCache(object):
         if 'cache_key' in kwargs:
             kwargs['add_to_key'] = kwargs['cache_key']
             del kwargs['cache_key']
+        if self.affinity is not None:
+            kwargs.setdefault('affinity', self.affinity)
         
 
     def invalidate(self, generation=None, **kwargs):
@@ -520,9 +1584,17 @@ class CustomUseGenCache(object):
     def wrap(self, *args, **kwargs):
         if 'timeout' not in kwargs:
             kwargs['timeout'] = self.timeout
+        if self.affinity is not None:
+            kwargs.setdefault('affinity', self.affinity)
         all_args = list(self.generation_names) + list(args)
         return gen_cache.wrap(*all_args, **kwargs)
 
+    def wrap_batch(self, *args, **kwargs):
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = self.timeout
+        all_args = list(self.generation_names) + list(args)
+        return gen_cache.wrap_batch(*all_args, **kwargs)
+
 class DummyGenCache(object):
     '''
     Used as a swap in replacement for CustomUseGenCache if you need to disable caching for whatever reason
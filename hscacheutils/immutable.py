@@ -0,0 +1,170 @@
+"""
+Read-only sharing of hot cached values in-process (opt in with gen_cache.wrap(..., immutable=True)).
+
+The values of immutable functions are kept, unpickled and frozen, in a process wide local tier:
+hits are served from it without fetching, unpickling or copying the value, every caller gets the
+same shared object. Keys still carry the generations, so invalidation works as usual.
+
+    @gen_cache.wrap('nav_portal:portal_id', immutable=True)
+    def get_navigation(portal_id):
+        return {'items': [...], 'labels': {...}}
+
+    nav = get_navigation(53)
+    nav['items'].append('x')    # raises ImmutableValueError
+    nav = thaw(nav)             # a mutable (deep) copy, if you need one
+
+Freezing turns lists into FrozenLists, dicts into FrozenDicts, sets into frozensets and bytearrays
+into strs, all the way down (tuples are frozen item by item). Their mutating methods raise an
+ImmutableValueError, a TypeError like the ones tuples raise. Instances of other classes can't be
+frozen: those values are returned as usual and not kept in the local tier (counted in
+hscacheutils.metrics as "immutable.unfreezable"). Paged values (see hscacheutils.paging) are
+kept as manifests, their pages aren't shared.
+
+The tier is bounded by bytes (GEN_CACHE_IMMUTABLE_MAX_BYTES, 64MB by default), as measured by
+local_cache.deep_sizeof, and evicts the least recently used values first. The memcached copy of
+the value is stored unfrozen, as without immutable=True.
+"""
+
+import threading
+
+from hscacheutils.dependencies import DependentValue
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.paging import PagedManifest
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Already immutable, all the way down
+_IMMUTABLE_TYPES = (type(None), bool, int, long, float, complex, str, unicode)
+
+
+class ImmutableValueError(TypeError):
+    pass
+
+
+class UnfreezableValue(Exception):
+    pass
+
+
+def _immutable(name):
+    def method(self, *args, **kwargs):
+        raise ImmutableValueError("Can't %s a shared cached %s, thaw() it for a mutable copy" % (
+            name, type(self).__name__))
+    method.__name__ = name
+    return method
+
+
+class FrozenList(list):
+    """
+    A list that can't be changed.
+    """
+
+    __setitem__ = _immutable('__setitem__')
+    __delitem__ = _immutable('__delitem__')
+    __setslice__ = _immutable('__setslice__')
+    __delslice__ = _immutable('__delslice__')
+    __iadd__ = _immutable('__iadd__')
+    __imul__ = _immutable('__imul__')
+    append = _immutable('append')
+    extend = _immutable('extend')
+    insert = _immutable('insert')
+    pop = _immutable('pop')
+    remove = _immutable('remove')
+    reverse = _immutable('reverse')
+    sort = _immutable('sort')
+
+    def __reduce__(self):
+        # The default pickling appends the items after creating the list
+        return (FrozenList, (list(self),))
+
+
+class FrozenDict(dict):
+    """
+    A dict that can't be changed.
+    """
+
+    __setitem__ = _immutable('__setitem__')
+    __delitem__ = _immutable('__delitem__')
+    clear = _immutable('clear')
+    pop = _immutable('pop')
+    popitem = _immutable('popitem')
+    setdefault = _immutable('setdefault')
+    update = _immutable('update')
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value):
+    """
+    Returns a frozen copy of value (value itself if it's already immutable). Raises an
+    UnfreezableValue for values that can't be frozen.
+    """
+    if isinstance(value, _IMMUTABLE_TYPES) or type(value) in (FrozenList, FrozenDict):
+        return value
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return FrozenDict((freeze(key), freeze(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(item) for item in value)
+    if isinstance(value, bytearray):
+        return str(value)
+    if isinstance(value, tuple):
+        items = [freeze(item) for item in value]
+        if type(value) is tuple:
+            return tuple(items)
+        if hasattr(value, '_fields'):
+            return type(value)(*items)
+    raise UnfreezableValue("Can't freeze %s values" % type(value).__name__)
+
+
+def thaw(value):
+    """
+    Returns a mutable deep copy of a frozen value (frozensets come back as sets, tuples stay
+    tuples).
+    """
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    if isinstance(value, dict):
+        return dict((key, thaw(item)) for key, item in value.items())
+    if isinstance(value, (set, frozenset)):
+        return set(thaw(item) for item in value)
+    if isinstance(value, tuple):
+        items = [thaw(item) for item in value]
+        return type(value)(*items) if hasattr(value, '_fields') else tuple(items)
+    return value
+
+
+def freeze_cached(cached):
+    """
+    Freezes what's cached for a wrapped call: its value, possibly in a DependentValue. Paged
+    manifests are left as they are.
+    """
+    if isinstance(cached, DependentValue):
+        return DependentValue(freeze_cached(cached.value), cached.dependencies)
+    if isinstance(cached, PagedManifest):
+        return cached
+    return freeze(cached)
+
+
+_local_tier = None
+_lock = threading.Lock()
+
+
+def local_tier():
+    """
+    The local tier shared by every immutable=True function.
+    """
+    global _local_tier
+    if _local_tier is None:
+        with _lock:
+            if _local_tier is None:
+                max_bytes = get_setting_default('GEN_CACHE_IMMUTABLE_MAX_BYTES', DEFAULT_MAX_BYTES)
+                _local_tier = LocalLRUCache(max_items=None, max_bytes=max_bytes)
+    return _local_tier
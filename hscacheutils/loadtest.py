@@ -0,0 +1,276 @@
+"""
+A load generator for gen_cache.wrap: many threads (or processes) make requests of synthetic
+wrapped calls, with Zipfian portal and item distributions, a mix of value sizes and
+invalidations of both the static and the per-portal generation, against an in-memory backend
+or a memcache emulator. Reports throughput, p50/p99 request latency, the hit ratio and the
+backend ops per request.
+
+    python -m hscacheutils.loadtest --workers 16 --requests 100000 --invalidation-rate 0.01
+    python -m hscacheutils.loadtest --backend emulator --processes --workers 8 --zipf 1.2
+
+Or from code:
+
+    from hscacheutils.loadtest import LoadTestConfig, run_load_test
+
+    print run_load_test(LoadTestConfig(workers=8, requests=10000, backend='emulator'))
+
+Each request makes calls_per_request calls of a function wrapped with a static ('loadtest')
+and a dynamic ('loadtest_portal:portal_id') generation. With probability invalidation_rate a
+request also invalidates one of them, the static one static_invalidation_share of the time.
+Each item has a fixed value size, drawn from value_sizes (a list of (bytes, weight)).
+
+The in-memory backend isn't shared between processes (each process gets its own), use the
+emulator (or --servers for a real memcached) to load test with processes.
+"""
+
+import bisect
+import random
+import sys
+import threading
+
+from multiprocessing.pool import Pool, ThreadPool
+from optparse import OptionParser
+from time import sleep, time
+
+from hscacheutils import raw_cache
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+
+
+LOCAL_BACKEND = 'local'
+EMULATOR_BACKEND = 'emulator'
+MEMCACHE_BACKEND = 'memcache'
+
+DEFAULT_VALUE_SIZES = [(100, 0.7), (2000, 0.25), (50000, 0.05)]
+
+
+class LoadTestConfig(object):
+
+    def __init__(self, workers=8, use_processes=False, requests=10000, calls_per_request=5, portals=1000,
+                 items=10000, zipf=1.1, invalidation_rate=0.01, static_invalidation_share=0.05,
+                 value_sizes=None, compute_time=0.001, backend=LOCAL_BACKEND, servers=None, seed=None):
+        self.workers = workers
+        self.use_processes = use_processes
+        self.requests = requests
+        self.calls_per_request = calls_per_request
+        self.portals = portals
+        self.items = items
+        self.zipf = zipf
+        self.invalidation_rate = invalidation_rate
+        self.static_invalidation_share = static_invalidation_share
+        self.value_sizes = value_sizes or DEFAULT_VALUE_SIZES
+        self.compute_time = compute_time
+        self.backend = backend
+        self.servers = servers
+        self.seed = seed
+
+
+class ZipfSampler(object):
+    """
+    Samples 0..n-1, i with probability proportional to 1 / (i + 1) ** s.
+    """
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cdf = []
+        total = 0.0
+        for i in range(n):
+            total += 1.0 / (i + 1) ** s
+            self.cdf.append(total)
+        self.total = total
+
+    def sample(self):
+        return min(bisect.bisect(self.cdf, self.rng.random() * self.total), len(self.cdf) - 1)
+
+
+class WorkerResult(object):
+
+    def __init__(self):
+        self.latencies = []
+        self.calls = 0
+        self.computes = 0
+        self.invalidations = 0
+        self.backend_ops = 0
+
+
+class LoadTestReport(object):
+
+    def __init__(self, config, results, duration):
+        self.config = config
+        self.duration = duration
+        latencies = sorted(latency for result in results for latency in result.latencies)
+        self.requests = len(latencies)
+        self.calls = sum(result.calls for result in results)
+        self.computes = sum(result.computes for result in results)
+        self.invalidations = sum(result.invalidations for result in results)
+        self.backend_ops = sum(result.backend_ops for result in results)
+
+        self.throughput = self.requests / duration if duration else 0
+        self.p50 = _percentile(latencies, 0.5)
+        self.p99 = _percentile(latencies, 0.99)
+        self.hit_ratio = 1 - float(self.computes) / self.calls if self.calls else 0
+        self.backend_ops_per_request = float(self.backend_ops) / self.requests if self.requests else 0
+
+    def __str__(self):
+        return ("%s requests in %.1fs (%.0f/s, %s %s): p50 %.2fms, p99 %.2fms, hit ratio %.1f%%, "
+                "%.1f backend ops per request, %s invalidations" % (
+                    self.requests, self.duration, self.throughput, self.config.workers,
+                    'processes' if self.config.use_processes else 'threads', self.p50 * 1000, self.p99 * 1000,
+                    self.hit_ratio * 100, self.backend_ops_per_request, self.invalidations))
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+_local = threading.local()
+
+
+class _CountingBackend(object):
+    """
+    Counts the calls made to the backend, per thread.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        method = getattr(self.backend, name)
+        if not callable(method):
+            return method
+
+        def counted(*args, **kwargs):
+            _local.backend_ops = getattr(_local, 'backend_ops', 0) + 1
+            return method(*args, **kwargs)
+        return counted
+
+
+@gen_cache.wrap('loadtest', 'loadtest_portal:portal_id', namespace='hscacheutils.loadtest.synthetic_call')
+def synthetic_call(portal_id, item_id, size, compute_time):
+    _local.computes = getattr(_local, 'computes', 0) + 1
+    if compute_time:
+        sleep(compute_time)
+    return 'x' * size
+
+
+def _item_sizes(config, rng):
+    sizes, weights = zip(*config.value_sizes)
+    cumulative = [sum(weights[:i + 1]) for i in range(len(weights))]
+    return [sizes[min(bisect.bisect(cumulative, rng.random() * cumulative[-1]), len(sizes) - 1)]
+            for item_id in range(config.items)]
+
+
+def _run_worker(job):
+    config, index, requests, item_sizes = job
+    rng = random.Random(None if config.seed is None else config.seed + index)
+    portals = ZipfSampler(config.portals, config.zipf, rng)
+    items = ZipfSampler(config.items, config.zipf, rng)
+
+    _local.computes = _local.backend_ops = 0
+    result = WorkerResult()
+    for request in xrange(requests):
+        start = time()
+        for call in range(config.calls_per_request):
+            item_id = items.sample()
+            synthetic_call(portals.sample(), item_id, item_sizes[item_id], config.compute_time)
+        if rng.random() < config.invalidation_rate:
+            if rng.random() < config.static_invalidation_share:
+                gen_cache.invalidate('loadtest')
+            else:
+                gen_cache.invalidate('loadtest_portal:portal_id', portal_id=portals.sample())
+            result.invalidations += 1
+        result.latencies.append(time() - start)
+
+    result.calls = requests * config.calls_per_request
+    result.computes = _local.computes
+    result.backend_ops = _local.backend_ops
+    return result
+
+
+def _install_process_backend(servers):
+    # In worker processes, the in-memory backend is per process
+    backend = raw_cache.build_memcached_cache(servers) if servers else LocalLRUCache(max_items=1000000)
+    raw_cache.set_backend(_CountingBackend(backend))
+
+
+def run_load_test(config):
+    """
+    Runs the load test described by config (a LoadTestConfig), returning a LoadTestReport.
+    """
+    emulator = None
+    servers = config.servers
+    if config.backend == EMULATOR_BACKEND:
+        from hscacheutils.memcache_emulator import MemcacheEmulator
+        emulator = MemcacheEmulator().start()
+        servers = emulator.servers
+    elif config.backend == MEMCACHE_BACKEND and not servers:
+        raise ValueError("The memcache backend needs servers")
+
+    backend = raw_cache.build_memcached_cache(servers) if servers else LocalLRUCache(max_items=1000000)
+    previous = raw_cache.set_backend(_CountingBackend(backend))
+
+    item_sizes = _item_sizes(config, random.Random(config.seed))
+    per_worker = [config.requests // config.workers + (1 if i < config.requests % config.workers else 0)
+                  for i in range(config.workers)]
+    jobs = [(config, i, requests, item_sizes) for i, requests in enumerate(per_worker)]
+
+    if config.use_processes:
+        pool = Pool(config.workers, initializer=_install_process_backend, initargs=(servers,))
+    else:
+        pool = ThreadPool(config.workers)
+
+    try:
+        start = time()
+        results = pool.map(_run_worker, jobs)
+        duration = time() - start
+    finally:
+        pool.close()
+        pool.join()
+        raw_cache.set_backend(previous)
+        if emulator is not None:
+            emulator.stop()
+
+    return LoadTestReport(config, results, duration)
+
+
+def main(argv=None):
+    parser = OptionParser(usage="python -m hscacheutils.loadtest [options]")
+    parser.add_option('--workers', type='int', default=8)
+    parser.add_option('--processes', action='store_true', default=False, help="workers are processes instead of threads")
+    parser.add_option('--requests', type='int', default=10000, help="requests, across all the workers")
+    parser.add_option('--calls-per-request', type='int', default=5)
+    parser.add_option('--portals', type='int', default=1000)
+    parser.add_option('--items', type='int', default=10000)
+    parser.add_option('--zipf', type='float', default=1.1, help="skew of the portal and item distributions")
+    parser.add_option('--invalidation-rate', type='float', default=0.01, help="fraction of requests invalidating")
+    parser.add_option('--static-invalidation-share', type='float', default=0.05,
+                      help="fraction of the invalidations bumping the static generation")
+    parser.add_option('--value-sizes', default=None, help="size:weight,... (eg. 100:0.7,2000:0.25,50000:0.05)")
+    parser.add_option('--compute-time', type='float', default=0.001, help="seconds per miss")
+    parser.add_option('--backend', default=LOCAL_BACKEND, choices=[LOCAL_BACKEND, EMULATOR_BACKEND, MEMCACHE_BACKEND])
+    parser.add_option('--servers', default=None, help="memcache servers for the memcache backend, comma separated")
+    parser.add_option('--seed', type='int', default=None)
+    options, args = parser.parse_args(argv)
+
+    if args:
+        parser.error("unexpected arguments")
+
+    value_sizes = None
+    if options.value_sizes:
+        value_sizes = [(int(size), float(weight)) for size, weight in
+                       (pair.split(':') for pair in options.value_sizes.split(','))]
+
+    config = LoadTestConfig(workers=options.workers, use_processes=options.processes, requests=options.requests,
+                            calls_per_request=options.calls_per_request, portals=options.portals, items=options.items,
+                            zipf=options.zipf, invalidation_rate=options.invalidation_rate,
+                            static_invalidation_share=options.static_invalidation_share, value_sizes=value_sizes,
+                            compute_time=options.compute_time, backend=options.backend,
+                            servers=options.servers.split(',') if options.servers else None, seed=options.seed)
+    sys.stdout.write("%s\n" % run_load_test(config))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+A thread-safe, size-bounded, in-process LRU cache with the same interface as the raw cache
+(get, set, get_many, set_many, add, incr, delete, gets/cas). Used for the process-local copies kept
+around by the caching code. PickledLocalCache keeps values pickled, so that every get returns
+a copy of its own.
+
+Bounded by items, and optionally by bytes (max_bytes), as measured by deep_sizeof: the memory
+taken by the value and everything it references, counting shared objects once.
+"""
+
+import cPickle as pickle
+import sys
+import threading
+
+from collections import OrderedDict
+from time import time
+
+
+def deep_sizeof(value):
+    """
+    The bytes taken by value and the objects it references (container items, dict keys and values,
+    instance attributes), each object counted once.
+    """
+    seen = set()
+    size = 0
+    pending = [value]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            pending.extend(obj)
+        if hasattr(obj, '__dict__') and not isinstance(obj, type):
+            pending.append(obj.__dict__)
+        for slot in getattr(type(obj), '__slots__', ()):
+            if hasattr(obj, slot):
+                pending.append(getattr(obj, slot))
+    return size
+
+
+class LocalLRUCache(object):
+    """
+    max_items (None for no limit) and max_bytes (None for no limit) bound the items kept, least
+    recently used ones are evicted first. Items bigger than max_bytes on their own aren't kept.
+    sizeof measures the values (deep_sizeof by default), keys are counted too.
+    """
+
+    def __init__(self, max_items=1000, default_timeout=None, max_bytes=None, sizeof=deep_sizeof):
+        self.max_items = max_items
+        self.default_timeout = default_timeout
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self._sizes = dict()
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires_at(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if timeout is None:
+            return None
+        return time() + timeout
+
+    def _get(self, key):
+        # Must be called with the lock held
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time():
+            self._remove(key)
+            return None
+
+        # Move to the most recently used end
+        del self._items[key]
+        self._items[key] = entry
+        return entry
+
+    def _size(self, key, value):
+        # Measured outside of the lock, deep_sizeof walks the whole value
+        if self.max_bytes is None:
+            return None
+        return sys.getsizeof(key) + self.sizeof(value)
+
+    def _remove(self, key):
+        # Must be called with the lock held
+        self._items.pop(key, None)
+        self.bytes -= self._sizes.pop(key, 0)
+
+    def _set(self, key, value, timeout, size=None):
+        # Must be called with the lock held
+        self._remove(key)
+        if size is not None:
+            if size > self.max_bytes:
+                return
+            self._sizes[key] = size
+            self.bytes += size
+        self._items[key] = (value, self._expires_at(timeout))
+
+        while ((self.max_items is not None and len(self._items) > self.max_items) or
+               (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            self._remove(next(iter(self._items)))
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._get(key)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def get_many(self, keys):
+        result = {}
+        with self._lock:
+            for key in keys:
+                entry = self._get(key)
+                if entry is not None:
+                    result[key] = entry[0]
+        return result
+
+    def set(self, key, value, timeout=None):
+        size = self._size(key, value)
+        with self._lock:
+            self._set(key, value, timeout, size)
+
+    def set_many(self, vals_by_key, timeout=None):
+        sizes = dict((key, self._size(key, value)) for key, value in vals_by_key.items())
+        with self._lock:
+            for key, value in vals_by_key.items():
+                self._set(key, value, timeout, sizes[key])
+
+    def add(self, key, value, timeout=None):
+        size = self._size(key, value)
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, value, timeout, size)
+            return True
+
+    def gets(self, key):
+        """
+        Returns (value, token), where token is what cas needs to check the key didn't change.
+        """
+        with self._lock:
+            entry = self._get(key)
+        if entry is None:
+            return None, None
+        return entry[0], entry
+
+    def cas(self, key, value, token, timeout=None):
+        """
+        Stores value if key didn't change since the gets that returned token (or, with a None
+        token, if key doesn't exist). Returns whether it was stored.
+        """
+        size = self._size(key, value)
+        with self._lock:
+            if self._get(key) is not token:
+                return False
+            self._set(key, value, timeout, size)
+            return True
+
+    def incr(self, key, delta=1):
+        with self._lock:
+            entry = self._get(key)
+            if entry is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = entry[0] + delta
+            self._items[key] = (value, entry[1])
+            if key in self._sizes:
+                size = self._size(key, value)
+                self.bytes += size - self._sizes[key]
+                self._sizes[key] = size
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+
+class PickledLocalCache(LocalLRUCache):
+    """
+    A LocalLRUCache storing values pickled, for tiers serving values that callers may mutate:
+    every hit unpickles a fresh copy (still skipping the round trip), instead of handing out one
+    shared object.
+    """
+
+    def get(self, key, default=None):
+        pickled = super(PickledLocalCache, self).get(key)
+        if pickled is None:
+            return default
+        return pickle.loads(pickled)
+
+    def get_many(self, keys):
+        return dict((key, pickle.loads(pickled))
+                    for key, pickled in super(PickledLocalCache, self).get_many(keys).items())
+
+    def set(self, key, value, timeout=None):
+        super(PickledLocalCache, self).set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), timeout)
+
+    def set_many(self, vals_by_key, timeout=None):
+        super(PickledLocalCache, self).set_many(
+            dict((key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) for key, value in vals_by_key.items()), timeout)
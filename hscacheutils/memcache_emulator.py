@@ -0,0 +1,398 @@
+"""
+An in-process TCP server speaking the memcache text protocol, so that latency and resilience
+work can be tested offline. Unlike simple_memory_cache it has network costs, item size limits,
+LRU eviction and (optionally) injected latency and failures.
+
+Supported commands: get, gets, set, add, replace, append, prepend, cas, incr, decr, delete,
+touch, flush_all, stats, version and quit.
+
+Usage:
+
+    from hscacheutils.memcache_emulator import MemcacheEmulator, emulated_raw_cache
+
+    # Talk to it directly via the ClientPool
+    with MemcacheEmulator(latency=0.002, jitter=0.001) as emulator:
+        client = ClientPool.get(emulator.servers)
+
+    # Or install it behind hscacheutils.raw_cache (and so gen_cache) for the duration of a test
+    with emulated_raw_cache(drop_rate=0.05, memory_limit=1024 * 1024) as emulator:
+        ...
+
+With pytest, importing `memcache_emulator` into a conftest.py makes it available as a fixture
+(that yields the running emulator installed behind raw_cache).
+"""
+
+import random
+import socket
+import SocketServer
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from time import sleep, time
+
+from hscacheutils import raw_cache
+
+
+# Same as memcached's defaults
+DEFAULT_ITEM_SIZE_LIMIT = 1024 * 1024
+DEFAULT_MEMORY_LIMIT = 64 * 1024 * 1024
+
+# Roughly what memcached spends per item on top of the key and the value
+ITEM_OVERHEAD = 50
+
+# Memcached treats expiration times larger than this as unix timestamps
+RELATIVE_EXPIRATION_LIMIT = 60 * 60 * 24 * 30
+
+STORAGE_COMMANDS = set(['set', 'add', 'replace', 'append', 'prepend', 'cas'])
+
+
+class _Item(object):
+    __slots__ = ('flags', 'expires_at', 'data', 'cas_unique')
+
+    def __init__(self, flags, expires_at, data, cas_unique):
+        self.flags = flags
+        self.expires_at = expires_at
+        self.data = data
+        self.cas_unique = cas_unique
+
+
+class EmulatedStore(object):
+    """
+    The data behind an emulator, an LRU ordered dict of items limited by total memory.
+    """
+
+    def __init__(self, item_size_limit=DEFAULT_ITEM_SIZE_LIMIT, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.item_size_limit = item_size_limit
+        self.memory_limit = memory_limit
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+        self.memory_used = 0
+        self.next_cas_unique = 1
+        self.stats = dict(get_hits=0, get_misses=0, cmd_get=0, cmd_set=0, evictions=0, curr_items=0)
+
+    def _size(self, key, data):
+        return len(key) + len(data) + ITEM_OVERHEAD
+
+    def _expires_at(self, exptime):
+        if exptime == 0:
+            return None
+        if exptime < 0:
+            return 0
+        if exptime > RELATIVE_EXPIRATION_LIMIT:
+            return exptime
+        return time() + exptime
+
+    def _live_item(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if item.expires_at is not None and item.expires_at <= time():
+            self._remove(key)
+            return None
+        return item
+
+    def _remove(self, key):
+        item = self.items.pop(key)
+        self.memory_used -= self._size(key, item.data)
+
+    def _store(self, key, flags, exptime, data):
+        size = self._size(key, data)
+        if key in self.items:
+            self._remove(key)
+
+        while self.items and self.memory_used + size > self.memory_limit:
+            oldest_key = next(iter(self.items))
+            self._remove(oldest_key)
+            self.stats['evictions'] += 1
+
+        self.items[key] = _Item(flags, self._expires_at(exptime), data, self.next_cas_unique)
+        self.next_cas_unique += 1
+        self.memory_used += size
+
+    def get(self, keys):
+        """
+        Returns a list of (key, item) for all the keys found.
+        """
+        found = []
+        with self.lock:
+            for key in keys:
+                self.stats['cmd_get'] += 1
+                item = self._live_item(key)
+                if item is None:
+                    self.stats['get_misses'] += 1
+                    continue
+                self.stats['get_hits'] += 1
+                # Move to the most recently used end
+                del self.items[key]
+                self.items[key] = item
+                found.append((key, item))
+        return found
+
+    def store(self, command, key, flags, exptime, data, cas_unique=None):
+        """
+        Returns the protocol response for a storage command.
+        """
+        with self.lock:
+            self.stats['cmd_set'] += 1
+            item = self._live_item(key)
+
+            if command == 'add' and item is not None:
+                return 'NOT_STORED'
+            if command in ('replace', 'append', 'prepend') and item is None:
+                return 'NOT_STORED'
+            if command == 'cas':
+                if item is None:
+                    return 'NOT_FOUND'
+                if item.cas_unique != cas_unique:
+                    return 'EXISTS'
+            if command == 'append':
+                flags, data = item.flags, item.data + data
+            elif command == 'prepend':
+                flags, data = item.flags, data + item.data
+
+            if self._size(key, data) - ITEM_OVERHEAD > self.item_size_limit:
+                return 'SERVER_ERROR object too large for cache'
+
+            self._store(key, flags, exptime, data)
+            return 'STORED'
+
+    def incr(self, key, delta):
+        with self.lock:
+            item = self._live_item(key)
+            if item is None:
+                return 'NOT_FOUND'
+            try:
+                value = int(item.data)
+            except ValueError:
+                return 'CLIENT_ERROR cannot increment or decrement non-numeric value'
+
+            # Wraps around like memcached's unsigned 64 bit counters, decr stops at 0
+            value = max(0, value + delta) % (2 ** 64)
+            item.data = str(value)
+            item.cas_unique = self.next_cas_unique
+            self.next_cas_unique += 1
+            return item.data
+
+    def delete(self, key):
+        with self.lock:
+            if self._live_item(key) is None:
+                return 'NOT_FOUND'
+            self._remove(key)
+            return 'DELETED'
+
+    def touch(self, key, exptime):
+        with self.lock:
+            item = self._live_item(key)
+            if item is None:
+                return 'NOT_FOUND'
+            item.expires_at = self._expires_at(exptime)
+            return 'TOUCHED'
+
+    def flush(self):
+        with self.lock:
+            self.items.clear()
+            self.memory_used = 0
+
+    def current_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['curr_items'] = len(self.items)
+            stats['bytes'] = self.memory_used
+            stats['limit_maxbytes'] = self.memory_limit
+            return stats
+
+
+class _DroppedConnection(Exception):
+    pass
+
+
+class _MemcacheProtocolHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        emulator = self.server.emulator
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+
+            parts = line.strip().split()
+            if not parts:
+                continue
+
+            command = parts[0].lower()
+            if command == 'quit':
+                return
+
+            try:
+                emulator._inject(command)
+                response = self._dispatch(emulator.store, command, parts[1:])
+            except _DroppedConnection:
+                return
+
+            if response is not None:
+                self.wfile.write(response + '\r\n')
+
+    def _dispatch(self, store, command, args):
+        noreply = bool(args) and args[-1] == 'noreply'
+        if noreply:
+            args = args[:-1]
+
+        if command in ('get', 'gets'):
+            out = []
+            for key, item in store.get(args):
+                if command == 'gets':
+                    out.append('VALUE %s %d %d %d' % (key, item.flags, len(item.data), item.cas_unique))
+                else:
+                    out.append('VALUE %s %d %d' % (key, item.flags, len(item.data)))
+                out.append(item.data)
+            out.append('END')
+            return '\r\n'.join(out)
+
+        elif command in STORAGE_COMMANDS:
+            key, flags, exptime, length = args[0], int(args[1]), int(args[2]), int(args[3])
+            cas_unique = int(args[4]) if command == 'cas' else None
+            data = self.rfile.read(length + 2)[:length]
+            response = store.store(command, key, flags, exptime, data, cas_unique)
+
+        elif command in ('incr', 'decr'):
+            delta = int(args[1])
+            response = store.incr(args[0], delta if command == 'incr' else -delta)
+
+        elif command == 'delete':
+            response = store.delete(args[0])
+
+        elif command == 'touch':
+            response = store.touch(args[0], int(args[1]))
+
+        elif command == 'flush_all':
+            store.flush()
+            response = 'OK'
+
+        elif command == 'version':
+            response = 'VERSION hscacheutils-emulator'
+
+        elif command == 'stats':
+            lines = ['STAT %s %s' % (name, value) for name, value in sorted(store.current_stats().items())]
+            return '\r\n'.join(lines + ['END'])
+
+        else:
+            response = 'ERROR'
+
+        if noreply:
+            return None
+        return response
+
+
+class _ThreadedServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MemcacheEmulator(object):
+    """
+    A memcache server running on a background thread of this process.
+
+    latency is the number of seconds every command takes, either a number or a dict of
+    command name => seconds (eg. {'get': 0.001, 'set': 0.002}), plus a random 0 to jitter
+    seconds on top. drop_rate is the fraction of commands for which the connection is
+    dropped without a response, item_size_limit is the largest value (in bytes) that can be
+    stored and memory_limit the total bytes stored before the least recently used items
+    are evicted.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, jitter=0, drop_rate=0,
+                 item_size_limit=DEFAULT_ITEM_SIZE_LIMIT, memory_limit=DEFAULT_MEMORY_LIMIT):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.store = EmulatedStore(item_size_limit=item_size_limit, memory_limit=memory_limit)
+        self.dropped = 0
+        self._server = None
+        self._thread = None
+
+    @property
+    def address(self):
+        return '%s:%s' % (self.host, self.port)
+
+    @property
+    def servers(self):
+        return [self.address]
+
+    def start(self):
+        self._server = _ThreadedServer((self.host, self.port), _MemcacheProtocolHandler)
+        self._server.emulator = self
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target=self._server.serve_forever, name='memcache-emulator-%s' % self.port)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def flush(self):
+        self.store.flush()
+
+    def stats(self):
+        stats = self.store.current_stats()
+        stats['dropped'] = self.dropped
+        return stats
+
+    def _inject(self, command):
+        if isinstance(self.latency, dict):
+            delay = self.latency.get(command, 0)
+        else:
+            delay = self.latency
+
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay:
+            sleep(delay)
+
+        if self.drop_rate and random.random() < self.drop_rate:
+            self.dropped += 1
+            raise _DroppedConnection()
+
+
+@contextmanager
+def emulated_raw_cache(**emulator_options):
+    """
+    Runs a MemcacheEmulator behind hscacheutils.raw_cache (and so behind gen_cache) for the
+    duration of the with block.
+    """
+    with MemcacheEmulator(**emulator_options) as emulator:
+        backend = raw_cache.build_memcached_cache(emulator.servers)
+        previous = raw_cache.set_backend(backend)
+        try:
+            yield emulator
+        finally:
+            raw_cache.set_backend(previous)
+            if hasattr(backend, 'close'):
+                backend.close()
+
+
+try:
+    import pytest
+except ImportError:
+    pytest = None
+
+if pytest is not None:
+    @pytest.fixture
+    def memcache_emulator():
+        with emulated_raw_cache() as emulator:
+            yield emulator
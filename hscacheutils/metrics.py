@@ -0,0 +1,56 @@
+"""
+Process-wide counters for the caching code (circuit breaker trips, absorbed invalidations,
+evicted generations, etc).
+
+    from hscacheutils import metrics
+
+    metrics.incr('circuit_breaker.trips')
+    metrics.get('circuit_breaker.trips')   # => 1
+    metrics.snapshot()                     # => {'circuit_breaker.trips': 1, ...}
+
+To forward the counters somewhere else (statsd, etc), install a hook that is called with
+(name, delta) on every increment:
+
+    metrics.set_hook(lambda name, delta: statsd.incr('hscacheutils.' + name, delta))
+"""
+
+import threading
+
+from collections import defaultdict
+
+
+_counters = defaultdict(int)
+_lock = threading.Lock()
+_hook = None
+
+
+def incr(name, delta=1):
+    with _lock:
+        _counters[name] += delta
+
+    if _hook is not None:
+        _hook(name, delta)
+
+
+def get(name):
+    return _counters.get(name, 0)
+
+
+def snapshot(prefix=''):
+    with _lock:
+        return dict((name, value) for name, value in _counters.items() if name.startswith(prefix))
+
+
+def reset(prefix=''):
+    with _lock:
+        for name in [name for name in _counters if name.startswith(prefix)]:
+            del _counters[name]
+
+
+def set_hook(hook):
+    """
+    Installs a function called with (name, delta) on every increment, returning the previous one.
+    """
+    global _hook
+    previous, _hook = _hook, hook
+    return previous
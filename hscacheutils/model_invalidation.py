@@ -0,0 +1,308 @@
+"""
+Invalidation driven by django model signals: declare which generations a model's rows feed
+(and through which of its fields), and saves, deletes and m2m changes bump just the
+generations of the rows and fields that actually changed.
+
+    from hscacheutils.model_invalidation import model_invalidation
+
+    # contact_id is the contact's id, invalidated when its name or email change
+    model_invalidation.register(Contact, 'contact:contact_id', contact_id='id', fields=['name', 'email'])
+    # portal_id is the contact's portal_id, invalidated on every save (and for both portals when
+    # a contact moves)
+    model_invalidation.register(Contact, 'contacts_portal:portal_id')
+    # m2m fields work too
+    model_invalidation.register(Contact, 'contact_lists:contact_id', contact_id='id', fields=['lists'])
+
+Generation parameters are read from the attribute of the same name unless mapped to another
+attribute (or to a function of the instance). Field values are snapshotted when instances are
+loaded, so only the fields that differ on save count as changed.
+
+Bumps made inside a transaction (eg. with ATOMIC_REQUESTS) are deferred until the outermost
+atomic block commits, and sent in one gen_cache.invalidate_many (dropped if it rolls back), so
+that concurrent readers can't re-cache data from before the commit under the new generations.
+Outside of transactions, bumps are made as they happen, unless inside
+model_invalidation.atomic() (a transaction.atomic whose bumps are sent together once it's done)
+or model_invalidation.batch():
+
+    with model_invalidation.atomic():
+        contact.save()
+        other_contact.delete()
+
+Deferring to the commit needs transaction.on_commit (Django 1.9+). With older versions, bumps
+made inside transactions other than model_invalidation.atomic() ones happen right away, before
+the commit: a reader racing the commit can cache the old rows under the new generations, until
+the next bump or the timeout.
+
+QuerySet.update() and bulk_create() don't send signals, use model_invalidation.update(queryset,
+**values) and model_invalidation.bulk_create(model, instances) instead. Clearing an m2m relation
+from its reverse side (the side the field isn't declared on) isn't tracked.
+"""
+
+import threading
+
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import signals
+
+from hscacheutils.generational_cache import gen_cache, parse_generation
+
+
+class _Registration(object):
+
+    def __init__(self, model, generation, fields, params):
+        self.generation = generation
+        self.dynamic_param = parse_generation(generation)[1]
+        if self.dynamic_param is not None:
+            self.source = params.get(self.dynamic_param, self.dynamic_param)
+
+        self.attnames = []
+        self.m2m_fields = []
+        for name in fields or ():
+            field = model._meta.get_field(name)
+            if field in model._meta.many_to_many:
+                self.m2m_fields.append(name)
+            else:
+                self.attnames.append(field.attname)
+        self.any_field = fields is None
+
+    def kwargs_for(self, instance):
+        if self.dynamic_param is None:
+            return {}
+        if callable(self.source):
+            return {self.dynamic_param: self.source(instance)}
+        return {self.dynamic_param: getattr(instance, self.source)}
+
+    def watches(self, field_names):
+        return self.any_field or bool(set(field_names) & set(self.attnames + self.m2m_fields))
+
+    def moves_with(self, field_names):
+        """
+        Whether changing field_names can move rows from one generation to another.
+        """
+        if self.dynamic_param is None:
+            return False
+        return callable(self.source) or self.source in field_names
+
+
+class _Snapshot(object):
+    __slots__ = ('values', 'kwargs')
+
+    def __init__(self, values, kwargs):
+        self.values = values
+        self.kwargs = kwargs
+
+
+class ModelInvalidationRegistry(object):
+
+    def __init__(self, invalidator=None):
+        self.invalidator = invalidator or gen_cache
+        self._registrations = dict()
+        self._local = threading.local()
+        # Where instances keep this registry's snapshot of their values
+        self._snapshot_attr = '_hscacheutils_snapshot_%x' % id(self)
+
+    def register(self, model, generation, fields=None, **params):
+        """
+        Invalidates generation when rows of model are created, deleted, or have one of fields
+        changed (or on every save if fields is None). params map the generation's dynamic
+        parameter to an attribute of the instance, or to a function of it.
+        """
+        registration = _Registration(model, generation, fields, params)
+        if model not in self._registrations:
+            self._registrations[model] = []
+            self._connect(model)
+        self._registrations[model].append(registration)
+
+        for name in registration.m2m_fields:
+            through = getattr(model, name).through
+            signals.m2m_changed.connect(self._m2m_handler(model, name), sender=through, weak=False,
+                                        dispatch_uid='hscacheutils.model_invalidation.%s.%s.%s' % (id(self), id(model), name))
+
+    def _connect(self, model):
+        uid = 'hscacheutils.model_invalidation.%s.%s' % (id(self), id(model))
+        signals.post_init.connect(self._post_init, sender=model, weak=False, dispatch_uid=uid)
+        signals.post_save.connect(self._post_save, sender=model, weak=False, dispatch_uid=uid)
+        signals.post_delete.connect(self._post_delete, sender=model, weak=False, dispatch_uid=uid)
+
+    def _snapshot(self, instance):
+        registrations = self._registrations[type(instance)]
+        values = dict((attname, getattr(instance, attname, None))
+                      for registration in registrations for attname in registration.attnames)
+        return _Snapshot(values, [registration.kwargs_for(instance) for registration in registrations])
+
+    def _post_init(self, sender, instance, **kwargs):
+        setattr(instance, self._snapshot_attr, self._snapshot(instance))
+
+    def _post_save(self, sender, instance, created, **kwargs):
+        registrations = self._registrations[sender]
+        old = getattr(instance, self._snapshot_attr, None)
+        new = self._snapshot(instance)
+        setattr(instance, self._snapshot_attr, new)
+
+        # Without a snapshot (or with one taken before some registrations), anything could have changed
+        if created or old is None or len(old.kwargs) != len(new.kwargs):
+            self._invalidate_all(registrations, new.kwargs)
+            return
+
+        changed = [attname for attname, value in new.values.items() if old.values.get(attname) != value]
+        invalidations = []
+        for i, registration in enumerate(registrations):
+            if old.kwargs[i] != new.kwargs[i]:
+                # Moved from one generation to another, both change
+                invalidations.append((registration.generation, old.kwargs[i]))
+                invalidations.append((registration.generation, new.kwargs[i]))
+            elif registration.watches(changed):
+                invalidations.append((registration.generation, new.kwargs[i]))
+        self.invalidate(invalidations)
+
+    def _post_delete(self, sender, instance, **kwargs):
+        registrations = self._registrations[sender]
+        self._invalidate_all(registrations, [registration.kwargs_for(instance) for registration in registrations])
+
+    def _m2m_handler(self, model, name):
+        def handler(sender, instance, action, reverse, pk_set, **kwargs):
+            if action not in ('post_add', 'post_remove', 'post_clear'):
+                return
+            if not reverse:
+                instances = [instance]
+            elif pk_set:
+                instances = list(model._default_manager.filter(pk__in=pk_set))
+            else:
+                instances = []
+
+            invalidations = []
+            for registration in self._registrations[model]:
+                if registration.watches([name]):
+                    invalidations.extend((registration.generation, registration.kwargs_for(related)) for related in instances)
+            self.invalidate(invalidations)
+        return handler
+
+    def _invalidate_all(self, registrations, all_kwargs):
+        self.invalidate([(registration.generation, kwargs) for registration, kwargs in zip(registrations, all_kwargs)])
+
+    def invalidate(self, invalidations):
+        """
+        Bumps the (generation, kwargs) invalidations, now or at the end of the current batch.
+        """
+        if not invalidations:
+            return
+
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.extend(invalidations)
+        else:
+            self._bump(invalidations)
+
+    def _bump(self, invalidations):
+        if not self._defer_to_commit(invalidations):
+            self.invalidator.invalidate_many(_unique(invalidations))
+
+    def _defer_to_commit(self, invalidations):
+        """
+        Queues invalidations made inside a transaction, to be bumped together once the outermost
+        atomic block commits. Returns whether it did (only with transaction.on_commit).
+        """
+        on_commit = getattr(transaction, 'on_commit', None)
+        if on_commit is None:
+            return False
+        connection = transaction.get_connection()
+        if not connection.in_atomic_block:
+            return False
+
+        deferred = getattr(self._local, 'deferred', None)
+        # Rolled back transactions drop their callbacks, and a new transaction needs its own
+        if deferred is None or not any(callback[1] is deferred[0] for callback in connection.run_on_commit):
+            queued = []
+
+            def bump():
+                if getattr(self._local, 'deferred', None) is not None and self._local.deferred[1] is queued:
+                    self._local.deferred = None
+                self.invalidator.invalidate_many(_unique(queued))
+
+            deferred = self._local.deferred = (bump, queued)
+            on_commit(bump)
+        deferred[1].extend(invalidations)
+        return True
+
+    @contextmanager
+    def batch(self):
+        """
+        Collects the invalidations made inside, and bumps them in one invalidate_many on the way
+        out (even on errors, since some of the changes might have been committed). Nested
+        batches join the outer one.
+        """
+        if getattr(self._local, 'pending', None) is not None:
+            yield
+            return
+
+        self._local.pending = []
+        try:
+            yield
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            if pending:
+                self._bump(pending)
+
+    @contextmanager
+    def atomic(self, using=None):
+        """
+        A transaction.atomic whose invalidations are bumped together after it commits (after the
+        outermost atomic block commits, when nested in one and transaction.on_commit is there).
+        """
+        with self.batch():
+            with transaction.atomic(using=using):
+                yield
+
+    def update(self, queryset, **values):
+        """
+        queryset.update(**values), invalidating what it changes. Loads the rows to update.
+        """
+        model = queryset.model
+        updated_fields = set()
+        for name in values:
+            field = model._meta.get_field(name)
+            updated_fields.update([field.name, field.attname])
+        # Rows whose generation parameter changes move generations, even if the fields aren't watched
+        registrations = [registration for registration in self._registrations.get(model, [])
+                         if registration.watches(updated_fields) or registration.moves_with(updated_fields)]
+        if not registrations:
+            return queryset.update(**values)
+
+        with self.batch():
+            instances = list(queryset)
+            updated = queryset.update(**values)
+            reloaded = model._default_manager.in_bulk([instance.pk for instance in instances])
+
+            invalidations = []
+            for instance in instances:
+                for registration in registrations:
+                    invalidations.append((registration.generation, registration.kwargs_for(instance)))
+                    if instance.pk in reloaded:
+                        invalidations.append((registration.generation, registration.kwargs_for(reloaded[instance.pk])))
+            self.invalidate(invalidations)
+        return updated
+
+    def bulk_create(self, model, instances):
+        """
+        model.objects.bulk_create(instances), invalidating the generations of the new rows.
+        """
+        created = model._default_manager.bulk_create(instances)
+        registrations = self._registrations.get(model, [])
+        self.invalidate([(registration.generation, registration.kwargs_for(instance))
+                         for instance in instances for registration in registrations])
+        return created
+
+
+def _unique(invalidations):
+    seen = set()
+    unique = []
+    for generation, kwargs in invalidations:
+        key = (generation, tuple(sorted(kwargs.items())))
+        if key not in seen:
+            seen.add(key)
+            unique.append((generation, kwargs))
+    return unique
+
+
+model_invalidation = ModelInvalidationRegistry()
@@ -0,0 +1,311 @@
+"""
+Packed storage for CustomUseGenCache (opt in with packed=True): small values that share a
+generation vector are stored together, in a few hashed bucket items (each a dict of cache_key =>
+value), instead of one memcache item each. That saves memcache's per-item overhead on tiny
+values (flags, counts, ids), and many values are read with the same bucket fetch.
+
+    flags_cache = CustomUseGenCache(['portal_flags:portal_id'], timeout=3600, packed=True)
+
+    flags_cache.set(True, portal_id=53, cache_key='beta')
+    flags_cache.get(portal_id=53, cache_key='beta')
+
+Writes merge into the bucket with gets/cas, retrying when somebody else changed it in the
+meantime (and dropping the bucket, which only costs misses, if that keeps happening). Behind
+django's memcached cache, gets/cas go through its python-memcached client. Backends without
+gets/cas (eg. django's local memory cache) fall back to get + set, where concurrent writes can
+lose each other's values (again, only costing misses) and a concurrent delete can be undone.
+
+Buckets are kept under max_bucket_size pickled bytes (900KB by default, below memcached's 1MB
+item limit, past which the whole bucket would silently fail to be stored): a write that grows a
+bucket past it drops its largest other entries.
+
+Values that pickle to more than max_packed_size bytes are stored in their own item as usual,
+with a marker in the bucket (so reading them takes one more round trip).
+
+CustomUseGenCache.get_many fetches the generations of all its variants once, and all of their
+buckets with a single get_many.
+
+Invalidation works as usual: new generation values mean new bucket keys.
+"""
+
+import cPickle as pickle
+import logging
+import zlib
+
+from hscacheutils import metrics
+from hscacheutils.circuit_breaker import CacheUnavailable, current_circuit_breaker
+from hscacheutils.affinity import affine_key
+from hscacheutils.generational_cache import _backend_method, _cache_call, build_affinity_token, \
+    build_generation_cache_key_suffixes, generation_values_for_suffixes, gen_cache, sanitize_memcached_key
+from hscacheutils.raw_cache import cache as raw_cache, get_backend as get_raw_cache_backend
+
+
+DEFAULT_MAX_BUCKET_SIZE = 900 * 1024
+
+# Room for the key and the pickling overhead of an entry, on top of its value
+ENTRY_OVERHEAD = 256
+
+
+class Unpacked(object):
+    """
+    What's in a bucket for values too large to be packed.
+    """
+
+
+class _PythonMemcachedCas(object):
+    """
+    gets/cas through the python-memcached client behind django's MemcachedCache (which doesn't
+    expose them). The client is thread local, and so are its cas ids.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    @classmethod
+    def supports(cls, backend):
+        return getattr(getattr(backend, '_lib', None), '__name__', None) == 'memcache'
+
+    def _client(self):
+        client = self.backend._cache
+        client.cache_cas = True
+        return client
+
+    def gets(self, key):
+        key = self.backend.make_key(key)
+        client = self._client()
+        value = client.gets(key)
+        if value is None:
+            return None, None
+        return value, client.cas_ids.get(key)
+
+    def cas(self, key, value, token, timeout=None):
+        if token is None:
+            return bool(self.backend.add(key, value, timeout))
+        key = self.backend.make_key(key)
+        client = self._client()
+        client.cas_ids[key] = token
+        return bool(client.cas(key, value, self.backend._get_memcache_timeout(timeout)))
+
+
+def _cas_backend():
+    """
+    What gets/cas are called on: raw_cache if its backend has them, else the python-memcached
+    client of a django MemcachedCache, else None.
+    """
+    backend = get_raw_cache_backend()
+    if hasattr(backend, 'gets'):
+        return raw_cache
+    if _PythonMemcachedCas.supports(backend):
+        return _PythonMemcachedCas(backend)
+    return None
+
+
+def _cas_call(cas_backend, op, *args, **kwargs):
+    """
+    Same as _cache_call, on the cas_backend.
+    """
+    breaker = current_circuit_breaker()
+    if breaker is None:
+        return _backend_method(cas_backend, op)(*args, **kwargs)
+    return breaker.call(op, _backend_method(cas_backend, op), *args, **kwargs)
+
+
+class PackedBuckets(object):
+
+    def __init__(self, generation_names, buckets=16, max_packed_size=512, timeout=None, max_cas_attempts=5,
+                 max_bucket_size=DEFAULT_MAX_BUCKET_SIZE):
+        self.generation_names = generation_names
+        self.buckets = buckets
+        self.max_packed_size = max_packed_size
+        self.timeout = timeout
+        self.max_cas_attempts = max_cas_attempts
+        self.max_bucket_size = max_bucket_size
+
+    def _keys(self, kwargs, all_gen_values=None):
+        """
+        Returns (bucket key, key of the value within the bucket, key of the value on its own).
+        If all_gen_values (a dict of generation suffix => value) is passed in, it is used instead
+        of fetching the generations.
+        """
+        add_to_key = kwargs.pop('add_to_key', None)
+        affinity = kwargs.pop('affinity', None)
+        affinity_token = build_affinity_token(affinity, kwargs) if affinity else None
+
+        if all_gen_values is None:
+            suffixes = build_generation_cache_key_suffixes(self.generation_names, **kwargs)
+            all_gen_values = generation_values_for_suffixes(suffixes, affinity_token)
+
+        item_key = gen_cache.build_key_with_generation_values({}, add_to_key)
+        bucket = (zlib.crc32(item_key) & 0xffffffff) % self.buckets
+        bucket_key = sanitize_memcached_key('%s:packed%s' % (gen_cache.build_key_with_generation_values(all_gen_values), bucket))
+        unpacked_key = gen_cache.build_key_with_generation_values(all_gen_values, add_to_key)
+
+        return affine_key(bucket_key, affinity_token), item_key, affine_key(unpacked_key, affinity_token)
+
+    def get(self, **kwargs):
+        try:
+            bucket_key, item_key, unpacked_key = self._keys(kwargs)
+            value = (_cache_call('get', bucket_key) or {}).get(item_key)
+            if isinstance(value, Unpacked):
+                value = _cache_call('get', unpacked_key)
+        except CacheUnavailable:
+            return None
+
+        metrics.incr('packed.hits' if value is not None else 'packed.misses')
+        return value
+
+    def get_many(self, variants):
+        """
+        Gets many values at once, each variant being the kwargs of a get: their generations are
+        fetched once (per affinity token) and their buckets with a single get_many. Returns the
+        values in order.
+        """
+        try:
+            resolved = []
+            suffixes_by_affinity = dict()
+            for kwargs in variants:
+                kwargs = dict(kwargs)
+                affinity = kwargs.get('affinity')
+                affinity_token = build_affinity_token(affinity, kwargs) if affinity else None
+                suffixes = build_generation_cache_key_suffixes(self.generation_names, **kwargs)
+                resolved.append((kwargs, suffixes, affinity_token))
+                suffixes_by_affinity.setdefault(affinity_token, set()).update(suffixes)
+
+            gen_values_by_affinity = dict((affinity_token, generation_values_for_suffixes(list(suffixes), affinity_token))
+                                          for affinity_token, suffixes in suffixes_by_affinity.items())
+
+            keys = [self._keys(kwargs, dict((suffix, gen_values_by_affinity[affinity_token][suffix]) for suffix in suffixes))
+                    for kwargs, suffixes, affinity_token in resolved]
+            found = self.get_keys(keys)
+        except CacheUnavailable:
+            return [None] * len(variants)
+
+        values = [found.get(value_keys) for value_keys in keys]
+        misses = values.count(None)
+        metrics.incr('packed.hits', len(values) - misses)
+        metrics.incr('packed.misses', misses)
+        return values
+
+    def set(self, value, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+
+        try:
+            bucket_key, item_key, unpacked_key = self._keys(kwargs)
+
+            if len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) > self.max_packed_size:
+                _cache_call('set', unpacked_key, value, timeout)
+                value = Unpacked()
+
+            self._update_bucket(bucket_key, timeout, lambda bucket: bucket.__setitem__(item_key, value), [item_key])
+        except CacheUnavailable:
+            pass
+
+    def get_keys(self, keys):
+        """
+        Gets many values by their (bucket key, item key, unpacked key), see _keys, with a single
+        get_many of their buckets (and another of the values too large to be packed, if any).
+        Returns a dict of those keys => value, without the misses.
+        """
+        buckets = _cache_call('get_many', list(set(bucket_key for bucket_key, item_key, unpacked_key in keys)))
+
+        values = dict()
+        unpacked = []
+        for value_keys in keys:
+            bucket_key, item_key, unpacked_key = value_keys
+            value = (buckets.get(bucket_key) or {}).get(item_key)
+            if isinstance(value, Unpacked):
+                unpacked.append(value_keys)
+            elif value is not None:
+                values[value_keys] = value
+
+        if unpacked:
+            unpacked_values = _cache_call('get_many', [unpacked_key for bucket_key, item_key, unpacked_key in unpacked])
+            for value_keys in unpacked:
+                value = unpacked_values.get(value_keys[2])
+                if value is not None:
+                    values[value_keys] = value
+        return values
+
+    def set_keys(self, values, timeout=None):
+        """
+        Sets many values at once, values being a dict of (bucket key, item key, unpacked key) =>
+        value. Every bucket is updated once, and the values too large to be packed are stored with
+        a single set_many.
+        """
+        if timeout is None:
+            timeout = self.timeout
+
+        unpacked = dict()
+        items_by_bucket = dict()
+        for (bucket_key, item_key, unpacked_key), value in values.items():
+            if len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)) > self.max_packed_size:
+                unpacked[unpacked_key] = value
+                value = Unpacked()
+            items_by_bucket.setdefault(bucket_key, dict())[item_key] = value
+
+        if unpacked:
+            _cache_call('set_many', unpacked, timeout)
+        for bucket_key, items in items_by_bucket.items():
+            self._update_bucket(bucket_key, timeout, lambda bucket, items=items: bucket.update(items), items)
+
+    def delete(self, **kwargs):
+        try:
+            bucket_key, item_key, unpacked_key = self._keys(kwargs)
+            self._update_bucket(bucket_key, self.timeout, lambda bucket: bucket.pop(item_key, None))
+            _cache_call('delete', unpacked_key)
+        except CacheUnavailable:
+            pass
+
+    def _fit(self, bucket, written):
+        """
+        Drops entries (the largest first, other than the written ones) from a bucket that would
+        pickle to more than max_bucket_size.
+        """
+        if len(bucket) * (self.max_packed_size + ENTRY_OVERHEAD) <= self.max_bucket_size:
+            return
+        size = len(pickle.dumps(bucket, pickle.HIGHEST_PROTOCOL))
+        if size <= self.max_bucket_size:
+            return
+
+        metrics.incr('packed.bucket_overflows')
+        entry_sizes = sorted(((len(pickle.dumps((item_key, value), pickle.HIGHEST_PROTOCOL)), item_key)
+                              for item_key, value in bucket.items() if item_key not in written), reverse=True)
+        for entry_size, item_key in entry_sizes:
+            if size <= self.max_bucket_size:
+                break
+            del bucket[item_key]
+            size -= entry_size
+
+    def _update_bucket(self, bucket_key, timeout, update, written=()):
+        """
+        Applies update (which changes the bucket dict in place, writing the written item keys)
+        to the bucket, with gets/cas.
+        """
+        cas_backend = _cas_backend()
+        if cas_backend is None:
+            # No gets/cas in this backend
+            bucket = dict(_cache_call('get', bucket_key) or {})
+            update(bucket)
+            self._fit(bucket, written)
+            _cache_call('set', bucket_key, bucket, timeout)
+            return True
+
+        for attempt in range(self.max_cas_attempts):
+            current, token = _cas_call(cas_backend, 'gets', bucket_key)
+
+            bucket = dict(current or {})
+            update(bucket)
+            self._fit(bucket, written)
+            if _cas_call(cas_backend, 'cas', bucket_key, bucket, token, timeout):
+                return True
+            metrics.incr('packed.cas_retries')
+
+        # Too contended, dropping the bucket only costs misses
+        logging.warning("Could not update the packed bucket %s after %s attempts" % (bucket_key, self.max_cas_attempts))
+        metrics.incr('packed.cas_failures')
+        _cache_call('delete', bucket_key)
+        return False
@@ -0,0 +1,204 @@
+"""
+Lazy paged storage for large list results (opt in with gen_cache.wrap(..., page_size=500)).
+
+Lists (and tuples) longer than page_size are stored as fixed-size pages, plus a manifest under
+the usual key of the call. Such results are returned as a PagedList, a read only sequence (on
+hits and misses alike, so callers always get the same type). On hits it fetches the pages it
+needs on demand, so reading the first rows of a huge result only costs their page(s):
+
+    @gen_cache.wrap('contacts_portal:portal_id', page_size=500)
+    def get_contact_ids(portal_id):
+        ...
+
+    contact_ids = get_contact_ids(53)   # fetches the manifest only
+    contact_ids[:20]                    # fetches the first page
+    len(contact_ids)                    # from the manifest
+    for contact_id in contact_ids:      # fetches prefetch_pages pages at a time
+        ...
+    contact_ids + [1, 2]                # a list (or tuple, for tuple results)
+    list(contact_ids)                   # fetches all the pages
+
+A PagedList isn't a list: use list() (or tuple()) for code that needs one. Pickling it (eg. when
+it's part of the value of another wrapped function) pickles the plain list or tuple.
+
+Pages are keyed off the value key, so they are invalidated along with it. If a page went
+missing (evicted), the function is called again and its result stored and used instead. Page
+fetches and missing pages are counted in hscacheutils.metrics as "paging.page_fetches" and
+"paging.page_misses".
+"""
+
+from hscacheutils import metrics
+from hscacheutils.affinity import affine_key
+from hscacheutils.circuit_breaker import CacheUnavailable
+
+
+# Pages fetched at once when iterating
+DEFAULT_PREFETCH_PAGES = 4
+
+
+class PagedManifest(object):
+    """
+    What's stored under the key of a paged value.
+    """
+
+    def __init__(self, length, page_size, is_tuple=False):
+        self.length = length
+        self.page_size = page_size
+        self.is_tuple = is_tuple
+
+    @property
+    def pages(self):
+        return (self.length + self.page_size - 1) // self.page_size
+
+
+def pageable(value, page_size):
+    return isinstance(value, (list, tuple)) and len(value) > page_size
+
+
+def page_key(key, index):
+    from hscacheutils.generational_cache import sanitize_memcached_key
+    return affine_key(sanitize_memcached_key('%s:page%s' % (key, index)), getattr(key, 'affinity', None))
+
+
+def store_pages(key, value, page_size, timeout):
+    """
+    Stores the pages of value, returning the manifest to store under key (after them, so that a
+    manifest is never seen before its pages).
+    """
+    from hscacheutils.generational_cache import _cache_call
+    manifest = PagedManifest(len(value), page_size, isinstance(value, tuple))
+    _cache_call('set_many', dict((page_key(key, index), list(value[index * page_size:(index + 1) * page_size]))
+                                 for index in range(manifest.pages)), timeout)
+    return manifest
+
+
+class PagedList(object):
+    """
+    A read only sequence over the pages of a paged value. recompute is called (and must return
+    the whole value) when pages are missing. full is the whole value, when it's already known
+    (eg. it was just computed).
+    """
+
+    def __init__(self, key, manifest, recompute, prefetch_pages=DEFAULT_PREFETCH_PAGES, full=None):
+        self.key = key
+        self.manifest = manifest
+        self.recompute = recompute
+        self.prefetch_pages = prefetch_pages
+        self._pages = dict()
+        self._full = full
+
+    @classmethod
+    def of(cls, key, value, page_size, recompute):
+        """
+        A PagedList over a value that was just computed.
+        """
+        return cls(key, PagedManifest(len(value), page_size, isinstance(value, tuple)), recompute, full=value)
+
+    def __len__(self):
+        # The recomputed value may not be as long as the stored one was
+        if self._full is not None:
+            return len(self._full)
+        return self.manifest.length
+
+    def _kind(self):
+        return tuple if getattr(self.manifest, 'is_tuple', False) else list
+
+    def _fetch(self, indexes):
+        """
+        Makes sure the pages at indexes are loaded, in a single fetch.
+        """
+        missing = [index for index in indexes if index not in self._pages]
+        if self._full is not None or not missing:
+            return
+
+        from hscacheutils.generational_cache import _cache_call
+        keys = dict((page_key(self.key, index), index) for index in missing)
+        metrics.incr('paging.page_fetches', len(missing))
+        try:
+            pages = _cache_call('get_many', keys.keys())
+        except CacheUnavailable:
+            pages = {}
+
+        # Some backends return None for misses, rather than leaving them out
+        misses = len([key for key in keys if pages.get(key) is None])
+        if misses:
+            metrics.incr('paging.page_misses', misses)
+            self._full = self.recompute()
+            return
+        for fetched_key, index in keys.items():
+            self._pages[index] = pages[fetched_key]
+
+    def _item(self, i):
+        if self._full is not None:
+            return self._full[i]
+        return self._pages[i // self.manifest.page_size][i % self.manifest.page_size]
+
+    def __getitem__(self, i):
+        page_size = self.manifest.page_size
+
+        if isinstance(i, slice):
+            indexes = range(*i.indices(len(self)))
+            if indexes and self._full is None:
+                first, last = min(indexes), max(indexes)
+                self._fetch(range(first // page_size, last // page_size + 1))
+            if self._full is not None:
+                return self._full[i]
+            return self._kind()(self._item(index) for index in indexes)
+
+        if self._full is None:
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError("PagedList index out of range")
+            self._fetch([i // page_size])
+        if self._full is not None:
+            return self._full[i]
+        return self._item(i)
+
+    def __iter__(self):
+        page_size = self.manifest.page_size
+        i = 0
+        # len(self) is checked every time, recomputing may change it
+        while i < len(self):
+            if self._full is None and i % page_size == 0 and i // page_size not in self._pages:
+                self._fetch(range(i // page_size, min(i // page_size + self.prefetch_pages, self.manifest.pages)))
+            yield self._item(i)
+            i += 1
+
+    def __contains__(self, item):
+        return any(element == item for element in self)
+
+    def index(self, item):
+        for i, element in enumerate(self):
+            if element == item:
+                return i
+        raise ValueError("%r is not in PagedList" % (item,))
+
+    def count(self, item):
+        return sum(1 for element in self if element == item)
+
+    def __add__(self, other):
+        return self._kind()(self) + other
+
+    def __radd__(self, other):
+        return other + self._kind()(self)
+
+    def __mul__(self, n):
+        return self._kind()(self) * n
+
+    __rmul__ = __mul__
+
+    def __reduce__(self):
+        # Pickled as the plain value (the recompute function can't be pickled)
+        return (self._kind(), (list(self),))
+
+    def __eq__(self, other):
+        if not isinstance(other, (list, tuple, PagedList)):
+            return NotImplemented
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<PagedList of %s items (%s pages loaded)>' % (len(self), len(self._pages))
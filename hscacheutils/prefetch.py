@@ -0,0 +1,247 @@
+"""
+DataLoader-style prefetching: collects the cache lookups of many different wrapped functions and
+gen_cache/CustomUseGenCache gets into a tick, then resolves all of their generations with one
+get_many and all of their values with another, instead of two round trips per lookup.
+
+    from hscacheutils.prefetch import Prefetcher
+
+    prefetcher = Prefetcher()
+    contact = prefetcher.call(get_contact, 53, contact_id=1)      # a gen_cache.wrap'd function
+    nav = prefetcher.get(nav_cache, user_id=1, cache_key='top')  # a CustomUseGenCache
+    footer = prefetcher.get(gen_cache, 'footer', 'footer:portal_id', portal_id=53)
+
+    render(contact.get(), nav.get(), footer.get())
+
+Each lookup returns a PrefetchedValue. The first .get() on any of them resolves every pending
+lookup of the prefetcher at once (call prefetcher.resolve() to do it explicitly). Wrapped
+functions that missed are only computed (and cached) when their value is consumed. Lookups
+added after a resolve go into the next tick.
+
+Adaptive, wrap_batch'd, track_dependencies, paged and immutable functions, functions with live
+overrides (see hscacheutils.registry) and packed CustomUseGenCaches aren't prefetched, their
+.get() just calls them. Prefetched calls count in the hits and misses of their registry entries.
+"""
+
+from time import time
+
+from hscacheutils import metrics, trace
+from hscacheutils.affinity import affine_key
+from hscacheutils.circuit_breaker import CacheUnavailable, current_circuit_breaker
+from hscacheutils.generational_cache import _cache_call, _trace_sample_key, _uncached_fallback, build_affinity_token, \
+    build_generation_cache_key_suffixes, generation_values_for_suffixes, gen_cache, BatchGenFuncHelper, GenerationalCache, CustomUseGenCache
+
+
+_NOT_RESOLVED = object()
+
+
+class PrefetchedValue(object):
+
+    def __init__(self, prefetcher, generation_suffixes, affinity=None):
+        self.prefetcher = prefetcher
+        self.generation_suffixes = generation_suffixes
+        self.affinity = affinity
+        self.key = None
+        self._value = _NOT_RESOLVED
+
+    @property
+    def resolved(self):
+        return self._value is not _NOT_RESOLVED
+
+    def build_key(self, all_gen_values):
+        raise NotImplementedError
+
+    def found(self, key, value):
+        self.key = key
+        self._value = value
+
+    def unavailable(self):
+        self._value = None
+
+    def get(self):
+        if not self.resolved:
+            self.prefetcher.resolve()
+        return self._value
+
+
+class _PrefetchedCall(PrefetchedValue):
+    """
+    A call to a gen_cache.wrap'd function.
+    """
+
+    def __init__(self, prefetcher, wrapped, args, kwargs):
+        self.wrapped = wrapped
+        self.func_helper = wrapped.func_helper
+        self.args = args
+        self.kwargs = kwargs
+        self._computed = False
+        self._cache_unavailable = False
+        super(_PrefetchedCall, self).__init__(prefetcher, self.func_helper.generation_suffixes(args, kwargs),
+                                              self.func_helper.affinity_token(args, kwargs))
+
+    def build_key(self, all_gen_values):
+        return self.func_helper.build_wrapped_cache_key_with_generations(self.args, self.kwargs, all_gen_values)
+
+    def found(self, key, value):
+        super(_PrefetchedCall, self).found(key, value)
+        if value is not None:
+            self.wrapped.registry_entry.hits += 1
+            if trace.recorder is not None:
+                trace.recorder.record(trace.GET_HIT, key,
+                                      sample_key=self.func_helper.build_local_copy_key(self.args, self.kwargs))
+
+    def unavailable(self):
+        super(_PrefetchedCall, self).unavailable()
+        self._cache_unavailable = True
+
+    def get(self):
+        value = super(_PrefetchedCall, self).get()
+        if value is not None or self._computed:
+            return value
+
+        self._computed = True
+        if self._cache_unavailable:
+            self._value = _uncached_fallback(self.func_helper, self.args, self.kwargs)
+            return self._value
+
+        entry = self.wrapped.registry_entry
+        entry.misses += 1
+        start = time()
+        self._value = self.func_helper.func(*self.args, **self.kwargs)
+        if trace.recorder is not None:
+            trace.recorder.record(trace.GET_MISS, self.key, self._value, time() - start,
+                                  sample_key=self.func_helper.build_local_copy_key(self.args, self.kwargs))
+
+        try:
+            _cache_call('set', self.key, self._value, entry.effective_timeout(self.func_helper.builder.timeout))
+        except CacheUnavailable:
+            pass
+
+        breaker = current_circuit_breaker()
+        if breaker is not None and breaker.local_copies is not None:
+            breaker.remember(self.func_helper.build_local_copy_key(self.args, self.kwargs), self._value)
+
+        return self._value
+
+
+class _PrefetchedGet(PrefetchedValue):
+    """
+    A gen_cache.get (or CustomUseGenCache.get, counting its hits and misses on registry_entry).
+    """
+
+    def __init__(self, prefetcher, generations, kwargs, registry_entry=None):
+        self.registry_entry = registry_entry
+        self.add_to_key = kwargs.pop('add_to_key', None)
+        affinity = kwargs.pop('affinity', None)
+        super(_PrefetchedGet, self).__init__(prefetcher, build_generation_cache_key_suffixes(generations, **kwargs),
+                                             build_affinity_token(affinity, kwargs) if affinity else None)
+
+    def build_key(self, all_gen_values):
+        return affine_key(gen_cache.build_key_with_generation_values(all_gen_values, self.add_to_key), self.affinity)
+
+    def found(self, key, value):
+        super(_PrefetchedGet, self).found(key, value)
+        if self.registry_entry is not None:
+            if value is None:
+                self.registry_entry.misses += 1
+            else:
+                self.registry_entry.hits += 1
+        if trace.recorder is not None:
+            trace.recorder.record(trace.GET_MISS if value is None else trace.GET_HIT, key,
+                                  sample_key=_trace_sample_key(self.generation_suffixes, self.add_to_key))
+
+
+class _ImmediateCall(PrefetchedValue):
+    """
+    A call that isn't prefetched, done when consumed.
+    """
+
+    def __init__(self, prefetcher, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        super(_ImmediateCall, self).__init__(prefetcher, [])
+
+    def get(self):
+        if not self.resolved:
+            self._value = self.func(*self.args, **self.kwargs)
+        return self._value
+
+
+class Prefetcher(object):
+
+    def __init__(self):
+        self._pending = []
+
+    def call(self, wrapped, *args, **kwargs):
+        """
+        Queues a call of a gen_cache.wrap'd function, returning a PrefetchedValue.
+        """
+        func_helper = getattr(wrapped, 'func_helper', None)
+        if func_helper is None or isinstance(func_helper, BatchGenFuncHelper) or getattr(wrapped, 'adaptive', None) is not None \
+                or getattr(wrapped, 'track_dependencies', False) or getattr(wrapped, 'page_size', None) is not None \
+                or getattr(wrapped, 'immutable', False) or wrapped.registry_entry.overridden:
+            # Not wrapped (eg. ignore_locally), a batch, adaptive, tracking its dependencies, paged,
+            # immutable (served from the shared local tier), or with live overrides (bypassed,
+            # local tier, etc, see hscacheutils.registry)
+            return _ImmediateCall(self, wrapped, args, kwargs)
+
+        return self._queue(_PrefetchedCall(self, wrapped, args, kwargs))
+
+    def get(self, cache, *generations, **kwargs):
+        """
+        Queues a cache.get(*generations, **kwargs), where cache is gen_cache (or another
+        GenerationalCache) or a CustomUseGenCache. Returns a PrefetchedValue.
+        """
+        kwargs.pop('use_raw', None)
+        registry_entry = None
+
+        if isinstance(cache, CustomUseGenCache):
+            if cache.packed is not None or cache.registry_entry.overridden:
+                # Packed, or with live overrides (bypassed, etc, see hscacheutils.registry)
+                return _ImmediateCall(self, cache.get, (), kwargs)
+            cache._adjust_kwargs(kwargs)
+            generations = cache.generation_names
+            registry_entry = cache.registry_entry
+        elif not isinstance(cache, GenerationalCache):
+            raise TypeError("Can't prefetch from %r" % cache)
+
+        if gen_cache.should_ignore_caching(kwargs):
+            return _ImmediateCall(self, lambda: None, (), {})
+
+        return self._queue(_PrefetchedGet(self, generations, kwargs, registry_entry))
+
+    def _queue(self, lookup):
+        self._pending.append(lookup)
+        return lookup
+
+    def resolve(self):
+        """
+        Fetches the generations, then the values, of every pending lookup.
+        """
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        metrics.incr('prefetch.ticks')
+        metrics.incr('prefetch.lookups', len(pending))
+
+        # Generations are placed by affinity (see hscacheutils.affinity), so they are fetched per
+        # affinity token. Usually there's only one (or none) in a request.
+        suffixes_by_affinity = dict()
+        for lookup in pending:
+            suffixes_by_affinity.setdefault(lookup.affinity, set()).update(lookup.generation_suffixes)
+
+        try:
+            gen_values_by_affinity = dict((affinity, generation_values_for_suffixes(list(suffixes), affinity) if suffixes else {})
+                                          for affinity, suffixes in suffixes_by_affinity.items())
+            keys = [lookup.build_key(dict((suffix, gen_values_by_affinity[lookup.affinity][suffix])
+                                          for suffix in lookup.generation_suffixes))
+                    for lookup in pending]
+            cached = _cache_call('get_many', list(set(keys)))
+        except CacheUnavailable:
+            for lookup in pending:
+                lookup.unavailable()
+            return
+
+        for lookup, key in zip(pending, keys):
+            lookup.found(key, cached.get(key))
@@ -52,13 +52,113 @@ def raw_memcache(timeout, key_prefix, servers):
     return decorator
 
 
+class MemcacheClientCache(object):
+    """
+    Gives a plain memcache.Client the same interface as a django cache (get_many, set_many,
+    incr raising ValueError, etc), for when django isn't around.
+    """
+
+    def __init__(self, servers, **client_kwargs):
+        self._servers = servers
+        self._client = memcache.Client(servers, **client_kwargs)
+        self._client.cache_cas = True
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return 0
+        if timeout > MAX_MEMCACHE_TIMEOUT:
+            return MAX_MEMCACHE_TIMEOUT
+        return int(timeout)
+
+    def get(self, key, default=None):
+        value = self._client.get(key)
+        if value is None:
+            return default
+        return value
+
+    def get_many(self, keys):
+        return self._client.get_multi(keys)
+
+    def set(self, key, value, timeout=None):
+        return self._client.set(key, value, self._timeout(timeout))
+
+    def set_many(self, vals_by_key, timeout=None):
+        return self._client.set_multi(vals_by_key, self._timeout(timeout))
+
+    def add(self, key, value, timeout=None):
+        return bool(self._client.add(key, value, self._timeout(timeout)))
+
+    def gets(self, key):
+        """
+        Returns (value, token), where token is what cas needs to check the key didn't change.
+        """
+        value = self._client.gets(key)
+        if value is None:
+            return None, None
+        return value, self._client.cas_ids.get(key)
+
+    def cas(self, key, value, token, timeout=None):
+        """
+        Stores value if key didn't change since the gets that returned token (or, with a None
+        token, if key doesn't exist). Returns whether it was stored.
+        """
+        if token is None:
+            return self.add(key, value, timeout)
+        self._client.cas_ids[key] = token
+        return bool(self._client.cas(key, value, self._timeout(timeout)))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def delete_many(self, keys):
+        self._client.delete_multi(keys)
+
+    def incr(self, key, delta=1):
+        value = self._client.incr(key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def decr(self, key, delta=1):
+        value = self._client.decr(key, delta)
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def clear(self):
+        self._client.flush_all()
+
+    def close(self):
+        self._client.disconnect_all()
+
+
+def build_memcached_cache(servers):
+    """
+    Builds a raw (no key prefix or version) cache talking to the passed in memcached servers,
+    using the django memcached backend if django is around.
+    """
+    if not get_cache:
+        return MemcacheClientCache(servers)
+    return get_cache('django.core.cache.backends.memcached.MemcachedCache',
+                     LOCATION=';'.join(servers),
+                     KEY_FUNCTION=lambda key, key_prefix, version: key)
+
+
 def load_cache():
     '''
+    If RAW_CACHE_REDIS_URL is defined in settings, use redis (see hscacheutils.redis_cache).
+
     If the RAW_CACHE_NAME is defined in settings, load the cache of that name.
 
     Otherwise, load the cache that has the exact same settings as the default cache,
     except with no 'KEY_PREFIX' set
     '''
+    redis_url = get_setting_default('RAW_CACHE_REDIS_URL', None)
+    if redis_url:
+        from hscacheutils.redis_cache import RedisCache
+        return RedisCache(url=redis_url,
+                          resolve_generations=get_setting_default('RAW_CACHE_REDIS_RESOLVE_GENERATIONS', True))
+
     # If no django installed, we use the local memory cache
     if not get_cache:
         return simple_memory_cache
@@ -76,6 +176,128 @@ def load_cache():
     the_cache = get_cache(backend, **raw_conf_dict)
     return the_cache
 
-cache = load_cache()
+class SwappableCache(object):
+    """
+    Delegates everything to the currently installed backend, so that the backend behind the
+    module level `cache` (which is imported all over the place) can be swapped at runtime.
+    Eg. for tests or for wrapping it with extra behavior.
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+
+cache = SwappableCache(load_cache())
+
+
+def load_generation_cache():
+    """
+    Generation keys are tiny, hot and expensive to lose (an evicted generation invalidates
+    everything under it), so they can live in their own cache, away from the bulky values:
+    either the django cache named GENERATION_CACHE_NAME, or the memcached servers listed in
+    GENERATION_CACHE_LOCATION.
+
+    Returns None (meaning: use the same backend as raw_cache.cache) if neither is set.
+    """
+    cache_name = get_setting_default('GENERATION_CACHE_NAME', None)
+    if cache_name and get_cache:
+        return get_cache(cache_name)
+
+    location = get_setting_default('GENERATION_CACHE_LOCATION', None)
+    if location:
+        if isinstance(location, basestring):
+            location = location.split(';')
+        return build_memcached_cache(location)
+
+    return None
+
+
+class GenerationCache(SwappableCache):
+    """
+    Where generation keys are stored. Delegates to raw_cache.cache's backend unless a
+    separate generation backend was configured or installed.
+    """
+
+    def __getattr__(self, name):
+        backend = self._backend if self._backend is not None else cache._backend
+        return getattr(backend, name)
+
+
+generation_cache = GenerationCache(load_generation_cache())
+
+
+def get_backend():
+    return cache._backend
+
+
+def set_backend(backend):
+    """
+    Installs a new backend behind raw_cache.cache, returning the previous one.
+    """
+    previous = cache._backend
+    cache._backend = backend
+    return previous
+
+
+def set_generation_backend(backend):
+    """
+    Installs a separate backend for the generation keys (None to share raw_cache.cache's
+    backend again), returning the previous one.
+    """
+    previous = generation_cache._backend
+    generation_cache._backend = backend
+    return previous
+
+
+def install_shared_memory_tier(local_timeout=5, **shared_memory_options):
+    """
+    Puts a SharedMemoryCache (shared by all the processes on this host) in front of the current
+    backend. See hscacheutils.tiered_cache.
+    """
+    from hscacheutils.shared_memory_cache import SharedMemoryCache
+    from hscacheutils.tiered_cache import TieredCache
+
+    shared_memory_cache = SharedMemoryCache(**shared_memory_options)
+    set_backend(TieredCache(shared_memory_cache, get_backend(), local_timeout=local_timeout))
+    return shared_memory_cache
+
+
+def install_affinity_routing(servers, **affinity_options):
+    """
+    Replaces the backend with an AffineCache spreading keys over the passed in memcached
+    servers, placing the keys of a tenant on a single one. See hscacheutils.affinity.
+    """
+    from hscacheutils.affinity import AffineCache
+
+    affine_cache = AffineCache.for_servers(servers, **affinity_options)
+    set_backend(affine_cache)
+    return affine_cache
+
+
+def install_batching_client(**batching_options):
+    """
+    Puts a BatchingCache (merging the concurrent lookups of many threads into single get_manys)
+    in front of the current backend. See hscacheutils.batching_cache.
+    """
+    from hscacheutils.batching_cache import BatchingCache
+
+    batching_cache = BatchingCache(get_backend(), **batching_options)
+    set_backend(batching_cache)
+    return batching_cache
+
+
+_affinity_location = get_setting_default('RAW_CACHE_AFFINITY_LOCATION', None)
+if _affinity_location:
+    install_affinity_routing(_affinity_location.split(';') if isinstance(_affinity_location, basestring) else _affinity_location)
 
+# Batching goes behind the shared memory tier, only lookups it misses need batching
+_batching_options = get_setting_default('RAW_CACHE_BATCHING', None)
+if _batching_options:
+    install_batching_client(**_batching_options)
 
+_shared_memory_tier_options = get_setting_default('RAW_CACHE_SHARED_MEMORY_TIER', None)
+if _shared_memory_tier_options:
+    install_shared_memory_tier(**_shared_memory_tier_options)
@@ -0,0 +1,248 @@
+"""
+A redis backend for raw_cache (and so gen_cache), with the same interface as the django
+memcached cache, plus:
+
+  - get_with_generations: resolves (and initializes, with SET NX) the generations of a wrapped
+    call and fetches its value in a single round trip, with a lua script. gen_cache.wrap uses it
+    automatically when this is the raw_cache backend and generations aren't stored separately.
+  - set_many, delete_many and incr_many (used by gen_cache.invalidate_many) are pipelined.
+  - add is a SET NX, so concurrent generation initializations agree on one value.
+  - gets/cas, with a lua script comparing the stored data to what gets returned.
+
+    from hscacheutils import raw_cache
+    from hscacheutils.redis_cache import RedisCache
+
+    raw_cache.set_backend(RedisCache(url='redis://localhost:6379/0'))
+
+Or set RAW_CACHE_REDIS_URL in your settings. Needs redis-py, unless you pass in a client
+(eg. hscacheutils.fake_redis.FakeRedis in tests).
+
+Integers are stored as plain numbers (so that incr works on them), everything else is pickled.
+
+get_with_generations is single node only: its script GETs a value key built from the generation
+values it just read, so that key can't be declared in KEYS up front. Redis Cluster (which routes
+scripts by their KEYS, and rejects keys of other slots) and ACLs restricting the keys scripts can
+touch both refuse it. There, pass resolve_generations=False (or set
+RAW_CACHE_REDIS_RESOLVE_GENERATIONS = False): wrapped functions then fetch their generations
+and their value in two round trips, as with memcached. The other scripts only touch the key
+they are given.
+"""
+
+import cPickle as pickle
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from hscacheutils.raw_cache import MAX_MEMCACHE_TIMEOUT
+
+
+class LuaScript(object):
+    """
+    A lua script, along with a python emulation of it for clients that can't run lua (see
+    hscacheutils.fake_redis). The emulation is called with (client, keys, args).
+    """
+
+    def __init__(self, source, emulation):
+        self.source = source
+        self.emulation = emulation
+
+    def register(self, client):
+        if hasattr(client, 'register_emulated_script'):
+            return client.register_emulated_script(self.source, self.emulation)
+        return client.register_script(self.source)
+
+
+def _emulate_incr_existing(client, keys, args):
+    if client.get(keys[0]) is None:
+        return None
+    return client.incrby(keys[0], int(args[0]))
+
+
+# Memcache semantics: incrementing a missing key fails instead of starting from 0
+INCR_EXISTING = LuaScript("""
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCRBY', KEYS[1], ARGV[1])
+end
+return false
+""", _emulate_incr_existing)
+
+
+def _emulate_compare_and_set(client, keys, args):
+    token, data, timeout = args[0], args[1], int(args[2])
+    if client.get(keys[0]) != (token or None):
+        return 0
+    client.set(keys[0], data, ex=timeout or None)
+    return 1
+
+
+# ARGV: the data gets returned (empty if the key was missing), the new data, and a timeout (0
+# for none)
+COMPARE_AND_SET = LuaScript("""
+local current = redis.call('GET', KEYS[1])
+if (current or '') ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[3]) > 0 then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+else
+    redis.call('SET', KEYS[1], ARGV[2])
+end
+return 1
+""", _emulate_compare_and_set)
+
+
+def _emulate_get_with_generations(client, keys, args):
+    value_key_prefix, generation_timeout, new_values = args[0], int(args[1]), args[2:]
+
+    generations = client.mget(keys)
+    initialized = []
+    for i, key in enumerate(keys):
+        if generations[i] is None:
+            if client.set(key, new_values[i], ex=generation_timeout, nx=True):
+                initialized.append(i + 1)
+            generations[i] = client.get(key)
+
+    value_key = value_key_prefix + ','.join(generations)
+    return [client.get(value_key), generations, initialized]
+
+
+# KEYS: the generation keys. ARGV: the value key prefix, the generation timeout, then a new
+# value for each generation, used if it is missing. The value key isn't in KEYS (it depends on
+# the generations), so this only runs on a single node, see the module docstring.
+GET_WITH_GENERATIONS = LuaScript("""
+local generations = redis.call('MGET', unpack(KEYS))
+local initialized = {}
+for i, key in ipairs(KEYS) do
+    if not generations[i] then
+        if redis.call('SET', key, ARGV[i + 2], 'EX', ARGV[2], 'NX') then
+            initialized[#initialized + 1] = i
+        end
+        generations[i] = redis.call('GET', key)
+    end
+end
+local value_key = ARGV[1] .. table.concat(generations, ',')
+return {redis.call('GET', value_key), generations, initialized}
+""", _emulate_get_with_generations)
+
+
+def encode(value):
+    if isinstance(value, (int, long)) and not isinstance(value, bool):
+        return str(value)
+    return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def decode(data):
+    if data is None:
+        return None
+    try:
+        return int(data)
+    except ValueError:
+        return pickle.loads(data)
+
+
+class RedisCache(object):
+
+    def __init__(self, url=None, client=None, resolve_generations=True, **client_kwargs):
+        if client is None:
+            if redis is None:
+                raise ImportError("RedisCache needs redis-py (pip install redis), or a client passed in")
+            client = redis.StrictRedis.from_url(url, **client_kwargs) if url else redis.StrictRedis(**client_kwargs)
+
+        self._client = client
+        # Whether gen_cache resolves generations with get_with_generations (single node only)
+        self.resolve_generations = resolve_generations
+        self._incr_existing = INCR_EXISTING.register(client)
+        self._get_with_generations = GET_WITH_GENERATIONS.register(client)
+        self._compare_and_set = COMPARE_AND_SET.register(client)
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return None
+        return max(1, min(int(timeout), MAX_MEMCACHE_TIMEOUT))
+
+    def get(self, key, default=None):
+        value = decode(self._client.get(key))
+        if value is None:
+            return default
+        return value
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        return dict((key, decode(data)) for key, data in zip(keys, self._client.mget(keys)) if data is not None)
+
+    def set(self, key, value, timeout=None):
+        return bool(self._client.set(key, encode(value), ex=self._timeout(timeout)))
+
+    def set_many(self, vals_by_key, timeout=None):
+        pipeline = self._client.pipeline(transaction=False)
+        for key, value in vals_by_key.items():
+            pipeline.set(key, encode(value), ex=self._timeout(timeout))
+        pipeline.execute()
+
+    def add(self, key, value, timeout=None):
+        return bool(self._client.set(key, encode(value), ex=self._timeout(timeout), nx=True))
+
+    def gets(self, key):
+        """
+        Returns (value, token), where token is what cas needs to check the key didn't change.
+        """
+        data = self._client.get(key)
+        return decode(data), data
+
+    def cas(self, key, value, token, timeout=None):
+        """
+        Stores value if key didn't change since the gets that returned token (or, with a None
+        token, if key doesn't exist). Returns whether it was stored.
+        """
+        args = [token or '', encode(value), self._timeout(timeout) or 0]
+        return bool(self._compare_and_set(keys=[key], args=args))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def delete_many(self, keys):
+        keys = list(keys)
+        if keys:
+            self._client.delete(*keys)
+
+    def incr(self, key, delta=1):
+        value = self._incr_existing(keys=[key], args=[delta])
+        if value is None:
+            raise ValueError("Key '%s' not found" % key)
+        return value
+
+    def decr(self, key, delta=1):
+        return self.incr(key, -delta)
+
+    def incr_many(self, keys, delta=1):
+        """
+        Increments many keys in one round trip. Returns a dict of key => new value, where
+        missing keys (which aren't created) have None.
+        """
+        keys = list(keys)
+        pipeline = self._client.pipeline(transaction=False)
+        for key in keys:
+            self._incr_existing(keys=[key], args=[delta], client=pipeline)
+        return dict(zip(keys, pipeline.execute()))
+
+    def get_with_generations(self, value_key_prefix, generation_keys, new_generation_values):
+        """
+        Fetches the generation_keys (initializing the missing ones with new_generation_values),
+        and the value stored under value_key_prefix followed by the comma separated generation
+        values, in a single round trip.
+
+        Returns (value key, value, generation keys that were initialized).
+        """
+        args = [value_key_prefix, MAX_MEMCACHE_TIMEOUT] + list(new_generation_values)
+        data, generations, initialized = self._get_with_generations(keys=list(generation_keys), args=args)
+
+        value_key = value_key_prefix + ','.join(generations)
+        return value_key, decode(data), [generation_keys[i - 1] for i in initialized]
+
+    def clear(self):
+        self._client.flushdb()
+
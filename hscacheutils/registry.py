@@ -0,0 +1,216 @@
+"""
+Runtime inventory of every gen_cache.wrap'd (and wrap_batch'd) function and CustomUseGenCache,
+with their generations, timeouts and hit/miss counts, and live overrides that take effect
+without a deploy:
+
+    from hscacheutils import registry
+
+    registry.describe()                                   # name => generations, timeout, stats, overrides
+    registry.override('contacts.get_contact', timeout=60) # a new timeout
+    registry.override('contacts.get_contact', bypass=True)  # stop caching it
+    registry.override('contacts.get_contact', sample_rate=0.1)  # only cache 10% of the calls
+    registry.override('contacts.get_contact', tier='local')     # also keep values in a local LRU
+    registry.clear_overrides('contacts.get_contact')
+
+Wrapped functions are named by their namespace, or "module.function:line" (so that same-named
+methods of different classes get entries of their own). CustomUseGenCaches by the name they're
+given, or "custom:" followed by their generations and timeout. Registering a name that's
+already taken by a different function or cache raises a DuplicateCacheEntry.
+
+The hot path only checks a flag on the entry, which the wrapper holds on to, so overrides cost
+nothing until they are set. Overrides are per process. To apply them to every process, publish
+them to the cache and have processes sync them (RegistrySyncMiddleware does it every
+GEN_CACHE_REGISTRY_SYNC_INTERVAL seconds, 30 by default):
+
+    registry.publish_overrides()
+"""
+
+import random
+import threading
+
+from time import time
+
+from hscacheutils.adaptive import LOCAL_TIER, MEMCACHE_TIER
+from hscacheutils.local_cache import PickledLocalCache
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+OVERRIDES_KEY = '_hscacheutils_registry_overrides'
+DEFAULT_SYNC_INTERVAL = 30
+
+
+class UnknownCacheEntry(Exception):
+    pass
+
+
+class DuplicateCacheEntry(Exception):
+    pass
+
+
+class CacheEntry(object):
+    """
+    A wrapped function or CustomUseGenCache. Stats are updated without locking, losing an
+    increment now and then doesn't matter here.
+    """
+
+    def __init__(self, name, kind, generations, timeout):
+        self.name = name
+        self.kind = kind
+        self.generations = list(generations)
+        self.timeout = timeout
+
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+        self.clear_overrides()
+
+    def clear_overrides(self):
+        # Checked first on the hot path, the rest is only looked at when it's set
+        self.overridden = False
+        self.timeout_override = None
+        self.bypass = False
+        self.sample_rate = None
+        self.tier = None
+        self.local_tier = None
+
+    def override(self, timeout=None, bypass=None, sample_rate=None, tier=None):
+        if timeout is not None:
+            self.timeout_override = timeout
+        if bypass is not None:
+            self.bypass = bypass
+        if sample_rate is not None:
+            self.sample_rate = sample_rate
+        if tier is not None:
+            if tier not in (LOCAL_TIER, MEMCACHE_TIER):
+                raise ValueError("Unknown tier %r" % tier)
+            self.tier = tier
+            self.local_tier = PickledLocalCache() if tier == LOCAL_TIER else None
+
+        self.overridden = bool(self.timeout_override is not None or self.bypass or self.sample_rate is not None
+                               or self.tier is not None)
+
+    @property
+    def overrides(self):
+        overrides = dict()
+        if self.timeout_override is not None:
+            overrides['timeout'] = self.timeout_override
+        if self.bypass:
+            overrides['bypass'] = True
+        if self.sample_rate is not None:
+            overrides['sample_rate'] = self.sample_rate
+        if self.tier is not None:
+            overrides['tier'] = self.tier
+        return overrides
+
+    def bypassed(self):
+        """
+        Whether this call should skip the cache (counting it if so). Only call when overridden.
+        """
+        if self.bypass or (self.sample_rate is not None and random.random() >= self.sample_rate):
+            self.bypasses += 1
+            return True
+        return False
+
+    def effective_timeout(self, timeout):
+        if self.overridden and self.timeout_override is not None:
+            return self.timeout_override
+        return timeout
+
+    def as_dict(self):
+        return dict(kind=self.kind, generations=self.generations, timeout=self.timeout, hits=self.hits,
+                    misses=self.misses, bypasses=self.bypasses, overrides=self.overrides)
+
+
+_entries = dict()
+_lock = threading.Lock()
+
+
+def register(name, kind, generations, timeout):
+    """
+    Returns the entry named name, creating it if needed. Re-registering a name with the same
+    kind, generations and timeout (eg. when a module is reloaded) returns the existing entry,
+    with its stats and overrides. Otherwise the name is taken, and DuplicateCacheEntry is raised.
+    """
+    with _lock:
+        entry = _entries.get(name)
+        if entry is None:
+            entry = _entries[name] = CacheEntry(name, kind, generations, timeout)
+        elif (entry.kind, entry.generations, entry.timeout) != (kind, list(generations), timeout):
+            raise DuplicateCacheEntry("%r is already registered (a %s of %s with a timeout of %s), give it a "
+                                      "unique namespace or name" % (name, entry.kind, entry.generations, entry.timeout))
+        return entry
+
+
+def get(name):
+    try:
+        return _entries[name]
+    except KeyError:
+        raise UnknownCacheEntry("No wrapped function or CustomUseGenCache named %r" % name)
+
+
+def entries():
+    return sorted(_entries.values(), key=lambda entry: entry.name)
+
+
+def describe():
+    return dict((entry.name, entry.as_dict()) for entry in entries())
+
+
+def override(name, **overrides):
+    """
+    Overrides the timeout, bypass, sample_rate (fraction of the calls using the cache) or tier
+    (adaptive.LOCAL_TIER or adaptive.MEMCACHE_TIER) of an entry, in this process.
+    """
+    get(name).override(**overrides)
+
+
+def clear_overrides(name=None):
+    for entry in ([get(name)] if name is not None else entries()):
+        entry.clear_overrides()
+
+
+def publish_overrides():
+    """
+    Stores the overrides of this process in the cache, for the other processes to sync.
+    """
+    from hscacheutils.raw_cache import MAX_MEMCACHE_TIMEOUT, cache as raw_cache
+    overrides = dict((entry.name, entry.overrides) for entry in entries() if entry.overridden)
+    raw_cache.set(OVERRIDES_KEY, overrides, MAX_MEMCACHE_TIMEOUT)
+
+
+def sync_overrides():
+    """
+    Replaces the overrides of this process with the published ones. Entries that aren't
+    registered (yet) in this process are skipped.
+    """
+    from hscacheutils.raw_cache import cache as raw_cache
+    published = raw_cache.get(OVERRIDES_KEY)
+    if published is None:
+        return
+
+    for entry in entries():
+        entry.clear_overrides()
+        if entry.name in published:
+            entry.override(**published[entry.name])
+
+
+class RegistrySyncMiddleware(object):
+    """
+    Syncs the published overrides at the start of a request, at most every
+    GEN_CACHE_REGISTRY_SYNC_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.interval = get_setting_default('GEN_CACHE_REGISTRY_SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)
+        self.last_sync = 0
+
+    def process_request(self, request):
+        now = time()
+        if now - self.last_sync >= self.interval:
+            self.last_sync = now
+            sync_overrides()
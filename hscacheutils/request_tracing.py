@@ -0,0 +1,264 @@
+"""
+Request-scoped tracing of cache round trips: records every backend call made by gen_cache
+(wrapped functions, gen_cache.get/set/..., CustomUseGenCache, generation lookups) in the current
+thread, with its timing, size and call site. When the request ends, it summarizes the round trips
+and flags lookups repeated with the same keys, and call sites making many round trips (loops
+that should have used gen_cache.wrap_batch, a Prefetcher or get_many).
+
+    from hscacheutils import request_tracing
+
+    with request_tracing.traced_request('/contacts') as tracer:
+        render_page()
+    print tracer.summary
+
+Or add 'hscacheutils.request_tracing.CacheTracingMiddleware' to your MIDDLEWARE_CLASSES.
+
+Sizing a value means pickling it again, so only a sample of the round trips are sized
+(GEN_CACHE_TRACING_SIZE_SAMPLE_RATE, 5% by default), and the summary's bytes are estimated from
+them. Pass size_sample_rate=1 to traced_request (or start_request) to size every round trip.
+
+Summaries are passed to a hook, which by default logs the ones with problems. In tests, make
+problems fail loudly with:
+
+    request_tracing.set_hook(request_tracing.raise_on_problems)
+"""
+
+import logging
+import random
+import sys
+import threading
+
+from collections import defaultdict
+from contextlib import contextmanager
+from time import time
+
+from hscacheutils.trace import value_size
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+# Round trips from one call site before it is flagged as a loop to batch
+DEFAULT_BATCH_THRESHOLD = 5
+
+# Share of the round trips whose values are sized
+DEFAULT_SIZE_SAMPLE_RATE = 0.05
+
+READ_OPS = set(['get', 'get_many', 'gets', 'get_with_generations'])
+MULTI_KEY_OPS = set(['get_many', 'delete_many', 'incr_many'])
+
+
+class CacheTracingProblem(Exception):
+    pass
+
+
+class RoundTrip(object):
+    """
+    A backend call. bytes is None if its values weren't sized.
+    """
+    __slots__ = ('op', 'keys', 'duration', 'bytes', 'call_site')
+
+    def __init__(self, op, keys, duration, bytes, call_site):
+        self.op = op
+        self.keys = keys
+        self.duration = duration
+        self.bytes = bytes
+        self.call_site = call_site
+
+
+def _keys_of(op, args):
+    if not args:
+        return ()
+    if op in MULTI_KEY_OPS:
+        return tuple(args[0])
+    if op == 'set_many':
+        return tuple(sorted(args[0]))
+    if op == 'get_with_generations':
+        return (args[0],) + tuple(args[1])
+    return (args[0],)
+
+
+def _bytes_of(op, args, result):
+    if op in READ_OPS:
+        if op == 'get_many':
+            return sum(value_size(value) for value in result.values() if value is not None)
+        if isinstance(result, tuple):
+            result = result[0] if op == 'gets' else result[1]
+        return value_size(result) if result is not None else 0
+    if op == 'set_many':
+        return sum(value_size(value) for value in args[0].values())
+    if op in ('set', 'add', 'cas') and len(args) > 1:
+        return value_size(args[1])
+    return 0
+
+
+def _call_site():
+    """
+    The file:line (function) of the first frame outside of hscacheutils (tests excepted).
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if not module.startswith('hscacheutils.') or module.startswith('hscacheutils.test'):
+            code = frame.f_code
+            return '%s:%s (%s)' % (code.co_filename, frame.f_lineno, code.co_name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+class RequestSummary(object):
+
+    def __init__(self, name, round_trips, batch_threshold):
+        self.name = name
+        self.round_trips = round_trips
+        self.time = sum(round_trip.duration for round_trip in round_trips)
+
+        # Estimated from the sized round trips
+        sized = [round_trip.bytes for round_trip in round_trips if round_trip.bytes is not None]
+        self.bytes_estimated = len(sized) < len(round_trips)
+        self.bytes = int(sum(sized) * len(round_trips) / len(sized)) if sized else 0
+
+        self.ops = defaultdict(int)
+        lookups = defaultdict(int)
+        by_call_site = defaultdict(int)
+        for round_trip in round_trips:
+            self.ops[round_trip.op] += 1
+            by_call_site[round_trip.call_site] += 1
+            if round_trip.op in READ_OPS:
+                lookups[(round_trip.op, round_trip.keys)] += 1
+
+        # [(op, keys, times)] of the reads done more than once with the same keys
+        self.repeated_lookups = sorted(((op, keys, count) for (op, keys), count in lookups.items() if count > 1),
+                                       key=lambda repeated: -repeated[2])
+
+        # [(call site, round trips)] of the call sites that should have batched
+        self.batchable_call_sites = sorted(((call_site, count) for call_site, count in by_call_site.items()
+                                            if count >= batch_threshold), key=lambda batchable: -batchable[1])
+
+    @property
+    def problems(self):
+        problems = []
+        for op, keys, count in self.repeated_lookups:
+            problems.append("%s of %s repeated %s times" % (op, ', '.join(keys)[:200], count))
+        for call_site, count in self.batchable_call_sites:
+            problems.append("%s made %s cache round trips, batch them (gen_cache.wrap_batch, a Prefetcher or get_many)"
+                            % (call_site, count))
+        return problems
+
+    def __str__(self):
+        lines = ["%s: %s cache round trips (%s) in %.1fms, %s%s bytes" % (
+            self.name, len(self.round_trips), ', '.join('%s %s' % (count, op) for op, count in sorted(self.ops.items())),
+            self.time * 1000, '~' if self.bytes_estimated else '', self.bytes)]
+        lines.extend('  ' + problem for problem in self.problems)
+        return '\n'.join(lines)
+
+
+class RequestTracer(object):
+
+    def __init__(self, name='request', batch_threshold=DEFAULT_BATCH_THRESHOLD, size_sample_rate=None):
+        self.name = name
+        self.batch_threshold = batch_threshold
+        if size_sample_rate is None:
+            size_sample_rate = get_setting_default('GEN_CACHE_TRACING_SIZE_SAMPLE_RATE', DEFAULT_SIZE_SAMPLE_RATE)
+        self.size_sample_rate = size_sample_rate
+        self.round_trips = []
+        self.summary = None
+
+    def wrap(self, op, method):
+        """
+        Returns method (the backend's op) recording its calls.
+        """
+        def traced(*args, **kwargs):
+            call_site = _call_site()
+            start = time()
+            result = method(*args, **kwargs)
+            duration = time() - start
+            size = _bytes_of(op, args, result) if random.random() < self.size_sample_rate else None
+            self.round_trips.append(RoundTrip(op, _keys_of(op, args), duration, size, call_site))
+            return result
+        return traced
+
+    def finish(self):
+        self.summary = RequestSummary(self.name, self.round_trips, self.batch_threshold)
+        return self.summary
+
+
+_local = threading.local()
+
+
+def current_tracer():
+    return getattr(_local, 'tracer', None)
+
+
+def start_request(name='request', batch_threshold=DEFAULT_BATCH_THRESHOLD, size_sample_rate=None):
+    tracer = RequestTracer(name, batch_threshold, size_sample_rate)
+    _local.tracer = tracer
+    return tracer
+
+
+def end_request():
+    """
+    Stops tracing the current thread, passing the summary to the hook (and returning it).
+    """
+    tracer = current_tracer()
+    if tracer is None:
+        return None
+    _local.tracer = None
+
+    summary = tracer.finish()
+    _hook(summary)
+    return summary
+
+
+@contextmanager
+def traced_request(name='request', batch_threshold=DEFAULT_BATCH_THRESHOLD, size_sample_rate=None):
+    tracer = start_request(name, batch_threshold, size_sample_rate)
+    try:
+        yield tracer
+    except Exception:
+        # Don't report (or raise) on top of the original error
+        _local.tracer = None
+        raise
+    end_request()
+
+
+def log_problems(summary):
+    if summary.problems:
+        logging.warning("Cache round trip problems in %s" % summary)
+
+
+def raise_on_problems(summary):
+    if summary.problems:
+        raise CacheTracingProblem(str(summary))
+
+
+_hook = log_problems
+
+
+def set_hook(hook):
+    """
+    Installs a function called with the RequestSummary of every traced request, returning the
+    previous one.
+    """
+    global _hook
+    previous, _hook = _hook, hook
+    return previous
+
+
+class CacheTracingMiddleware(object):
+    """
+    Traces the cache round trips of every django request.
+    """
+
+    def process_request(self, request):
+        start_request(request.path)
+
+    def process_response(self, request, response):
+        end_request()
+        return response
+
+    def process_exception(self, request, exception):
+        # Don't report (or raise) on top of the original error
+        _local.tracer = None
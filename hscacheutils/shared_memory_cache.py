@@ -0,0 +1,331 @@
+"""
+A cache shared by every process on a host, backed by an mmap'd file (put it on a tmpfs such
+as /dev/shm). Meant to sit between the processes and memcache (see tiered_cache.TieredCache),
+so that hot generation values and small results are shared by all the prefork workers on a
+box without a network hop.
+
+The file is a fixed-size hash table split into slab classes, each made of fixed-size slots
+(eg. 4096 slots of 256 bytes, 2048 of 1024 bytes and 512 of 4096 bytes). An item lives in
+the smallest slab class it fits in. Within a class, a key hashes to a bucket of a few slots
+(set associative), and a new item replaces an expired slot or else the least recently
+written one. Items that don't fit in the largest slot aren't stored.
+
+Reads don't take any lock: every slot has a sequence number that is odd while it's being
+written, and readers retry when it is odd or changed while they were reading. Writes take one
+of a number of lock stripes, which are both a thread lock and an fcntl lock on the file (so
+they exclude other threads and other processes).
+
+    shm_cache = SharedMemoryCache('/dev/shm/hscacheutils')
+    shm_cache.set('key', {'some': 'value'}, timeout=10)
+    shm_cache.get('key')
+"""
+
+import cPickle as pickle
+import fcntl
+import mmap
+import os
+import struct
+import threading
+
+from hashlib import md5
+from time import time
+
+
+MAGIC = 'HSSHM001'
+
+# magic, number of slab classes, bucket size (slots per bucket), number of lock stripes
+FILE_HEADER = struct.Struct('<8sIII')
+# slot size, number of slots (repeated for each slab class)
+SLAB_HEADER = struct.Struct('<II')
+MAX_SLAB_CLASSES = 8
+HEADER_SIZE = 256
+
+# sequence number, key hash, expires at (0 for never), written at, key length, value length
+SLOT_HEADER = struct.Struct('<IQddHI')
+# The sequence number, and the rest of the header, written separately
+SLOT_SEQUENCE = struct.Struct('<I')
+SLOT_FIELDS = struct.Struct('<QddHI')
+# Sequence numbers wrap around (staying odd while a slot is being written)
+SEQUENCE_MASK = 0xffffffff
+
+DEFAULT_SLABS = ((256, 4096), (1024, 2048), (4096, 512))
+
+# How many times a reader retries a slot that is being written before calling it a miss
+READ_RETRIES = 10
+
+
+def _key_hash(key):
+    return struct.unpack('<Q', md5(key).digest()[:8])[0]
+
+
+class _StripeLock(object):
+    """
+    Excludes other threads (with a thread lock) and other processes (with an fcntl lock on a
+    byte past the end of the file, which doesn't need to exist).
+    """
+
+    def __init__(self, fd, offset):
+        self.fd = fd
+        self.offset = offset
+        self.thread_lock = threading.Lock()
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        self.thread_lock.release()
+
+
+class _SlabClass(object):
+
+    def __init__(self, offset, slot_size, num_slots, bucket_size, stripes):
+        self.offset = offset
+        self.slot_size = slot_size
+        # A multiple of the number of stripes, so that a bucket is always guarded by the same
+        # stripe (bucket % stripes == key_hash % stripes)
+        num_buckets = max(1, num_slots // bucket_size)
+        self.num_buckets = num_buckets + (-num_buckets % stripes)
+        self.bucket_size = bucket_size
+        self.max_payload = slot_size - SLOT_HEADER.size
+
+    @property
+    def size(self):
+        return self.num_buckets * self.bucket_size * self.slot_size
+
+    def bucket(self, key_hash):
+        return key_hash % self.num_buckets
+
+    def slot_offsets(self, bucket):
+        start = self.offset + bucket * self.bucket_size * self.slot_size
+        return [start + i * self.slot_size for i in range(self.bucket_size)]
+
+
+class SharedMemoryCache(object):
+    """
+    Has the same interface as the raw cache (get, set, add, incr, delete, get_many, set_many).
+    Every process opening the same path with the same options shares the same items.
+    """
+
+    def __init__(self, path, slabs=DEFAULT_SLABS, bucket_size=4, stripes=64, default_timeout=60):
+        self.path = path
+        self.default_timeout = default_timeout
+        self.bucket_size = bucket_size
+        self.stripes = stripes
+
+        if len(slabs) > MAX_SLAB_CLASSES:
+            raise ValueError("At most %s slab classes are supported" % MAX_SLAB_CLASSES)
+
+        self.slab_classes = []
+        offset = HEADER_SIZE
+        for slot_size, num_slots in sorted(slabs):
+            slab_class = _SlabClass(offset, slot_size, num_slots, bucket_size, stripes)
+            self.slab_classes.append(slab_class)
+            offset += slab_class.size
+        self.total_size = offset
+
+        self._open()
+        self._stripe_locks = [_StripeLock(self._fd, self.total_size + i) for i in range(stripes)]
+
+    def _header(self):
+        header = FILE_HEADER.pack(MAGIC, len(self.slab_classes), self.bucket_size, self.stripes)
+        for slab_class in self.slab_classes:
+            header += SLAB_HEADER.pack(slab_class.slot_size, slab_class.num_buckets * slab_class.bucket_size)
+        return header
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Only one process gets to lay out a new file
+            fcntl.lockf(fd, fcntl.LOCK_EX, HEADER_SIZE, 0)
+            try:
+                header = self._header()
+                if os.fstat(fd).st_size == 0:
+                    os.ftruncate(fd, self.total_size)
+                    os.write(fd, header)
+                else:
+                    existing = os.read(fd, len(header))
+                    if existing != header:
+                        raise ValueError("%s was created with different options" % self.path)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN, HEADER_SIZE, 0)
+
+            self._mmap = mmap.mmap(fd, self.total_size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd = fd
+
+    def close(self):
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _lock(self, key_hash):
+        return self._stripe_locks[key_hash % self.stripes]
+
+    def _read_slot(self, offset, key, key_hash):
+        """
+        Returns the pickled value in the slot if it holds key (and hasn't expired), without
+        taking any lock.
+        """
+        buf = self._mmap
+        for attempt in range(READ_RETRIES):
+            header = SLOT_HEADER.unpack_from(buf, offset)
+            sequence, slot_hash, expires_at, written_at, key_len, value_len = header
+
+            if sequence % 2:
+                continue  # being written
+            if slot_hash != key_hash or key_len != len(key):
+                return None
+
+            start = offset + SLOT_HEADER.size
+            slot_key = buf[start:start + key_len]
+            data = buf[start + key_len:start + key_len + value_len]
+
+            if SLOT_HEADER.unpack_from(buf, offset)[0] != sequence:
+                continue  # changed while we were reading
+            if slot_key != key:
+                return None
+            if expires_at and expires_at <= time():
+                return None
+            return data
+
+        return None
+
+    def _write_slot(self, offset, key_hash, expires_at, key, data):
+        # Must be called with the stripe lock held
+        buf = self._mmap
+        sequence = SLOT_HEADER.unpack_from(buf, offset)[0]
+
+        SLOT_SEQUENCE.pack_into(buf, offset, (sequence + 1) & SEQUENCE_MASK)
+        start = offset + SLOT_HEADER.size
+        buf[start:start + len(key) + len(data)] = key + data
+        SLOT_FIELDS.pack_into(buf, offset + SLOT_SEQUENCE.size, key_hash, expires_at, time(), len(key), len(data))
+        # Published last, once everything it guards is written
+        SLOT_SEQUENCE.pack_into(buf, offset, (sequence + 2) & SEQUENCE_MASK)
+
+    def _clear_slot(self, offset):
+        # Must be called with the stripe lock held
+        buf = self._mmap
+        sequence = SLOT_HEADER.unpack_from(buf, offset)[0]
+        SLOT_SEQUENCE.pack_into(buf, offset, (sequence + 1) & SEQUENCE_MASK)
+        SLOT_FIELDS.pack_into(buf, offset + SLOT_SEQUENCE.size, 0, 0, 0, 0, 0)
+        SLOT_SEQUENCE.pack_into(buf, offset, (sequence + 2) & SEQUENCE_MASK)
+
+    def _find(self, key, key_hash):
+        """
+        Returns (slot offset, pickled value) for key, or (None, None).
+        """
+        for slab_class in self.slab_classes:
+            for offset in slab_class.slot_offsets(slab_class.bucket(key_hash)):
+                data = self._read_slot(offset, key, key_hash)
+                if data is not None:
+                    return offset, data
+        return None, None
+
+    def _store(self, key, key_hash, data, timeout):
+        # Must be called with the stripe lock held
+        size = len(key) + len(data)
+        slab_class = None
+        for candidate in self.slab_classes:
+            if size <= candidate.max_payload:
+                slab_class = candidate
+                break
+
+        # The key might be in another slab class if its value changed size
+        self._delete(key, key_hash)
+
+        if slab_class is None:
+            return False
+
+        if timeout is None:
+            timeout = self.default_timeout
+        expires_at = time() + timeout if timeout else 0
+
+        now = time()
+        victim, victim_written_at = None, None
+        for offset in slab_class.slot_offsets(slab_class.bucket(key_hash)):
+            sequence, slot_hash, slot_expires_at, written_at, key_len, value_len = SLOT_HEADER.unpack_from(self._mmap, offset)
+            if not key_len or (slot_expires_at and slot_expires_at <= now):
+                victim = offset
+                break
+            if victim is None or written_at < victim_written_at:
+                victim, victim_written_at = offset, written_at
+
+        self._write_slot(victim, key_hash, expires_at, key, data)
+        return True
+
+    def _delete(self, key, key_hash):
+        # Must be called with the stripe lock held
+        offset, data = self._find(key, key_hash)
+        while offset is not None:
+            self._clear_slot(offset)
+            offset, data = self._find(key, key_hash)
+
+    def get(self, key, default=None):
+        offset, data = self._find(key, _key_hash(key))
+        if data is None:
+            return default
+        return pickle.loads(data)
+
+    def get_many(self, keys):
+        result = {}
+        for key in keys:
+            offset, data = self._find(key, _key_hash(key))
+            if data is not None:
+                result[key] = pickle.loads(data)
+        return result
+
+    def set(self, key, value, timeout=None):
+        """
+        Returns False if the value was too large to be stored.
+        """
+        key_hash = _key_hash(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock(key_hash):
+            return self._store(key, key_hash, data, timeout)
+
+    def set_many(self, vals_by_key, timeout=None):
+        for key, value in vals_by_key.items():
+            self.set(key, value, timeout)
+
+    def add(self, key, value, timeout=None):
+        key_hash = _key_hash(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock(key_hash):
+            if self._find(key, key_hash)[1] is not None:
+                return False
+            return self._store(key, key_hash, data, timeout)
+
+    def incr(self, key, delta=1):
+        key_hash = _key_hash(key)
+        with self._lock(key_hash):
+            offset, data = self._find(key, key_hash)
+            if data is None:
+                raise ValueError("Key '%s' not found" % key)
+
+            expires_at = SLOT_HEADER.unpack_from(self._mmap, offset)[2]
+            value = pickle.loads(data) + delta
+            timeout = max(expires_at - time(), 0.001) if expires_at else 0
+            self._store(key, key_hash, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), timeout)
+            return value
+
+    def delete(self, key):
+        key_hash = _key_hash(key)
+        with self._lock(key_hash):
+            self._delete(key, key_hash)
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+
+    def clear(self):
+        for stripe in range(self.stripes):
+            with self._lock(stripe):
+                for slab_class in self.slab_classes:
+                    for bucket in range(slab_class.num_buckets):
+                        if bucket % self.stripes != stripe:
+                            continue
+                        for offset in slab_class.slot_offsets(bucket):
+                            self._clear_slot(offset)
@@ -19,6 +19,12 @@ def set_many(vals_by_key, timeout=None):
     for key, value in vals_by_key.items():
         _cache_dict[key] = value
 
+def add(key, value, timeout=None):
+    if key in _cache_dict:
+        return False
+    _cache_dict[key] = value
+    return True
+
 def get(key):
     return _cache_dict.get(key)
 
@@ -35,3 +41,7 @@ def incr(key, delta=1):
         _cache_dict[key] = 0
     _cache_dict[key] += delta
     return _cache_dict[key]
+
+def delete_many(keys):
+    for key in keys:
+        delete(key)
@@ -0,0 +1,315 @@
+"""
+Replays a cache access trace (see hscacheutils.trace) against hypothetical cache policies, to
+estimate what changing TTLs, tiers or sizes would do before doing it.
+
+Each policy is made of an optional local tier (LRU or TinyLFU admission, sized in items) in
+front of the backend (unbounded, or LRU sized in bytes), a TTL, and an early refresh fraction
+(values read in the last fraction of their TTL are recomputed in the background, instead of
+expiring under a request).
+
+    from hscacheutils.simulator import SimulationPolicy, simulate_file
+
+    for report in simulate_file('/tmp/cache.trace', [
+            SimulationPolicy('current', ttl=300),
+            SimulationPolicy('local lru', local_size=1000, local_ttl=5, ttl=300),
+            SimulationPolicy('local tinylfu + refresh', local_size=1000, local_policy='tinylfu', ttl=3600, early_refresh=0.1)]):
+        print report
+
+Or from the command line:
+
+    python -m hscacheutils.simulator /tmp/cache.trace --local-size 1000 --local-policy tinylfu --ttl 3600
+
+Values that were already cached before tracing started have unknown compute times and sizes,
+the averages of the known ones are used for them.
+"""
+
+import sys
+
+from collections import OrderedDict
+from optparse import OptionParser
+
+from hscacheutils.trace import read_trace, GET_HIT, GET_MISS, SET, INVALIDATE, DELETE
+
+
+LRU = 'lru'
+TINYLFU = 'tinylfu'
+
+
+class SimulationPolicy(object):
+
+    def __init__(self, name='policy', local_size=0, local_policy=LRU, local_ttl=None, backend_size=None,
+                 ttl=None, early_refresh=0):
+        if local_policy not in (LRU, TINYLFU):
+            raise ValueError("Unknown local policy %r" % local_policy)
+        self.name = name
+        self.local_size = local_size
+        self.local_policy = local_policy
+        self.local_ttl = local_ttl
+        self.backend_size = backend_size
+        self.ttl = ttl
+        self.early_refresh = early_refresh
+
+
+class SimulationReport(object):
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.requests = 0
+        self.local_hits = 0
+        self.backend_hits = 0
+        self.computes = 0
+        self.refreshes = 0
+        self.backend_ops = 0
+        self.compute_time = 0.0
+        self.saved_compute_time = 0.0
+
+    @property
+    def hits(self):
+        return self.local_hits + self.backend_hits
+
+    @property
+    def hit_ratio(self):
+        return float(self.hits) / self.requests if self.requests else 0.0
+
+    @property
+    def backend_ops_per_request(self):
+        return float(self.backend_ops) / self.requests if self.requests else 0.0
+
+    def as_dict(self):
+        return dict(policy=self.policy.name, requests=self.requests, hit_ratio=self.hit_ratio,
+                    local_hits=self.local_hits, backend_hits=self.backend_hits, computes=self.computes,
+                    refreshes=self.refreshes, backend_ops=self.backend_ops,
+                    backend_ops_per_request=self.backend_ops_per_request,
+                    compute_time=self.compute_time, saved_compute_time=self.saved_compute_time)
+
+    def __str__(self):
+        return ("%s: hit ratio %.3f (%s local, %s backend hits of %s requests), %s backend ops (%.2f/request), "
+                "%.1fs computing (+%s refreshes), %.1fs of compute saved") % (
+            self.policy.name, self.hit_ratio, self.local_hits, self.backend_hits, self.requests, self.backend_ops,
+            self.backend_ops_per_request, self.compute_time, self.refreshes, self.saved_compute_time)
+
+
+class _CountMinSketch(object):
+    """
+    Frequency estimates for TinyLFU admission, halved every sample_size increments so that
+    old popularity fades.
+    """
+
+    DEPTH = 4
+
+    def __init__(self, width):
+        self.width = max(16, width)
+        self.rows = [[0] * self.width for i in range(self.DEPTH)]
+        self.sample_size = 10 * self.width
+        self.additions = 0
+
+    def _indexes(self, key_hash):
+        for i in range(self.DEPTH):
+            yield i, ((key_hash >> (i * 16)) ^ (key_hash * (i + 1))) % self.width
+
+    def add(self, key_hash):
+        for row, index in self._indexes(key_hash):
+            self.rows[row][index] += 1
+
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self.additions = 0
+            for row in self.rows:
+                for i in range(self.width):
+                    row[i] //= 2
+
+    def estimate(self, key_hash):
+        return min(self.rows[row][index] for row, index in self._indexes(key_hash))
+
+
+class _Tier(object):
+    """
+    An LRU of key hash => (stored at, size), bounded by items or by bytes, optionally with
+    TinyLFU admission.
+    """
+
+    def __init__(self, max_items=None, max_bytes=None, ttl=None, admission=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.sketch = _CountMinSketch(4 * max_items) if admission == TINYLFU and max_items else None
+
+    def record_access(self, key_hash):
+        if self.sketch is not None:
+            self.sketch.add(key_hash)
+
+    def get(self, key_hash, now):
+        entry = self.entries.get(key_hash)
+        if entry is None:
+            return None
+        if self.ttl is not None and now - entry[0] > self.ttl:
+            self.remove(key_hash)
+            return None
+        del self.entries[key_hash]
+        self.entries[key_hash] = entry
+        return entry
+
+    def _full(self, extra_bytes):
+        if self.max_items is not None and len(self.entries) >= self.max_items:
+            return True
+        if self.max_bytes is not None and self.bytes + extra_bytes > self.max_bytes:
+            return True
+        return False
+
+    def put(self, key_hash, now, size):
+        self.remove(key_hash)
+
+        if self.sketch is not None and self.entries and self._full(size):
+            victim = next(iter(self.entries))
+            if self.sketch.estimate(key_hash) <= self.sketch.estimate(victim):
+                return  # not admitted
+
+        while self.entries and self._full(size):
+            self.remove(next(iter(self.entries)))
+
+        self.entries[key_hash] = (now, size)
+        self.bytes += size
+
+    def remove(self, key_hash):
+        entry = self.entries.pop(key_hash, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+class _KnownCosts(object):
+    """
+    The compute time and size of every key, as far as the trace tells.
+    """
+
+    def __init__(self):
+        self.compute_times = dict()
+        self.sizes = dict()
+
+    def learn(self, records):
+        for record in records:
+            if record.op == GET_MISS and record.compute_time:
+                self.compute_times.setdefault(record.key_hash, record.compute_time)
+            if record.op in (GET_MISS, SET) and record.value_size:
+                self.sizes[record.key_hash] = record.value_size
+
+        self.mean_compute_time = _mean(self.compute_times.values())
+        self.mean_size = int(_mean(self.sizes.values()))
+
+    def compute_time(self, key_hash):
+        return self.compute_times.get(key_hash, self.mean_compute_time)
+
+    def size(self, key_hash):
+        return self.sizes.get(key_hash, self.mean_size)
+
+
+def _mean(values):
+    values = list(values)
+    if not values:
+        return 0.0
+    return float(sum(values)) / len(values)
+
+
+def simulate(records, policies):
+    """
+    Replays a list of TraceRecords against every policy, returning a SimulationReport for each.
+    """
+    records = list(records)
+    costs = _KnownCosts()
+    costs.learn(records)
+    return [_simulate_policy(records, policy, costs) for policy in policies]
+
+
+def simulate_file(path, policies):
+    return simulate(read_trace(path), policies)
+
+
+def _simulate_policy(records, policy, costs):
+    report = SimulationReport(policy)
+
+    local = None
+    if policy.local_size:
+        local = _Tier(max_items=policy.local_size, ttl=policy.local_ttl, admission=policy.local_policy)
+    backend = _Tier(max_bytes=policy.backend_size, ttl=policy.ttl)
+
+    for record in records:
+        now, key_hash = record.timestamp, record.key_hash
+
+        if record.op in (GET_HIT, GET_MISS):
+            report.requests += 1
+
+            if local is not None:
+                local.record_access(key_hash)
+                if local.get(key_hash, now) is not None:
+                    report.local_hits += 1
+                    report.saved_compute_time += costs.compute_time(key_hash)
+                    continue
+
+            report.backend_ops += 1
+            entry = backend.get(key_hash, now)
+
+            if entry is not None:
+                report.backend_hits += 1
+                report.saved_compute_time += costs.compute_time(key_hash)
+
+                if policy.early_refresh and policy.ttl and now - entry[0] > policy.ttl * (1 - policy.early_refresh):
+                    # Recomputed in the background, the request itself was still a hit
+                    report.refreshes += 1
+                    report.compute_time += costs.compute_time(key_hash)
+                    report.backend_ops += 1
+                    backend.put(key_hash, now, entry[1])
+            else:
+                report.computes += 1
+                report.compute_time += costs.compute_time(key_hash)
+                report.backend_ops += 1
+                backend.put(key_hash, now, costs.size(key_hash))
+
+            if local is not None:
+                local.put(key_hash, now, costs.size(key_hash))
+
+        elif record.op == SET:
+            report.backend_ops += 1
+            backend.put(key_hash, now, costs.size(key_hash))
+            if local is not None:
+                local.remove(key_hash)
+
+        elif record.op == DELETE:
+            report.backend_ops += 1
+            backend.remove(key_hash)
+            if local is not None:
+                local.remove(key_hash)
+
+        elif record.op == INVALIDATE:
+            # Bumping a generation changes the keys of everything under it, nothing to remove
+            report.backend_ops += 1
+
+    return report
+
+
+def main(argv=None):
+    parser = OptionParser(usage="python -m hscacheutils.simulator <trace file> [options]")
+    parser.add_option('--local-size', type='int', default=0, help="items in the local tier (0 for none)")
+    parser.add_option('--local-policy', default=LRU, choices=[LRU, TINYLFU])
+    parser.add_option('--local-ttl', type='float', default=None)
+    parser.add_option('--backend-size', type='int', default=None, help="bytes in the backend (unbounded by default)")
+    parser.add_option('--ttl', type='float', default=None)
+    parser.add_option('--early-refresh', type='float', default=0,
+                      help="fraction of the TTL at the end of which values are refreshed early")
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 1:
+        parser.error("expected a trace file")
+
+    baseline = SimulationPolicy('as traced (unbounded, no ttl)')
+    candidate = SimulationPolicy('candidate', local_size=options.local_size, local_policy=options.local_policy,
+                                 local_ttl=options.local_ttl, backend_size=options.backend_size, ttl=options.ttl,
+                                 early_refresh=options.early_refresh)
+
+    for report in simulate_file(args[0], [baseline, candidate]):
+        sys.stdout.write("%s\n" % report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
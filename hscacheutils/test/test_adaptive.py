@@ -0,0 +1,123 @@
+from time import sleep, time
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils.adaptive import AdaptivePolicy, FunctionStats, LOCAL_TIER, MEMCACHE_TIER
+from hscacheutils.generational_cache import gen_cache
+
+
+def test_policy_decisions():
+    policy = AdaptivePolicy(min_samples=10, min_timeout=60, max_timeout=3600)
+
+    stats = FunctionStats()
+    eq_(False, policy.decide(stats, 300).bypass)
+
+    # Cheap to compute, big to fetch
+    stats.hits = 5
+    stats.record_miss(0.000001, 1024 * 1024)
+    stats.misses = 10
+    ok_(policy.decide(stats, 300).bypass)
+
+    # Expensive, small and hot
+    stats = FunctionStats()
+    stats.hits = 95
+    stats.record_miss(0.5, 100)
+    stats.misses = 5
+    decision = policy.decide(stats, 300)
+    ok_(not decision.bypass)
+    eq_(LOCAL_TIER, decision.tier)
+    eq_(300, decision.timeout)
+    eq_(3600, policy.decide(stats, None).timeout)
+
+    # Invalidated more often than it is re-read
+    stats = FunctionStats()
+    stats.hits = 1
+    stats.record_miss(0.5, 100)
+    stats.misses = 99
+    stats.invalidations = 99
+    ok_(policy.decide(stats, 300).bypass)
+
+    # Invalidated now and then
+    stats = FunctionStats()
+    stats.since = time() - 1000
+    stats.hits = 50
+    stats.record_miss(0.5, 100000)
+    stats.misses = 50
+    stats.invalidations = 10
+    decision = policy.decide(stats, 300)
+    eq_(MEMCACHE_TIER, decision.tier)
+    ok_(150 <= decision.timeout <= 250)
+
+    # Never above the configured timeout
+    eq_(100, policy.decide(stats, 100).timeout)
+
+
+def test_adaptive_wrapped_function():
+    policy = AdaptivePolicy(min_samples=10, reevaluate_every=10)
+    calls = []
+
+    @gen_cache.wrap("adaptive_test", timeout=60, adaptive=policy)
+    def hot_function(a):
+        calls.append(a)
+        sleep(0.002)
+        return time() + random.randint(0, 10000000)
+
+    first_result = hot_function(1)
+    for i in range(19):
+        eq_(first_result, hot_function(1))
+    eq_(1, len(calls))
+
+    decision = hot_function.adaptive.decision
+    eq_(LOCAL_TIER, decision.tier)
+    ok_('adaptive_test' in str(gen_cache.adaptive_decisions()))
+
+    # Served from the local tier, but still invalidated through the generations
+    eq_(first_result, hot_function(1))
+    hot_function.invalidate(1)
+    second_result = hot_function(1)
+    ok_(first_result != second_result)
+    eq_(2, len(calls))
+
+    gen_cache.invalidate('adaptive_test')
+    ok_(first_result != hot_function(1))
+    eq_(1, hot_function.adaptive.stats.invalidations)
+
+
+def test_adaptive_local_tier_copies():
+    policy = AdaptivePolicy(min_samples=10, reevaluate_every=10)
+
+    @gen_cache.wrap("adaptive_test", timeout=60, adaptive=policy)
+    def hot_list(a):
+        sleep(0.002)
+        return [a]
+
+    for i in range(20):
+        hot_list(1)
+    eq_(LOCAL_TIER, hot_list.adaptive.decision.tier)
+
+    # A caller mutating its value doesn't change the other callers'
+    hot_list(1).append(2)
+    eq_([1], hot_list(1))
+
+
+def test_adaptive_bypass():
+    policy = AdaptivePolicy(min_samples=10, reevaluate_every=10, bypass_probation=3600)
+    calls = []
+
+    @gen_cache.wrap("adaptive_test", timeout=60, adaptive=policy)
+    def cheap_function(a):
+        calls.append(a)
+        return 'x' * 100000
+
+    for i in range(10):
+        cheap_function(i)
+    ok_(cheap_function.adaptive.decision.bypass)
+
+    cheap_function(1)
+    cheap_function(1)
+    eq_(12, len(calls))
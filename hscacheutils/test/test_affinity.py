@@ -0,0 +1,155 @@
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from collections import defaultdict
+
+from hscacheutils import metrics, raw_cache
+from hscacheutils.affinity import AffineCache, HashRing, affine_key
+from hscacheutils.batching_cache import BatchingCache
+from hscacheutils.generational_cache import CustomUseGenCache, gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.tiered_cache import TieredCache
+
+
+class CountingCache(LocalLRUCache):
+    get_manys = 0
+
+    def get_many(self, keys):
+        self.get_manys += 1
+        return super(CountingCache, self).get_many(keys)
+
+
+def test_hash_ring():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    counts = defaultdict(int)
+    for i in range(4000):
+        counts[ring.node('portal_id:%s' % i)] += 1
+
+    # Stable, and roughly balanced
+    eq_(ring.node('portal_id:53'), HashRing(['a', 'b', 'c', 'd']).node('portal_id:53'))
+    eq_(4, len(counts))
+    ok_(all(600 < count < 1400 for count in counts.values()))
+
+    # Adding a node only moves about a fifth of the tokens
+    bigger = HashRing(['a', 'b', 'c', 'd', 'e'])
+    moved = sum(1 for i in range(4000) if ring.node('portal_id:%s' % i) != bigger.node('portal_id:%s' % i))
+    ok_(moved < 4000 * 0.35)
+
+
+def test_affine_cache():
+    nodes = [LocalLRUCache() for i in range(4)]
+    cache = AffineCache(nodes)
+
+    keys = [affine_key('key%s' % i, 'portal_id:53') for i in range(20)]
+    cache.set_many(dict((key, i) for i, key in enumerate(keys)))
+    eq_(1, len([node for node in nodes if len(node)]))
+
+    lookups = metrics.get('affinity.multi_node_lookups')
+    eq_(dict((key, i) for i, key in enumerate(keys)), cache.get_many(keys))
+    eq_(lookups, metrics.get('affinity.multi_node_lookups'))
+
+    # Plain keys are spread out
+    cache.set_many(dict(('plain%s' % i, i) for i in range(20)))
+    eq_(4, len([node for node in nodes if len(node)]))
+    eq_(dict(('plain%s' % i, i) for i in range(20)), cache.get_many(['plain%s' % i for i in range(20)]))
+    eq_(lookups + 1, metrics.get('affinity.multi_node_lookups'))
+
+    # Bumped on every node that has it
+    nodes[0].set('counter', 1)
+    nodes[2].set('counter', 5)
+    eq_(6, cache.incr_everywhere('counter'))
+    eq_(2, nodes[0].get('counter'))
+    try:
+        cache.incr_everywhere('nope')
+        ok_(False)
+    except ValueError:
+        pass
+
+
+def test_affine_wrapped_calls():
+    nodes = [CountingCache() for i in range(4)]
+    previous = raw_cache.set_backend(AffineCache(nodes))
+    calls = []
+    try:
+        @gen_cache.wrap('affinity_test', 'affinity_test_portal:affinity_portal_id', affinity='affinity_portal_id')
+        def get_thing(affinity_portal_id, thing_id):
+            calls.append((affinity_portal_id, thing_id))
+            return '%s-%s' % (affinity_portal_id, thing_id)
+
+        for portal_id in range(10):
+            eq_('%s-1' % portal_id, get_thing(portal_id, 1))
+
+        # Every lookup of a portal hits its node only
+        lookups = metrics.get('affinity.multi_node_lookups')
+        for node in nodes:
+            node.get_manys = 0
+        for portal_id in range(10):
+            eq_('%s-1' % portal_id, get_thing(portal_id, 1))
+        eq_(10, len(calls))
+        eq_(lookups, metrics.get('affinity.multi_node_lookups'))
+        eq_(10, sum(node.get_manys for node in nodes))
+
+        # Invalidations of shared generations reach every tenant's copy
+        gen_cache.invalidate('affinity_test')
+        for portal_id in range(10):
+            eq_('%s-1' % portal_id, get_thing(portal_id, 1))
+        eq_(20, len(calls))
+
+        gen_cache.invalidate('affinity_test_portal:affinity_portal_id', affinity_portal_id=3)
+        get_thing(3, 1)
+        get_thing(4, 1)
+        eq_(21, len(calls))
+
+        get_thing.invalidate(5, 1)
+        get_thing(5, 1)
+        eq_(22, len(calls))
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_affine_custom_cache():
+    nodes = [LocalLRUCache() for i in range(4)]
+    previous = raw_cache.set_backend(AffineCache(nodes))
+    try:
+        for packed in (False, True):
+            things_cache = CustomUseGenCache(['affinity_custom_test', 'affinity_custom_test_portal:affinity_portal_id'],
+                                             affinity='affinity_portal_id', packed=packed)
+            for node in nodes:
+                node.clear()
+
+            for i in range(10):
+                things_cache.set(i, affinity_portal_id=53, cache_key='thing%s' % i)
+            eq_(range(10), [things_cache.get(affinity_portal_id=53, cache_key='thing%s' % i) for i in range(10)])
+            eq_(1, len([node for node in nodes if len(node)]))
+
+            things_cache.invalidate('affinity_custom_test')
+            eq_(None, things_cache.get(affinity_portal_id=53, cache_key='thing1'))
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_affine_behind_wrappers():
+    # As installed by raw_cache with RAW_CACHE_BATCHING and RAW_CACHE_SHARED_MEMORY_TIER
+    for wrap in (lambda backend: BatchingCache(backend, window=0),
+                 lambda backend: TieredCache(LocalLRUCache(), backend),
+                 lambda backend: TieredCache(LocalLRUCache(), BatchingCache(backend, window=0))):
+        previous = raw_cache.set_backend(wrap(AffineCache([LocalLRUCache() for i in range(4)])))
+        calls = []
+        try:
+            @gen_cache.wrap('affinity_wrapped_test', affinity='affinity_portal_id')
+            def get_thing(affinity_portal_id):
+                calls.append(affinity_portal_id)
+                return affinity_portal_id
+
+            for portal_id in range(8):
+                get_thing(portal_id)
+            gen_cache.invalidate('affinity_wrapped_test')
+            gen_cache.invalidate_many(['affinity_wrapped_test'])
+            for portal_id in range(8):
+                get_thing(portal_id)
+            eq_(16, len(calls))
+        finally:
+            raw_cache.set_backend(previous)
@@ -0,0 +1,86 @@
+import threading
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import metrics, raw_cache
+from hscacheutils.batching_cache import BatchingCache
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+
+
+class CountingCache(LocalLRUCache):
+    get_manys = 0
+
+    def get_many(self, keys):
+        self.get_manys += 1
+        return super(CountingCache, self).get_many(keys)
+
+
+def test_batching_cache():
+    backend = CountingCache()
+    cache = BatchingCache(backend, window=0.05)
+
+    for i in range(20):
+        cache.set('key%s' % i, i)
+    eq_(3, cache.get('key3'))
+    eq_('default', cache.get('nope', 'default'))
+    eq_({'key1': 1, 'key2': 2}, cache.get_many(['key1', 'key2', 'nope']))
+
+    backend.get_manys = 0
+    results = dict()
+
+    def lookup(i):
+        results[i] = cache.get_many(['key%s' % i, 'key%s' % (i + 1)])
+
+    threads = [threading.Thread(target=lookup, args=(i,)) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    eq_(dict((i, {'key%s' % i: i, 'key%s' % (i + 1): i + 1}) for i in range(10)), results)
+    ok_(backend.get_manys < 10)
+
+
+def test_batching_cache_max_batch():
+    backend = CountingCache()
+    cache = BatchingCache(backend, window=10, max_batch=2)
+
+    # A full batch doesn't wait for the window
+    eq_({}, cache.get_many(['a', 'b']))
+    eq_(1, backend.get_manys)
+
+
+def test_batching_cache_errors():
+    class BrokenCache(LocalLRUCache):
+        def get_many(self, keys):
+            raise IOError("down")
+
+    cache = BatchingCache(BrokenCache(), window=0)
+    try:
+        cache.get('a')
+        ok_(False)
+    except IOError:
+        pass
+
+
+def test_gen_cache_with_batching_client():
+    previous = raw_cache.get_backend()
+    batching_cache = raw_cache.install_batching_client(window=0.001)
+    try:
+        batches = metrics.get('batching.batches')
+
+        @gen_cache.wrap("batching_test", timeout=60)
+        def func(x):
+            return x * 2
+
+        eq_(4, func(2))
+        eq_(4, func(2))
+        ok_(metrics.get('batching.batches') > batches)
+        ok_(batching_cache.backend is previous)
+    finally:
+        raw_cache.set_backend(previous)
@@ -0,0 +1,135 @@
+from time import sleep, time
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import metrics, raw_cache
+from hscacheutils.circuit_breaker import CircuitBreaker, CacheUnavailable, install_circuit_breaker, OPEN, CLOSED
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+
+
+class FlakyCache(LocalLRUCache):
+    """
+    A local cache that can be made to fail or be slow on demand.
+    """
+    down = False
+    delay = 0
+
+    def _maybe_fail(self):
+        if self.delay:
+            sleep(self.delay)
+        if self.down:
+            raise IOError("memcache is down")
+
+    def get(self, key, default=None):
+        self._maybe_fail()
+        return super(FlakyCache, self).get(key, default)
+
+    def get_many(self, keys):
+        self._maybe_fail()
+        return super(FlakyCache, self).get_many(keys)
+
+    def set(self, key, value, timeout=None):
+        self._maybe_fail()
+        return super(FlakyCache, self).set(key, value, timeout)
+
+    def set_many(self, vals_by_key, timeout=None):
+        self._maybe_fail()
+        return super(FlakyCache, self).set_many(vals_by_key, timeout)
+
+    def add(self, key, value, timeout=None):
+        self._maybe_fail()
+        return super(FlakyCache, self).add(key, value, timeout)
+
+
+class with_flaky_cache(object):
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self.cache = FlakyCache()
+
+    def __enter__(self):
+        self.previous_backend = raw_cache.set_backend(self.cache)
+        self.previous_breaker = install_circuit_breaker(self.breaker)
+        return self.cache
+
+    def __exit__(self, *exc_info):
+        raw_cache.set_backend(self.previous_backend)
+        install_circuit_breaker(self.previous_breaker)
+
+
+def test_breaker_state_machine():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    trips = metrics.get('circuit_breaker.trips')
+
+    def fail():
+        raise IOError()
+
+    for i in range(2):
+        try:
+            breaker.call('get', fail)
+        except CacheUnavailable:
+            pass
+
+    eq_(OPEN, breaker.state)
+    eq_(trips + 1, metrics.get('circuit_breaker.trips'))
+    ok_(not breaker.allow_request())
+
+    sleep(0.06)
+    # A single trial call gets through once the reset timeout has passed
+    eq_('ok', breaker.call('get', lambda: 'ok'))
+    eq_(CLOSED, breaker.state)
+
+
+def test_wrapped_function_computes_directly_when_open():
+    calls = []
+
+    @gen_cache.wrap("breaker_test", timeout=60)
+    def func(a):
+        calls.append(a)
+        return time() + random.randint(0, 10000000)
+
+    with with_flaky_cache(CircuitBreaker(failure_threshold=1, reset_timeout=60)) as cache:
+        first_result = func(1)
+        eq_(first_result, func(1))
+        eq_(1, len(calls))
+
+        cache.down = True
+        second_result = func(1)
+        ok_(second_result != first_result)
+        eq_(2, len(calls))
+
+        # Now open, so the cache isn't even tried
+        cache.down = False
+        func(1)
+        eq_(3, len(calls))
+
+        eq_(None, gen_cache.get('breaker_test', add_to_key='x'))
+        gen_cache.set('value', 'breaker_test', add_to_key='x')
+
+
+def test_wrapped_function_serves_local_copy_when_open():
+    @gen_cache.wrap("breaker_test", timeout=60)
+    def func(a):
+        return time() + random.randint(0, 10000000)
+
+    with with_flaky_cache(CircuitBreaker(failure_threshold=1, reset_timeout=60, local_copies=10)) as cache:
+        first_result = func(1)
+
+        cache.down = True
+        eq_(first_result, func(1))
+        ok_(func(2) != func(2))
+
+
+def test_slow_calls_trip_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, budgets={'get': 0.001, 'get_many': 0.001, 'add': 0.001})
+
+    with with_flaky_cache(breaker) as cache:
+        cache.delay = 0.005
+        gen_cache.get('breaker_test', add_to_key='slow')
+        eq_(OPEN, breaker.state)
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+import threading
+
+from time import sleep
+
+from nose.tools import ok_, eq_
+
+from hscacheutils.debounce import InvalidationDebouncer
+
+
+def test_one_scheduler_thread():
+    bumped = []
+    debouncer = InvalidationDebouncer(lambda generation, **kwargs: bumped.append(kwargs['portal_id']),
+                                      {'debounce_test:portal_id': 0.05})
+    threads = threading.active_count()
+    for portal_id in range(50):
+        for i in range(3):
+            debouncer.invalidate('debounce_test:portal_id', 'debounce_test:%s' % portal_id, portal_id=portal_id)
+    ok_(threading.active_count() <= threads + 1)
+    eq_(50, len(bumped))
+
+    sleep(0.2)
+    eq_(range(50), sorted(bumped[50:]))
+
+
+def test_flushed_at_exit():
+    # A job exiting right after its last burst still does the trailing invalidation
+    script = (
+        "import sys\n"
+        "from hscacheutils.debounce import InvalidationDebouncer\n"
+        "def bump(generation, **kwargs):\n"
+        "    sys.stdout.write('bumped %s\\n' % kwargs['portal_id'])\n"
+        "debouncer = InvalidationDebouncer(bump, {'debounce_test:portal_id': 60})\n"
+        "for i in range(3):\n"
+        "    debouncer.invalidate('debounce_test:portal_id', 'debounce_test:1', portal_id=1)\n")
+    output = subprocess.check_output([sys.executable, '-c', script])
+    eq_(['bumped 1', 'bumped 1'], output.splitlines())
@@ -0,0 +1,102 @@
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import metrics, raw_cache
+from hscacheutils.fake_redis import FakeRedis
+from hscacheutils.generational_cache import CustomUseGenCache, gen_cache
+from hscacheutils.redis_cache import RedisCache
+
+
+calls = []
+settings_cache = CustomUseGenCache(['deps_test_settings:deps_portal_id'])
+
+
+@gen_cache.wrap('deps_test_contact:deps_contact_id')
+def get_contact(deps_contact_id):
+    calls.append(('contact', deps_contact_id))
+    return 'contact %s' % deps_contact_id
+
+
+@gen_cache.wrap('deps_test_dashboard:deps_portal_id', track_dependencies=True)
+def get_dashboard(deps_portal_id, deps_contact_ids):
+    calls.append(('dashboard', deps_portal_id))
+    return [get_contact(contact_id) for contact_id in deps_contact_ids] + [settings_cache.get(deps_portal_id=deps_portal_id)]
+
+
+@gen_cache.wrap('deps_test_page', track_dependencies=True)
+def get_page(deps_portal_id):
+    calls.append(('page', deps_portal_id))
+    return get_dashboard(deps_portal_id, [1, 2])
+
+
+def _check_dependencies():
+    del calls[:]
+
+    eq_(['contact 1', 'contact 2', None], get_dashboard(53, [1, 2]))
+    eq_(['contact 1', 'contact 2', None], get_dashboard(53, [1, 2]))
+    eq_(3, len(calls))
+
+    # A nested generation invalidates the outer value
+    stale = metrics.get('dependencies.stale')
+    gen_cache.invalidate('deps_test_contact:deps_contact_id', deps_contact_id=2)
+    get_dashboard(53, [1, 2])
+    eq_([('dashboard', 53), ('contact', 2)], calls[3:])
+    eq_(stale + 1, metrics.get('dependencies.stale'))
+
+    # Contacts it didn't use don't
+    gen_cache.invalidate('deps_test_contact:deps_contact_id', deps_contact_id=3)
+    get_dashboard(53, [1, 2])
+    eq_(5, len(calls))
+
+    # And the generations of gen_cache.get/CustomUseGenCache count too
+    settings_cache.invalidate(deps_portal_id=53)
+    get_dashboard(53, [1, 2])
+    eq_(6, len(calls))
+
+    # Transitively, through a nested tracked value that was a hit
+    del calls[:]
+    get_page(53)
+    get_page(53)
+    eq_([('page', 53)], calls)
+    gen_cache.invalidate('deps_test_contact:deps_contact_id', deps_contact_id=1)
+    eq_(['contact 1', 'contact 2', None], get_page(53))
+    eq_([('page', 53), ('page', 53), ('dashboard', 53), ('contact', 1)], calls)
+
+
+@gen_cache.wrap(track_dependencies=True)
+def get_constant():
+    calls.append(('constant',))
+    return 'constant'
+
+
+@gen_cache.wrap('deps_test_outer:deps_portal_id', track_dependencies=True)
+def get_outer(deps_portal_id):
+    calls.append(('outer', deps_portal_id))
+    return [get_constant(), get_contact(deps_portal_id)]
+
+
+def test_nested_tracked_without_generations():
+    # The inner collector is equal to the outer one (both empty) when it stops
+    del calls[:]
+    eq_(['constant', 'contact 7'], get_outer(7))
+    eq_(['constant', 'contact 7'], get_outer(7))
+    eq_([('outer', 7), ('constant',), ('contact', 7)], calls)
+
+    gen_cache.invalidate('deps_test_contact:deps_contact_id', deps_contact_id=7)
+    eq_(['constant', 'contact 7'], get_outer(7))
+    eq_(('outer', 7), calls[3])
+
+
+def test_dependencies():
+    _check_dependencies()
+
+
+def test_dependencies_server_side():
+    previous = raw_cache.set_backend(RedisCache(client=FakeRedis()))
+    try:
+        _check_dependencies()
+    finally:
+        raw_cache.set_backend(previous)
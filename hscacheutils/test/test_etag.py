@@ -0,0 +1,127 @@
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+
+from hscacheutils import metrics
+from hscacheutils.etag import GenerationETagMiddleware, generation_etag, parse_if_none_match
+from hscacheutils.generational_cache import gen_cache
+
+
+calls = []
+
+
+@generation_etag('etag_test', 'etag_test_portal:etag_portal_id')
+def page(request, etag_portal_id):
+    calls.append(etag_portal_id)
+    return HttpResponse('page of %s' % etag_portal_id)
+
+
+@generation_etag('etag_test', cache_response=True, vary_on=lambda request: request.COOKIES.get('user'))
+def cached_page(request):
+    calls.append('cached')
+    response = HttpResponse('cached page', content_type='text/plain')
+    response['X-Rendered'] = 'yes'
+    return response
+
+
+def plain_page(request):
+    calls.append('plain')
+    return HttpResponse('plain')
+
+
+def missing_page(request):
+    calls.append('missing')
+    return HttpResponse('missing', status=404)
+
+
+def test_parse_if_none_match():
+    eq_(['abc', 'def', '*'], parse_if_none_match('"abc", W/"def", *'))
+
+
+def test_etag_not_modified():
+    factory = RequestFactory()
+    del calls[:]
+
+    response = page(factory.get('/page'), etag_portal_id=1)
+    eq_(200, response.status_code)
+    etag = response['ETag']
+    eq_([1], calls)
+
+    # Revalidating skips the view
+    not_modified = metrics.get('etag.not_modified')
+    response = page(factory.get('/page', HTTP_IF_NONE_MATCH=etag), etag_portal_id=1)
+    eq_(304, response.status_code)
+    eq_(etag, response['ETag'])
+    eq_([1], calls)
+    eq_(not_modified + 1, metrics.get('etag.not_modified'))
+
+    # Other arguments, urls and methods don't match
+    eq_(200, page(factory.get('/page', HTTP_IF_NONE_MATCH=etag), etag_portal_id=2).status_code)
+    eq_(200, page(factory.get('/page?x=1', HTTP_IF_NONE_MATCH=etag), etag_portal_id=1).status_code)
+    eq_(200, page(factory.post('/page', HTTP_IF_NONE_MATCH=etag), etag_portal_id=1).status_code)
+    eq_(4, len(calls))
+
+    # Invalidating changes the ETag
+    gen_cache.invalidate('etag_test_portal:etag_portal_id', etag_portal_id=1)
+    response = page(factory.get('/page', HTTP_IF_NONE_MATCH=etag), etag_portal_id=1)
+    eq_(200, response.status_code)
+    ok_(response['ETag'] != etag)
+
+
+def test_cached_response():
+    factory = RequestFactory()
+    del calls[:]
+
+    response = cached_page(factory.get('/cached'))
+    eq_('cached page', response.content)
+
+    hits = metrics.get('etag.response_hits')
+    response = cached_page(factory.get('/cached'))
+    eq_(['cached'], calls)
+    eq_(hits + 1, metrics.get('etag.response_hits'))
+    eq_('cached page', response.content)
+    eq_('text/plain', response['Content-Type'])
+    eq_('yes', response['X-Rendered'])
+    ok_(response.has_header('ETag'))
+
+    # Varies on the user
+    request = factory.get('/cached')
+    request.COOKIES['user'] = 'someone'
+    cached_page(request)
+    eq_(2, len(calls))
+
+    gen_cache.invalidate('etag_test')
+    cached_page(factory.get('/cached'))
+    eq_(3, len(calls))
+
+
+def test_middleware():
+    factory = RequestFactory()
+    del calls[:]
+
+    settings.GEN_CACHE_ETAG_VIEWS = {
+        '%s.plain_page' % __name__: {'generations': ['etag_test']},
+        '%s.missing_page' % __name__: {'generations': ['etag_test'], 'cache_response': True},
+    }
+    try:
+        middleware = GenerationETagMiddleware()
+    finally:
+        del settings.GEN_CACHE_ETAG_VIEWS
+
+    eq_(None, middleware.process_view(factory.get('/page'), page, (), {'etag_portal_id': 1}))
+
+    etag = middleware.process_view(factory.get('/plain'), plain_page, (), {})['ETag']
+    eq_(304, middleware.process_view(factory.get('/plain', HTTP_IF_NONE_MATCH=etag), plain_page, (), {}).status_code)
+    eq_(['plain'], calls)
+
+    # Only 200s get an ETag or are cached
+    response = middleware.process_view(factory.get('/missing'), missing_page, (), {})
+    eq_(404, response.status_code)
+    ok_(not response.has_header('ETag'))
+    middleware.process_view(factory.get('/missing'), missing_page, (), {})
+    eq_(['plain', 'missing', 'missing'], calls)
@@ -0,0 +1,134 @@
+import logging
+
+from time import time
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import generation_values, raw_cache
+from hscacheutils.generation_values import HLC, MICROSECONDS, HybridLogicalClock, MicrosecondValues, base36, describe
+from hscacheutils.generational_cache import build_generation_cache_key, gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.setting_wrappers import _set_setting
+
+
+calls = []
+
+
+@gen_cache.wrap('generation_values_test')
+def get_value(value_id):
+    calls.append(value_id)
+    return 'value %s' % value_id
+
+
+def test_clock_values():
+    clock = HybridLogicalClock(host_id=5)
+    values = [clock.new_value() for i in range(100)]
+    eq_(values, sorted(set(values)))
+
+    described = describe(values[-1])
+    eq_(HLC, described['scheme'])
+    eq_(5, described['host_id'])
+    eq_(0, described['bumps'])
+    ok_(abs(described['timestamp'] - time()) < 5)
+
+    # Increments only touch the bumps
+    eq_(3, describe(values[-1] + 3)['bumps'])
+
+    # Other hosts minting at the same moment get other values
+    other = HybridLogicalClock(host_id=6)
+    other.physical, other.logical = clock.physical, clock.logical
+    clock.physical = other.physical = clock.physical + 1000
+    ok_(clock.new_value() != other.new_value())
+
+    # Never behind the values it read, nor the legacy ones
+    ahead = HybridLogicalClock(host_id=7)
+    ahead.physical = clock.physical + 60000
+    read = ahead.new_value()
+    clock.observe([read, 123])
+    ok_(clock.new_value() > read)
+    ok_(clock.new_value() > MicrosecondValues().new_value())
+
+    legacy = describe(int(time() * 1000000))
+    eq_(MICROSECONDS, legacy['scheme'])
+    ok_(abs(legacy['timestamp'] - time()) < 5)
+
+
+def test_compact_keys():
+    eq_('0', base36(0))
+    eq_('zz', base36(36 * 36 - 1))
+    eq_(int(base36(123456789012345), 36), 123456789012345)
+    ok_(len(base36(HybridLogicalClock().new_value())) <= 12)
+
+    backend = LocalLRUCache()
+    previous_backend = raw_cache.set_backend(backend)
+    previous = generation_values.set_scheme(MicrosecondValues())
+    del calls[:]
+    try:
+        # An existing microsecond generation
+        legacy_value = int(time() * 1000000)
+        backend.set(build_generation_cache_key('generation_values_test'), legacy_value)
+        get_value(1)
+        decimal_key = get_value.func_helper.build_wrapped_cache_key_with_generations((1,), {})
+        ok_(str(legacy_value) in decimal_key)
+
+        # Switching to clock values keeps the keys
+        generation_values.set_scheme(HybridLogicalClock())
+        get_value(1)
+        eq_([1], calls)
+
+        # Compact keys change them once
+        generation_values.set_scheme(HybridLogicalClock(compact=True))
+        compact_key = get_value.func_helper.build_wrapped_cache_key_with_generations((1,), {})
+        ok_(base36(legacy_value) in compact_key)
+        get_value(1)
+        get_value(1)
+        eq_([1, 1], calls)
+
+        # New generations get clock values, invalidation still increments them
+        backend.clear()
+        get_value(1)
+        value = backend.get(build_generation_cache_key('generation_values_test'))
+        eq_(HLC, describe(value)['scheme'])
+        gen_cache.invalidate('generation_values_test')
+        eq_(value + 1, backend.get(build_generation_cache_key('generation_values_test')))
+        get_value(1)
+        eq_([1, 1, 1, 1], calls)
+    finally:
+        generation_values.set_scheme(previous)
+        raw_cache.set_backend(previous_backend)
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def test_host_id_setting():
+    handler = RecordingHandler()
+    logging.getLogger().addHandler(handler)
+    previous = generation_values.set_scheme(None)
+    _set_setting('GEN_CACHE_GENERATION_VALUES', HLC)
+    try:
+        # A derived host id is best effort, so it warns
+        ok_(isinstance(generation_values.current_scheme(), HybridLogicalClock))
+        eq_(1, len([message for message in handler.messages if 'GEN_CACHE_HOST_ID' in message]))
+
+        del handler.messages[:]
+        generation_values.set_scheme(None)
+        _set_setting('GEN_CACHE_HOST_ID', 12)
+        eq_(12, generation_values.current_scheme().host_id)
+        eq_([], handler.messages)
+    finally:
+        _set_setting('GEN_CACHE_GENERATION_VALUES', MICROSECONDS)
+        _set_setting('GEN_CACHE_HOST_ID', None)
+        generation_values.set_scheme(previous)
+        logging.getLogger().removeHandler(handler)
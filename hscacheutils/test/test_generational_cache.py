@@ -1,4 +1,4 @@
-from time import time
+from time import sleep, time
 import random
 
 from nose.tools import ok_, eq_
@@ -456,3 +456,207 @@ def test_custom_gen_cache():
     
     
 
+
+def test_wrap_batch():
+    calls = []
+
+    @gen_cache.wrap_batch("batchtest", "batchtest_portal:portal_id", "batchtest_contact:contact_id", batch_arg='contact_ids', timeout=60)
+    def get_contacts(portal_id, contact_ids, flavor='vanilla'):
+        calls.append(list(contact_ids))
+        return dict((contact_id, (contact_id, flavor, time() + random.randint(0, 10000000))) for contact_id in contact_ids if contact_id != 404)
+
+    first_result = get_contacts(1, [1, 2, 3])
+    eq_([[1, 2, 3]], calls)
+    eq_([1, 2, 3], sorted(first_result.keys()))
+
+    second_result = get_contacts(1, [2, 3, 4, 404])
+    eq_([4, 404], calls[-1])
+    eq_(first_result[2], second_result[2])
+    eq_(first_result[3], second_result[3])
+    ok_(404 not in second_result)
+
+    eq_(first_result[1], get_contacts(1, contact_ids=[1])[1])
+    ok_(get_contacts(2, [1])[1] != first_result[1])
+    ok_(get_contacts(1, [1], flavor='mint')[1] != first_result[1])
+
+    gen_cache.invalidate('batchtest_contact:contact_id', contact_id=2)
+    third_result = get_contacts(1, [1, 2, 3])
+    eq_([2], calls[-1])
+    ok_(third_result[2] != first_result[2])
+    eq_(first_result[1], third_result[1])
+
+    get_contacts.invalidate(1, [3])
+    eq_(first_result[1], get_contacts(1, [1, 3])[1])
+    eq_([3], calls[-1])
+
+
+def test_wrap_batch_list_results():
+    @gen_cache.wrap_batch("batchtest", batch_arg='ids', element_arg='some_id', result_key=lambda item: item['id'], timeout=60)
+    def get_things(ids):
+        return [{'id': some_id, 'at': time() + random.randint(0, 10000000)} for some_id in ids]
+
+    first_result = get_things((5, 6))
+    eq_([5, 6], [item['id'] for item in first_result])
+    eq_(first_result, get_things((5, 6)))
+    eq_(first_result[::-1], get_things([6, 5, 6]))
+
+def test_debounced_invalidation():
+    from hscacheutils import metrics
+
+    calls = []
+
+    @gen_cache.wrap("debounced:portal_id", timeout=60)
+    def func(portal_id):
+        calls.append(portal_id)
+        return time() + random.randint(0, 10000000)
+
+    gen_cache.debounce_invalidations('debounced:portal_id', 0.05)
+    try:
+        absorbed = metrics.get('invalidation_debounce.absorbed')
+        first_result = func(1)
+
+        # The first invalidation goes through right away
+        gen_cache.invalidate('debounced:portal_id', portal_id=1)
+        second_result = func(1)
+        ok_(first_result != second_result)
+
+        # The next ones are coalesced
+        for i in range(10):
+            eq_(None, gen_cache.invalidate('debounced:portal_id', portal_id=1))
+        eq_(second_result, func(1))
+        eq_(absorbed + 10, metrics.get('invalidation_debounce.absorbed'))
+
+        # Other portals aren't affected
+        func(2)
+        gen_cache.invalidate('debounced:portal_id', portal_id=2)
+        func(2)
+        eq_(2, len([c for c in calls if c == 2]))
+
+        # And the trailing invalidation happens after the interval
+        sleep(0.1)
+        ok_(func(1) != second_result)
+
+        gen_cache.invalidate('debounced:portal_id', portal_id=1)
+        gen_cache.invalidate('debounced:portal_id', portal_id=1)
+        third_result = func(1)
+        gen_cache.debouncer.flush()
+        ok_(func(1) != third_result)
+    finally:
+        gen_cache.debounce_invalidations('debounced:portal_id', None)
+
+def test_separate_generation_backend():
+    from hscacheutils import metrics, raw_cache
+    from hscacheutils.local_cache import LocalLRUCache
+    from hscacheutils.generational_cache import build_generation_cache_key_full, multi_generation_values
+
+    generation_backend = LocalLRUCache()
+    previous = raw_cache.set_generation_backend(generation_backend)
+    try:
+        key = build_generation_cache_key_full('separate_gen:separate_id', separate_id=1)
+        value = multi_generation_values('separate_gen:separate_id', separate_id=1).values()[0]
+        eq_(value, generation_backend.get(key))
+        eq_(None, raw_cache.get_backend().get(key))
+
+        gen_cache.invalidate('separate_gen:separate_id', separate_id=1)
+        eq_(value + 1, generation_backend.get(key))
+
+        # An evicted generation is counted (and gets a new value)
+        evicted = metrics.get('generations.evicted')
+        generation_backend.delete(key)
+        ok_(multi_generation_values('separate_gen:separate_id', separate_id=1).values()[0] != value + 1)
+        eq_(evicted + 1, metrics.get('generations.evicted'))
+
+        # Even if another process created it
+        other_key = build_generation_cache_key_full('separate_gen:separate_id', separate_id=2)
+        generation_backend.set(other_key, 1234)
+        eq_([1234], multi_generation_values('separate_gen:separate_id', separate_id=2).values())
+        generation_backend.delete(other_key)
+        multi_generation_values('separate_gen:separate_id', separate_id=2)
+        eq_(evicted + 2, metrics.get('generations.evicted'))
+    finally:
+        raw_cache.set_generation_backend(previous)
+
+
+def test_concurrent_generation_initialization():
+    from hscacheutils import raw_cache
+    from hscacheutils.local_cache import LocalLRUCache
+    from hscacheutils.generational_cache import build_generation_cache_key_full, multi_generation_values
+
+    class RacingCache(LocalLRUCache):
+        # Somebody else initializes the generation between our get_many and our add
+        def add(self, key, value, timeout=None):
+            super(RacingCache, self).add(key, 'their_value', timeout)
+            return super(RacingCache, self).add(key, value, timeout)
+
+    previous = raw_cache.set_generation_backend(RacingCache())
+    try:
+        eq_({'racing_gen': 'their_value'}, multi_generation_values('racing_gen'))
+    finally:
+        raw_cache.set_generation_backend(previous)
+
+def test_namespaced_keys():
+    from hscacheutils.generational_cache import GenCacheNamespaceCollision
+
+    def make_func(namespace, version=None):
+        @gen_cache.wrap("namespaced", namespace=namespace, version=version, timeout=60)
+        def namespaced_func(a):
+            return time() + random.randint(0, 10000000)
+        return namespaced_func
+
+    first_func = make_func('tests.namespaced_func')
+    first_result = first_func(1)
+
+    # Same namespace, but defined somewhere else (ie. after a deploy moved it around)
+    second_func = make_func('tests.namespaced_func')
+    eq_(first_result, second_func(1))
+    ok_('[cached]tests.namespaced_func(' in second_func.func_helper.full_key)
+
+    # Only bumping the version invalidates it
+    third_func = make_func('tests.namespaced_func', version=2)
+    ok_(first_result != third_func(1))
+    ok_('[cached]tests.namespaced_func:v2(' in third_func.func_helper.full_key)
+
+    try:
+        @gen_cache.wrap("namespaced", namespace='tests.namespaced_func')
+        def some_other_func(a):
+            pass
+        ok_(False)
+    except GenCacheNamespaceCollision, e:
+        ok_('some_other_func' in e.message)
+
+
+def test_get_many_variants():
+    from hscacheutils import raw_cache
+    from hscacheutils.local_cache import LocalLRUCache
+
+    class CountingCache(LocalLRUCache):
+        get_manys = 0
+
+        def get_many(self, keys):
+            self.get_manys += 1
+            return super(CountingCache, self).get_many(keys)
+
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+    fragments_cache = CustomUseGenCache(['fragments', 'fragments_portal:portal_id'])
+    try:
+        gen_cache.set('header 53', 'fragments', 'fragments_portal:portal_id', portal_id=53, add_to_key='header')
+        fragments_cache.set_many([('footer', 'footer 53'), ({'cache_key': 'nav', 'portal_id': 54}, 'nav 54')],
+                                 portal_id=53)
+
+        # One fetch for the generations, one for the values
+        backend.get_manys = 0
+        eq_(['header 53', 'footer 53', None, 'nav 54'],
+            gen_cache.get_many(['fragments', 'fragments_portal:portal_id'],
+                               ['header', 'footer', 'nav', {'add_to_key': 'nav', 'portal_id': 54}], portal_id=53))
+        eq_(2, backend.get_manys)
+
+        eq_(['footer 53', 'header 53'], fragments_cache.get_many(['footer', 'header'], portal_id=53))
+        eq_([fragments_cache.get(portal_id=53, cache_key='footer')],
+            fragments_cache.get_many([{'cache_key': 'footer'}], portal_id=53))
+        eq_([], fragments_cache.get_many([], portal_id=53))
+
+        fragments_cache.invalidate(portal_id=53)
+        eq_([None, 'nav 54'], fragments_cache.get_many(['footer', {'cache_key': 'nav', 'portal_id': 54}], portal_id=53))
+    finally:
+        raw_cache.set_backend(previous)
@@ -0,0 +1,164 @@
+import cPickle as pickle
+import sys
+
+from collections import namedtuple
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import immutable, metrics, raw_cache
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.immutable import FrozenDict, FrozenList, ImmutableValueError, freeze, thaw
+from hscacheutils.local_cache import LocalLRUCache, deep_sizeof
+from hscacheutils.prefetch import Prefetcher
+
+
+Point = namedtuple('Point', 'x y')
+
+calls = []
+
+
+@gen_cache.wrap('immutable_test', immutable=True)
+def get_navigation(portal_id):
+    calls.append(portal_id)
+    return {'portal_id': portal_id, 'items': ['home', 'contacts'], 'tags': set(['a'])}
+
+
+class Opaque(object):
+    pass
+
+
+@gen_cache.wrap('immutable_test', immutable=True)
+def get_opaque(portal_id):
+    calls.append(portal_id)
+    return Opaque()
+
+
+class CountingCache(LocalLRUCache):
+
+    def __init__(self):
+        super(CountingCache, self).__init__()
+        self.gotten = []
+
+    def get(self, key, default=None):
+        self.gotten.append(key)
+        return super(CountingCache, self).get(key, default)
+
+
+def test_freeze():
+    value = freeze({'a': [1, {'b': [2]}], 'c': (set([3]), bytearray('xy')), 'p': Point([1], 2)})
+    ok_(isinstance(value, FrozenDict))
+    ok_(isinstance(value['a'], FrozenList))
+    ok_(isinstance(value['a'][1]['b'], FrozenList))
+    eq_((frozenset([3]), 'xy'), value['c'])
+    ok_(isinstance(value['p'], Point))
+    eq_([1], value['p'].x)
+    ok_(freeze(value) is value)
+
+    # Still equal to (and serializable as) the original
+    eq_({'a': [1, {'b': [2]}], 'c': (frozenset([3]), 'xy'), 'p': Point([1], 2)}, value)
+    copy = pickle.loads(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    eq_(value, copy)
+    ok_(isinstance(copy['a'], FrozenList))
+
+    mutable = thaw(value)
+    mutable['a'].append(4)
+    mutable['d'] = 5
+    mutable['c'][0].add(6)
+    eq_(set([3, 6]), mutable['c'][0])
+    eq_([1, {'b': [2]}, 4], mutable['a'])
+    eq_([1, {'b': [2]}], value['a'])
+
+    for mutate in (lambda: value.update(d=1), lambda: value.pop('a'), lambda: value['a'].sort(),
+                   lambda: value['a'].__setitem__(0, 2), lambda: value['a'][1].setdefault('c', 1)):
+        try:
+            mutate()
+        except ImmutableValueError:
+            pass
+        else:
+            ok_(False, "mutated a frozen value")
+
+
+def test_byte_accounting():
+    x = 'x' * 1000
+    eq_(sys.getsizeof([x, x]) + sys.getsizeof(x), deep_sizeof([x, x]))
+    ok_(deep_sizeof({'a': 'x' * 1000}) > 1000)
+
+    cache = LocalLRUCache(max_items=None, max_bytes=3000)
+    cache.set('a', 'a' * 1000)
+    cache.set('b', 'b' * 1000)
+    eq_(2, len(cache))
+    ok_(2000 < cache.bytes < 3000)
+    cache.get('a')
+    cache.set('c', 'c' * 1000)
+    eq_(None, cache.get('b'))
+    ok_(cache.get('a') and cache.get('c'))
+    ok_(cache.bytes <= 3000)
+
+    # Too big on its own
+    cache.set('d', 'd' * 5000)
+    eq_(None, cache.get('d'))
+    eq_(2, len(cache))
+
+    cache.delete('a')
+    cache.delete('c')
+    eq_(0, cache.bytes)
+
+
+def test_shared_values():
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+    immutable.local_tier().clear()
+    del calls[:]
+    try:
+        first = get_navigation(1)
+        ok_(isinstance(first, FrozenDict))
+        key = get_navigation.func_helper.build_wrapped_cache_key_with_generations((1,), {})
+        ok_(type(backend.get(key)) is dict)
+
+        del backend.gotten[:]
+        second = get_navigation(1)
+        ok_(second is first)
+        ok_(key not in backend.gotten)  # only the generation is fetched
+        eq_([1], calls)
+
+        try:
+            second['items'].append('x')
+        except ImmutableValueError:
+            pass
+        else:
+            ok_(False, "mutated a shared value")
+        eq_(['home', 'contacts'], get_navigation(1)['items'])
+
+        # Filled from memcache in other processes
+        immutable.local_tier().clear()
+        third = get_navigation(1)
+        eq_([1], calls)
+        ok_(isinstance(third['items'], FrozenList))
+        ok_(get_navigation(1) is third)
+
+        gen_cache.invalidate('immutable_test')
+        get_navigation(1)
+        eq_([1, 1], calls)
+
+        get_navigation.invalidate(1)
+        get_navigation(1)
+        eq_([1, 1, 1], calls)
+
+        # Prefetched calls are served from the local tier too
+        prefetched = Prefetcher().call(get_navigation, 1)
+        ok_(prefetched.get() is get_navigation(1))
+
+        # Values that can't be frozen aren't shared
+        unfreezable = metrics.get('immutable.unfreezable')
+        get_opaque(2)
+        get_opaque(2)
+        eq_([1, 1, 1, 2], calls)
+        eq_(None, immutable.local_tier().get(get_opaque.func_helper.build_wrapped_cache_key_with_generations((2,), {})))
+        eq_(unfreezable + 2, metrics.get('immutable.unfreezable'))
+    finally:
+        immutable.local_tier().clear()
+        raw_cache.set_backend(previous)
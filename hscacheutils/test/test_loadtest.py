@@ -0,0 +1,44 @@
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import loadtest
+from hscacheutils.loadtest import LoadTestConfig, ZipfSampler
+
+
+def test_zipf_sampler():
+    sampler = ZipfSampler(100, 1.2, random.Random(1))
+    samples = [sampler.sample() for i in range(10000)]
+    ok_(all(0 <= sample < 100 for sample in samples))
+    # Skewed towards the first ones
+    ok_(samples.count(0) > samples.count(1) > samples.count(50))
+
+
+def test_load_test_threads():
+    report = loadtest.run_load_test(LoadTestConfig(workers=4, requests=400, portals=20, items=50, compute_time=0,
+                                          invalidation_rate=0.05, seed=1))
+    eq_(400, report.requests)
+    eq_(2000, report.calls)
+    ok_(0.5 < report.hit_ratio < 1)
+    ok_(report.invalidations > 0)
+    # At least the generations and the value of each call
+    ok_(report.backend_ops_per_request >= 2 * 5)
+    ok_(0 < report.p50 <= report.p99)
+    ok_('hit ratio' in str(report))
+
+
+def test_load_test_processes_against_the_emulator():
+    report = loadtest.run_load_test(LoadTestConfig(workers=2, use_processes=True, requests=100, portals=10, items=20,
+                                          compute_time=0, backend='emulator', seed=1))
+    eq_(100, report.requests)
+    ok_(report.hit_ratio > 0.3)
+    ok_(report.backend_ops > 0)
+
+
+def test_main():
+    eq_(0, loadtest.main(['--workers', '2', '--requests', '20', '--items', '10', '--compute-time', '0',
+                 '--value-sizes', '10:1,100:1']))
@@ -0,0 +1,96 @@
+from time import time
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.memcache_emulator import MemcacheEmulator, emulated_raw_cache
+from hscacheutils.raw_cache import ClientPool, MemcacheClientCache, cache as raw_cache
+
+
+def test_emulator_protocol():
+    with MemcacheEmulator() as emulator:
+        client = ClientPool.get(emulator.servers)
+
+        ok_(client.set('foo', 'bar'))
+        eq_('bar', client.get('foo'))
+        ok_(not client.add('foo', 'baz'))
+        ok_(client.add('foo2', {'a': [1, 2]}))
+        eq_({'foo': 'bar', 'foo2': {'a': [1, 2]}}, client.get_multi(['foo', 'foo2', 'nope']))
+
+        client.set('counter', 5)
+        eq_(6, client.incr('counter'))
+        eq_(4, client.decr('counter', 2))
+        eq_(None, client.incr('not_a_counter'))
+
+        ok_(client.delete('foo'))
+        eq_(None, client.get('foo'))
+
+        stats = emulator.stats()
+        ok_(stats['get_hits'] >= 3)
+        ok_(stats['get_misses'] >= 2)
+
+
+def test_emulator_cas():
+    with MemcacheEmulator() as emulator:
+        client = MemcacheClientCache(emulator.servers)._client
+        client.set('casme', 1)
+        eq_(1, client.gets('casme'))
+        ok_(client.cas('casme', 2))
+
+        # Somebody else changed it in between
+        eq_(2, client.gets('casme'))
+        ClientPool.get(emulator.servers).set('casme', 3)
+        ok_(not client.cas('casme', 4))
+
+
+def test_emulator_limits():
+    with MemcacheEmulator(item_size_limit=100, memory_limit=1000) as emulator:
+        client = ClientPool.get(emulator.servers)
+        ok_(not client.set('too_big', 'x' * 200))
+        eq_(None, client.get('too_big'))
+
+        for i in range(20):
+            client.set('item%s' % i, 'y' * 90)
+
+        stats = emulator.stats()
+        ok_(stats['evictions'] > 0)
+        ok_(stats['bytes'] <= 1000)
+        eq_(None, client.get('item0'))
+        eq_('y' * 90, client.get('item19'))
+
+
+def test_emulator_latency_and_drops():
+    with MemcacheEmulator(latency={'get': 0.02}, jitter=0.01) as emulator:
+        client = MemcacheClientCache(emulator.servers)
+        client.set('slow', 1)
+        start = time()
+        eq_(1, client.get('slow'))
+        ok_(time() - start >= 0.02)
+
+    with MemcacheEmulator(drop_rate=1.0) as emulator:
+        client = MemcacheClientCache(emulator.servers)
+        eq_(None, client.get('dropped'))
+        ok_(emulator.stats()['dropped'] >= 1)
+
+
+def test_emulated_raw_cache():
+    previous = raw_cache._backend
+
+    with emulated_raw_cache() as emulator:
+        @gen_cache.wrap("emulated", "emulated:portal_id", timeout=60)
+        def emulated_func(portal_id):
+            return time() + random.randint(0, 10000000)
+
+        first_result = emulated_func(1)
+        eq_(first_result, emulated_func(1))
+
+        gen_cache.invalidate('emulated:portal_id', portal_id=1)
+        ok_(first_result != emulated_func(1))
+        ok_(emulator.stats()['curr_items'] > 0)
+
+    ok_(raw_cache._backend is previous)
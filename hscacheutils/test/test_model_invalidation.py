@@ -0,0 +1,241 @@
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from django.db import models
+from django.db.models import signals
+
+from hscacheutils.generational_cache import multi_generation_values
+from hscacheutils.model_invalidation import ModelInvalidationRegistry
+
+
+class InvalidationContact(models.Model):
+    portal_id = models.IntegerField()
+    name = models.CharField(max_length=100)
+    email = models.CharField(max_length=100)
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        app_label = 'hscacheutils_test'
+
+
+class InvalidationList(models.Model):
+    contacts = models.ManyToManyField(InvalidationContact, related_name='lists')
+
+    class Meta:
+        app_label = 'hscacheutils_test'
+
+
+class RecordingInvalidator(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def invalidate_many(self, invalidations):
+        self.calls.append(invalidations)
+
+
+def _registry():
+    invalidator = RecordingInvalidator()
+    registry = ModelInvalidationRegistry(invalidator)
+    registry.register(InvalidationContact, 'model_test_contact:contact_id', contact_id='id', fields=['name', 'email'])
+    registry.register(InvalidationContact, 'model_test_portal:portal_id')
+    registry.register(InvalidationContact, 'model_test_scores', fields=['score'])
+    registry.register(InvalidationList, 'model_test_list:list_id', list_id='id', fields=['contacts'])
+    return registry, invalidator
+
+
+def _save(instance, created=False):
+    signals.post_save.send(sender=type(instance), instance=instance, created=created)
+
+
+def test_saves_and_deletes():
+    registry, invalidator = _registry()
+
+    contact = InvalidationContact(id=1, portal_id=53, name='a', email='a@example.com')
+    _save(contact, created=True)
+    eq_([[('model_test_contact:contact_id', {'contact_id': 1}), ('model_test_portal:portal_id', {'portal_id': 53}),
+          ('model_test_scores', {})]], invalidator.calls)
+
+    # Only the generations watching the changed fields
+    del invalidator.calls[:]
+    contact.score = 10
+    _save(contact)
+    eq_([[('model_test_portal:portal_id', {'portal_id': 53}), ('model_test_scores', {})]], invalidator.calls)
+
+    del invalidator.calls[:]
+    contact.email = 'b@example.com'
+    _save(contact)
+    eq_([[('model_test_contact:contact_id', {'contact_id': 1}), ('model_test_portal:portal_id', {'portal_id': 53})]],
+        invalidator.calls)
+
+    # Moving to another portal invalidates both
+    del invalidator.calls[:]
+    contact.portal_id = 54
+    _save(contact)
+    eq_([[('model_test_portal:portal_id', {'portal_id': 53}), ('model_test_portal:portal_id', {'portal_id': 54})]],
+        invalidator.calls)
+
+    del invalidator.calls[:]
+    signals.post_delete.send(sender=InvalidationContact, instance=contact)
+    eq_(1, len(invalidator.calls))
+    eq_(3, len(invalidator.calls[0]))
+
+
+def test_m2m():
+    registry, invalidator = _registry()
+    contact = InvalidationContact(id=1, portal_id=53, name='a', email='a@example.com')
+    contact_list = InvalidationList(id=7)
+
+    signals.m2m_changed.send(sender=InvalidationList.contacts.through, instance=contact_list, action='pre_add',
+                             reverse=False, model=InvalidationContact, pk_set=set([1]))
+    eq_([], invalidator.calls)
+    signals.m2m_changed.send(sender=InvalidationList.contacts.through, instance=contact_list, action='post_add',
+                             reverse=False, model=InvalidationContact, pk_set=set([1]))
+    eq_([[('model_test_list:list_id', {'list_id': 7})]], invalidator.calls)
+
+
+def test_batches():
+    registry, invalidator = _registry()
+
+    with registry.batch():
+        for i in range(5):
+            contact = InvalidationContact(id=i, portal_id=53, name='a', email='a@example.com')
+            _save(contact, created=True)
+        with registry.batch():
+            contact.name = 'b'
+            _save(contact)
+        eq_([], invalidator.calls)
+
+    # One bump of each generation, in one call
+    eq_(1, len(invalidator.calls))
+    eq_(5 + 1 + 1, len(invalidator.calls[0]))
+
+
+def test_invalidates_generations():
+    registry = ModelInvalidationRegistry()
+    registry.register(InvalidationContact, 'model_gen_test_portal:portal_id', fields=['name'])
+
+    contact = InvalidationContact(id=1, portal_id=53, name='a', email='a@example.com')
+    before = multi_generation_values('model_gen_test_portal:portal_id', portal_id=53)
+
+    contact.email = 'b@example.com'
+    _save(contact)
+    eq_(before, multi_generation_values('model_gen_test_portal:portal_id', portal_id=53))
+
+    contact.name = 'b'
+    _save(contact)
+    ok_(before != multi_generation_values('model_gen_test_portal:portal_id', portal_id=53))
+
+
+class FakeRows(object):
+    """
+    Stands in for the queryset and manager of InvalidationContact (there's no database in the tests).
+    """
+
+    def __init__(self, rows):
+        self.model = InvalidationContact
+        self.rows = rows
+
+    def __iter__(self):
+        return iter([InvalidationContact(**row) for row in self.rows.values()])
+
+    def update(self, **values):
+        for row in self.rows.values():
+            row.update(values)
+        return len(self.rows)
+
+    def in_bulk(self, pks):
+        return dict((pk, InvalidationContact(**self.rows[pk])) for pk in pks if pk in self.rows)
+
+
+def test_update_moves():
+    invalidator = RecordingInvalidator()
+    registry = ModelInvalidationRegistry(invalidator)
+    registry.register(InvalidationContact, 'model_test_portal:portal_id', fields=['name'])
+
+    rows = FakeRows({1: dict(id=1, portal_id=53, name='a', email='a@example.com')})
+    manager = InvalidationContact._default_manager
+    InvalidationContact._default_manager = rows
+    try:
+        # Only the email changes, not watched
+        registry.update(rows, email='b@example.com')
+        eq_([], invalidator.calls)
+
+        # The rows move portals, even though portal_id isn't a watched field
+        eq_(1, registry.update(rows, portal_id=54))
+        eq_([[('model_test_portal:portal_id', {'portal_id': 53}), ('model_test_portal:portal_id', {'portal_id': 54})]],
+            invalidator.calls)
+    finally:
+        InvalidationContact._default_manager = manager
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.in_atomic_block = False
+        self.run_on_commit = []
+
+
+class FakeTransaction(object):
+    """
+    transaction.on_commit, as in Django 1.9+.
+    """
+
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    def get_connection(self, using=None):
+        return self.connection
+
+    def on_commit(self, func, using=None):
+        if self.connection.in_atomic_block:
+            self.connection.run_on_commit.append((set(), func))
+        else:
+            func()
+
+    def commit(self):
+        callbacks, self.connection.run_on_commit = self.connection.run_on_commit, []
+        self.connection.in_atomic_block = False
+        for sids, func in callbacks:
+            func()
+
+    def rollback(self):
+        self.connection.run_on_commit = []
+        self.connection.in_atomic_block = False
+
+
+def test_bumps_after_commit():
+    from hscacheutils import model_invalidation
+
+    registry, invalidator = _registry()
+    fake_transaction = FakeTransaction()
+    original, model_invalidation.transaction = model_invalidation.transaction, fake_transaction
+    try:
+        contact = InvalidationContact(id=1, portal_id=53, name='a', email='a@example.com')
+        fake_transaction.connection.in_atomic_block = True
+        _save(contact, created=True)
+        contact.score = 10
+        _save(contact)
+        eq_([], invalidator.calls)
+
+        # All of the transaction's bumps, in one call, once it commits
+        fake_transaction.commit()
+        eq_(1, len(invalidator.calls))
+        eq_(3, len(invalidator.calls[0]))
+
+        # Nothing on rollbacks, and the next transaction starts afresh
+        del invalidator.calls[:]
+        fake_transaction.connection.in_atomic_block = True
+        _save(contact)
+        fake_transaction.rollback()
+        fake_transaction.connection.in_atomic_block = True
+        contact.name = 'b'
+        _save(contact)
+        fake_transaction.commit()
+        eq_([[('model_test_contact:contact_id', {'contact_id': 1}), ('model_test_portal:portal_id', {'portal_id': 53})]],
+            invalidator.calls)
+    finally:
+        model_invalidation.transaction = original
@@ -0,0 +1,191 @@
+import cPickle as pickle
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import metrics, raw_cache
+from hscacheutils.fake_redis import FakeRedis
+from hscacheutils.generational_cache import CustomUseGenCache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.memcache_emulator import MemcacheEmulator
+from hscacheutils.packed_cache import _PythonMemcachedCas
+from hscacheutils.raw_cache import MemcacheClientCache
+from hscacheutils.redis_cache import RedisCache
+
+
+def _check_gets_and_cas(cache):
+    eq_((None, None), cache.gets('cas_key'))
+    ok_(cache.cas('cas_key', 1, None))
+    ok_(not cache.cas('cas_key', 2, None))
+
+    value, token = cache.gets('cas_key')
+    eq_(1, value)
+    cache.set('cas_key', 3)
+    ok_(not cache.cas('cas_key', 4, token))
+    eq_(3, cache.get('cas_key'))
+
+    value, token = cache.gets('cas_key')
+    ok_(cache.cas('cas_key', 5, token))
+    eq_(5, cache.get('cas_key'))
+
+
+def test_gets_and_cas():
+    _check_gets_and_cas(LocalLRUCache())
+    _check_gets_and_cas(RedisCache(client=FakeRedis()))
+    with MemcacheEmulator() as emulator:
+        _check_gets_and_cas(MemcacheClientCache(emulator.servers))
+
+
+def _check_packed(packed_cache):
+    eq_(None, packed_cache.get(packed_portal_id=1, cache_key='flag'))
+
+    for i in range(50):
+        packed_cache.set(i, packed_portal_id=1, cache_key='count%s' % i)
+    packed_cache.set(True, packed_portal_id=1, cache_key='flag')
+    packed_cache.set('x' * 5000, packed_portal_id=1, cache_key='big')
+
+    eq_(True, packed_cache.get(packed_portal_id=1, cache_key='flag'))
+    eq_('x' * 5000, packed_cache.get(packed_portal_id=1, cache_key='big'))
+    eq_(range(50), [packed_cache.get(packed_portal_id=1, cache_key='count%s' % i) for i in range(50)])
+    eq_(None, packed_cache.get(packed_portal_id=2, cache_key='flag'))
+
+    packed_cache.delete(packed_portal_id=1, cache_key='flag')
+    eq_(None, packed_cache.get(packed_portal_id=1, cache_key='flag'))
+    eq_(3, packed_cache.get(packed_portal_id=1, cache_key='count3'))
+
+    packed_cache.invalidate(packed_portal_id=1)
+    eq_(None, packed_cache.get(packed_portal_id=1, cache_key='count3'))
+
+
+def test_packed_custom_cache():
+    packed_cache = CustomUseGenCache(['packed_test', 'packed_test_portal:packed_portal_id'], packed=True, packed_buckets=4)
+
+    # Default backend (no gets/cas)
+    _check_packed(packed_cache)
+
+    backend = LocalLRUCache()
+    previous = raw_cache.set_backend(backend)
+    try:
+        _check_packed(packed_cache)
+
+        # 50 small values in 4 buckets (plus the 2 generations)
+        backend.clear()
+        for i in range(50):
+            packed_cache.set(i, packed_portal_id=1, cache_key='count%s' % i)
+        eq_(4 + 2, len(backend))
+    finally:
+        raw_cache.set_backend(previous)
+
+    with MemcacheEmulator() as emulator:
+        previous = raw_cache.set_backend(MemcacheClientCache(emulator.servers))
+        try:
+            _check_packed(packed_cache)
+        finally:
+            raw_cache.set_backend(previous)
+
+    # Django's memcached cache, with gets/cas through its python-memcached client
+    with MemcacheEmulator() as emulator:
+        backend = raw_cache.build_memcached_cache(emulator.servers)
+        previous = raw_cache.set_backend(backend)
+        try:
+            _check_gets_and_cas(_PythonMemcachedCas(backend))
+            _check_packed(packed_cache)
+        finally:
+            raw_cache.set_backend(previous)
+
+
+def test_packed_cas_conflicts():
+    class ContendedCache(LocalLRUCache):
+        # Somebody else writes the bucket between our gets and our cas, conflicts times
+        conflicts = 0
+
+        def cas(self, key, value, token, timeout=None):
+            if self.conflicts:
+                self.conflicts -= 1
+                current = dict(self.get(key) or {})
+                current['theirs'] = 1
+                self.set(key, current)
+            return super(ContendedCache, self).cas(key, value, token, timeout)
+
+    backend = ContendedCache()
+    previous = raw_cache.set_backend(backend)
+    packed_cache = CustomUseGenCache(['packed_conflict_test'], packed=True, packed_buckets=1)
+    try:
+        retries = metrics.get('packed.cas_retries')
+        backend.conflicts = 2
+        packed_cache.set('mine', cache_key='mine')
+        eq_(retries + 2, metrics.get('packed.cas_retries'))
+
+        # Both writes survived the merge
+        eq_('mine', packed_cache.get(cache_key='mine'))
+        eq_(1, packed_cache.get(cache_key='theirs'))
+
+        # Giving up drops the bucket
+        backend.conflicts = 10
+        packed_cache.set('again', cache_key='again')
+        eq_(None, packed_cache.get(cache_key='mine'))
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_packed_get_many():
+    class CountingCache(LocalLRUCache):
+        get_manys = 0
+
+        def get_many(self, keys):
+            self.get_manys += 1
+            return super(CountingCache, self).get_many(keys)
+
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+    packed_cache = CustomUseGenCache(['packed_many_test', 'packed_many_test_portal:packed_portal_id'], packed=True,
+                                     packed_buckets=4)
+    try:
+        for i in range(10):
+            packed_cache.set(i, packed_portal_id=1, cache_key='count%s' % i)
+        packed_cache.set('x' * 5000, packed_portal_id=1, cache_key='big')
+
+        backend.get_manys = 0
+        eq_(range(10) + [None], packed_cache.get_many(['count%s' % i for i in range(10)] + ['nope'], packed_portal_id=1))
+        eq_(2, backend.get_manys)
+
+        eq_(['x' * 5000, 3], packed_cache.get_many(['big', {'cache_key': 'count3'}], packed_portal_id=1))
+    finally:
+        raw_cache.set_backend(previous)
+
+def test_bucket_size_limit():
+    backend = LocalLRUCache()
+    previous = raw_cache.set_backend(backend)
+    packed_cache = CustomUseGenCache(['packed_size_test'], packed=True, packed_buckets=1)
+    packed_cache.packed.max_bucket_size = 10000
+    try:
+        overflows = metrics.get('packed.bucket_overflows')
+        for i in range(100):
+            packed_cache.set('x' * 400, cache_key='item%s' % i)
+
+        # The latest writes are kept, the bucket stays under the limit
+        ok_(metrics.get('packed.bucket_overflows') > overflows)
+        eq_('x' * 400, packed_cache.get(cache_key='item99'))
+        bucket_keys = [key for key in backend._items if key.endswith(':packed0')]
+        eq_(1, len(bucket_keys))
+        ok_(len(pickle.dumps(backend.get(bucket_keys[0]), pickle.HIGHEST_PROTOCOL)) <= 10000)
+    finally:
+        raw_cache.set_backend(previous)
+
+def test_backend_errors_in_gets():
+    class BrokenCache(LocalLRUCache):
+        def gets(self, key):
+            raise AttributeError("a bug in the backend")
+
+    previous = raw_cache.set_backend(BrokenCache())
+    packed_cache = CustomUseGenCache(['packed_broken_test'], packed=True)
+    try:
+        packed_cache.set(1, cache_key='a')
+        ok_(False, "swallowed an error raised by the backend")
+    except AttributeError:
+        pass
+    finally:
+        raw_cache.set_backend(previous)
@@ -0,0 +1,150 @@
+import cPickle as pickle
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import metrics, raw_cache
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.paging import PagedList, page_key
+
+
+calls = []
+
+
+@gen_cache.wrap('paging_test', page_size=100)
+def get_ids(count):
+    calls.append(count)
+    return range(count)
+
+
+lengths = {}
+
+
+@gen_cache.wrap('paging_test', page_size=100)
+def get_tuple(count):
+    calls.append(count)
+    return tuple(range(lengths.get(count, count)))
+
+
+class CountingCache(LocalLRUCache):
+    get_manys = 0
+
+    def get_many(self, keys):
+        self.get_manys += 1
+        return super(CountingCache, self).get_many(keys)
+
+
+def test_paged_values():
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+    del calls[:]
+    try:
+        eq_(range(1050), get_ids(1050))
+
+        ids = get_ids(1050)
+        ok_(isinstance(ids, PagedList))
+        eq_(1050, len(ids))
+        eq_([1050], calls)
+
+        # Only the pages read are fetched
+        fetches = metrics.get('paging.page_fetches')
+        eq_(range(20), ids[:20])
+        eq_(150, ids[150])
+        eq_(1049, ids[-1])
+        eq_(range(95, 105), ids[95:105])
+        eq_(fetches + 3, metrics.get('paging.page_fetches'))
+
+        # Iterating fetches a few pages at a time (after the generations)
+        backend.get_manys = 0
+        eq_(range(1050), list(get_ids(1050)))
+        eq_(1 + 3, backend.get_manys)
+        eq_(get_ids(1050), range(1050))
+
+        # Short lists are stored as usual
+        eq_(range(10), get_ids(10))
+        eq_(list, type(get_ids(10)))
+
+        # Missing pages recompute the value
+        del calls[:]
+        ids = get_ids(1050)
+        backend.delete(page_key(ids.key, 5))
+        eq_(500, ids[500])
+        eq_([1050], calls)
+        eq_(500, get_ids(1050)[500])
+        eq_([1050], calls)
+
+        gen_cache.invalidate('paging_test')
+        eq_(range(1050), get_ids(1050))
+        eq_([1050, 1050], calls)
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_same_type_on_hits_and_misses():
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+    try:
+        missed = get_ids(250)
+        hit = get_ids(250)
+        ok_(isinstance(missed, PagedList))
+        ok_(isinstance(hit, PagedList))
+        eq_(range(250) + [1], hit + [1])
+        eq_([1] + range(250), [1] + hit)
+        ok_(249 in hit)
+        eq_(3, hit.index(3))
+
+        # Tuples stay tuples
+        eq_(tuple(range(250)) + (1,), get_tuple(250) + (1,))
+        eq_(tuple(range(10, 20)), get_tuple(250)[10:20])
+
+        # Pickled (eg. in the value of another wrapped function) as the plain list
+        eq_(range(250), pickle.loads(pickle.dumps(hit, pickle.HIGHEST_PROTOCOL)))
+        eq_(list, type(pickle.loads(pickle.dumps(hit, pickle.HIGHEST_PROTOCOL))))
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_recomputed_length():
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+    try:
+        get_tuple(300)
+        stored = get_tuple(300)
+        backend.delete(page_key(stored.key, 1))
+
+        # The recomputed value is shorter than the stored one
+        lengths[300] = 150
+        ids = get_tuple(300)
+        eq_(0, ids[0])
+        eq_(tuple(range(150)), tuple(ids))
+        eq_(150, len(ids))
+        eq_(tuple(range(140, 150)), ids[140:160])
+    finally:
+        lengths.clear()
+        raw_cache.set_backend(previous)
+
+
+class NoneForMissesCache(LocalLRUCache):
+    def get_many(self, keys):
+        values = super(NoneForMissesCache, self).get_many(keys)
+        return dict((key, values.get(key)) for key in keys)
+
+
+def test_pages_missing_as_none():
+    backend = NoneForMissesCache()
+    previous = raw_cache.set_backend(backend)
+    del calls[:]
+    try:
+        get_ids(350)
+        ids = get_ids(350)
+        backend.delete(page_key(ids.key, 2))
+
+        # A page that comes back as None recomputes the value
+        eq_(range(200, 250), ids[200:250])
+        eq_([350, 350], calls)
+    finally:
+        raw_cache.set_backend(previous)
@@ -0,0 +1,107 @@
+from time import time
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import raw_cache
+from hscacheutils.generational_cache import gen_cache, CustomUseGenCache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.prefetch import Prefetcher
+
+
+class CountingCache(LocalLRUCache):
+
+    def __init__(self, *args, **kwargs):
+        super(CountingCache, self).__init__(*args, **kwargs)
+        self.calls = []
+
+    def get(self, key, default=None):
+        self.calls.append('get')
+        return super(CountingCache, self).get(key, default)
+
+    def get_many(self, keys):
+        self.calls.append('get_many')
+        return super(CountingCache, self).get_many(keys)
+
+
+def test_prefetch():
+    backend = CountingCache()
+    previous = raw_cache.set_backend(backend)
+
+    try:
+        computed = []
+
+        @gen_cache.wrap("prefetch_test", "prefetch_contact:contact_id", timeout=60)
+        def get_contact(contact_id):
+            computed.append(contact_id)
+            return time() + random.randint(0, 10000000)
+
+        @gen_cache.wrap("prefetch_test", "prefetch_portal:portal_id", timeout=60)
+        def get_portal(portal_id):
+            return 'portal %s' % portal_id
+
+        nav_cache = CustomUseGenCache(["prefetch_test", "prefetch_nav:user_id"])
+        nav_cache.set('<nav>', user_id=1, cache_key='top')
+
+        first_contact = get_contact(1)
+        del backend.calls[:]
+        del computed[:]
+
+        prefetcher = Prefetcher()
+        contact = prefetcher.call(get_contact, 1)
+        other_contact = prefetcher.call(get_contact, contact_id=2)
+        portal = prefetcher.call(get_portal, 53)
+        nav = prefetcher.get(nav_cache, user_id=1, cache_key='top')
+        missing = prefetcher.get(gen_cache, 'prefetch_test', add_to_key='missing')
+
+        eq_([], backend.calls)
+        eq_(first_contact, contact.get())
+
+        # One get_many for the generations, one for the values
+        eq_(['get_many', 'get_many'], backend.calls)
+        eq_('portal 53', portal.get())
+        eq_('<nav>', nav.get())
+        eq_(None, missing.get())
+
+        # Misses are computed when consumed, and cached
+        eq_([], computed)
+        other_value = other_contact.get()
+        eq_([2], computed)
+        eq_(other_value, get_contact(2))
+        eq_(other_value, prefetcher.call(get_contact, 2).get())
+        eq_([2], computed)
+
+        gen_cache.invalidate('prefetch_contact:contact_id', contact_id=1)
+        ok_(first_contact != prefetcher.call(get_contact, 1).get())
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_prefetch_custom_use_gen_cache_registry():
+    previous = raw_cache.set_backend(CountingCache())
+    try:
+        flags_cache = CustomUseGenCache(["prefetch_flags:user_id"])
+        entry = flags_cache.registry_entry
+        flags_cache.set('on', user_id=1, cache_key='beta')
+
+        # Hits and misses are counted on the registry entry
+        hits, misses = entry.hits, entry.misses
+        prefetcher = Prefetcher()
+        flag = prefetcher.get(flags_cache, user_id=1, cache_key='beta')
+        other_flag = prefetcher.get(flags_cache, user_id=2, cache_key='beta')
+        eq_('on', flag.get())
+        eq_(None, other_flag.get())
+        eq_((hits + 1, misses + 1), (entry.hits, entry.misses))
+
+        # And bypassing it skips the cache, as CustomUseGenCache.get does
+        entry.override(bypass=True)
+        try:
+            eq_(None, prefetcher.get(flags_cache, user_id=1, cache_key='beta').get())
+        finally:
+            entry.clear_overrides()
+    finally:
+        raw_cache.set_backend(previous)
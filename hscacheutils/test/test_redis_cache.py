@@ -0,0 +1,169 @@
+from time import time
+import os
+import random
+
+from nose.plugins.skip import SkipTest
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import raw_cache
+from hscacheutils.fake_redis import FakeRedis
+from hscacheutils.generational_cache import gen_cache, build_generation_cache_key_full, multi_generation_values
+from hscacheutils.prefetch import Prefetcher
+from hscacheutils.redis_cache import RedisCache
+
+
+def test_redis_cache():
+    cache = RedisCache(client=FakeRedis())
+
+    eq_(None, cache.get('nope'))
+    eq_('default', cache.get('nope', 'default'))
+
+    cache.set('foo', {'a': [1, 2, 3]})
+    eq_({'a': [1, 2, 3]}, cache.get('foo'))
+
+    ok_(not cache.add('foo', 'other'))
+    ok_(cache.add('bar', 1))
+    eq_(3, cache.incr('bar', 2))
+    eq_(2, cache.decr('bar'))
+    eq_({'foo': {'a': [1, 2, 3]}, 'bar': 2}, cache.get_many(['foo', 'bar', 'baz']))
+
+    try:
+        cache.incr('nope')
+        ok_(False)
+    except ValueError:
+        pass
+    eq_(None, cache.get('nope'))
+
+    cache.set_many({'a': 'x', 'b': True, 'c': 5L})
+    eq_({'a': 'x', 'b': True, 'c': 5}, cache.get_many(['a', 'b', 'c']))
+
+    cache.delete_many(['a', 'b'])
+    cache.delete('foo')
+    eq_({'c': 5}, cache.get_many(['a', 'b', 'c', 'foo']))
+
+    cache.set('expires', 1, timeout=1)
+    cache._client._expires_at['expires'] = time() - 1
+    eq_(None, cache.get('expires'))
+
+    cache.clear()
+    eq_(None, cache.get('c'))
+
+
+def test_pipelined_incr_many():
+    client = FakeRedis()
+    cache = RedisCache(client=client)
+    cache.set_many({'a': 1, 'b': 2, 'c': 'not a number'})
+
+    before = client.commands
+    eq_({'a': 2, 'b': 3, 'nope': None}, cache.incr_many(['a', 'b', 'nope']))
+    eq_(1, client.commands - before)
+    eq_(None, cache.get('nope'))
+
+
+def test_gen_cache_on_redis():
+    client = FakeRedis()
+    previous = raw_cache.set_backend(RedisCache(client=client))
+
+    try:
+        @gen_cache.wrap("redis_test", "redis_test_portal:redis_portal_id", timeout=60)
+        def func(redis_portal_id, other=1):
+            return time() + random.randint(0, 10000000)
+
+        # Generations are initialized server side, in the same round trip as the value fetch
+        before = client.commands
+        first_result = func(1)
+        eq_(2, client.commands - before)   # the fetch and the set
+        ok_(client.get(build_generation_cache_key_full('redis_test_portal:redis_portal_id', redis_portal_id=1)))
+
+        before = client.commands
+        eq_(first_result, func(1))
+        eq_(1, client.commands - before)
+        ok_(first_result != func(1, other=2))
+
+        # The two step key building agrees with the server side one
+        eq_(first_result, Prefetcher().call(func, 1).get())
+
+        gen_cache.invalidate('redis_test_portal:redis_portal_id', redis_portal_id=1)
+        second_result = func(1)
+        ok_(first_result != second_result)
+
+        # Pipelined invalidations, including missing generations
+        values = multi_generation_values('redis_test', 'redis_test_portal:redis_portal_id', redis_portal_id=1)
+        before = client.commands
+        new_values = gen_cache.invalidate_many(['redis_test', ('redis_test_portal:redis_portal_id', {'redis_portal_id': 1}),
+                                                ('redis_test_portal:redis_portal_id', {'redis_portal_id': 99})])
+        eq_(values['redis_test'] + 1, new_values[0])
+        eq_(values['redis_portal_id:1'] + 1, new_values[1])
+        ok_(new_values[2])
+        eq_(2, client.commands - before)   # the pipeline, and the add of the missing generation
+        ok_(second_result != func(1))
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_without_resolving_generations():
+    client = FakeRedis()
+    previous = raw_cache.set_backend(RedisCache(client=client, resolve_generations=False))
+
+    try:
+        @gen_cache.wrap("redis_test", timeout=60)
+        def func():
+            return time() + random.randint(0, 10000000)
+
+        first_result = func()
+        before = client.commands
+        eq_(first_result, func())
+        eq_(2, client.commands - before)   # the generations, then the value
+        eq_(first_result, Prefetcher().call(func).get())
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_scripts_on_a_server():
+    # The lua scripts themselves (the other tests run their python emulations)
+    url = os.environ.get('REDIS_TEST_URL')
+    if not url:
+        raise SkipTest("Set REDIS_TEST_URL to run the scripts against a redis server")
+
+    cache = RedisCache(url=url)
+    cache.clear()
+    previous = raw_cache.set_backend(cache)
+    try:
+        cache.set('counter', 1)
+        eq_(3, cache.incr('counter', 2))
+        try:
+            cache.incr('nope')
+            ok_(False)
+        except ValueError:
+            pass
+
+        value, token = cache.gets('cas_key')
+        ok_(cache.cas('cas_key', 1, token))
+        ok_(not cache.cas('cas_key', 2, token))
+        eq_(1, cache.get('cas_key'))
+
+        @gen_cache.wrap("redis_server_test", timeout=60)
+        def func():
+            return time() + random.randint(0, 10000000)
+
+        first_result = func()
+        eq_(first_result, func())
+        gen_cache.invalidate('redis_server_test')
+        ok_(first_result != func())
+    finally:
+        raw_cache.set_backend(previous)
+        cache.clear()
+
+
+def test_invalidate_many_without_incr_many():
+    @gen_cache.wrap("invalidate_many_test", timeout=60)
+    def func():
+        return time() + random.randint(0, 10000000)
+
+    first_result = func()
+    gen_cache.invalidate_many(['invalidate_many_test'])
+    ok_(first_result != func())
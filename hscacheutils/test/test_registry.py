@@ -0,0 +1,200 @@
+from time import time
+
+from nose.tools import ok_, eq_, raises
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import raw_cache, registry
+from hscacheutils.generational_cache import CustomUseGenCache, gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.prefetch import Prefetcher
+from hscacheutils.registry import DuplicateCacheEntry, UnknownCacheEntry
+
+
+calls = []
+
+
+@gen_cache.wrap('registry_test', timeout=300, namespace='registry_test.get_value')
+def get_value(value_id):
+    calls.append(value_id)
+    return 'value %s' % value_id
+
+
+@gen_cache.wrap_batch('registry_test', batch_arg='value_ids', namespace='registry_test.get_values')
+def get_values(value_ids):
+    calls.extend(value_ids)
+    return dict((value_id, 'value %s' % value_id) for value_id in value_ids)
+
+
+class Contacts(object):
+
+    @gen_cache.wrap('registry_test', timeout=60)
+    def get(self, contact_id):
+        return 'contact %s' % contact_id
+
+
+class Companies(object):
+
+    @gen_cache.wrap('registry_test_companies', timeout=120)
+    def get(self, company_id):
+        return 'company %s' % company_id
+
+
+def test_inventory():
+    custom_cache = CustomUseGenCache(['registry_test', 'registry_test_portal:portal_id'], timeout=60)
+    named_cache = CustomUseGenCache(['registry_test'], name='registry_test.named')
+
+    description = registry.describe()
+    eq_('wrap', description['registry_test.get_value']['kind'])
+    eq_(['registry_test'], description['registry_test.get_value']['generations'])
+    eq_(300, description['registry_test.get_value']['timeout'])
+    eq_('wrap_batch', description['registry_test.get_values']['kind'])
+    eq_(60, description['custom:registry_test,registry_test_portal:portal_id:60']['timeout'])
+    ok_('registry_test.named' in description)
+    ok_(get_value.registry_entry is registry.get('registry_test.get_value'))
+
+    entry = custom_cache.registry_entry
+    hits, misses = entry.hits, entry.misses
+    custom_cache.get(portal_id=1, cache_key='nope')
+    custom_cache.set('yes', portal_id=1, cache_key='yes')
+    custom_cache.get(portal_id=1, cache_key='yes')
+    eq_((hits + 1, misses + 1), (entry.hits, entry.misses))
+    named_cache.get()
+
+
+@raises(UnknownCacheEntry)
+def test_unknown():
+    registry.override('registry_test.nope', bypass=True)
+
+
+def test_overrides():
+    backend = LocalLRUCache()
+    previous = raw_cache.set_backend(backend)
+    del calls[:]
+    try:
+        get_value(1)
+        get_value(1)
+        get_values([1, 2])
+        get_values([1, 2])
+        eq_([1, 1, 2], calls)
+        entry = registry.get('registry_test.get_value')
+        ok_(entry.hits >= 1)
+
+        del calls[:]
+        registry.override('registry_test.get_value', bypass=True)
+        get_value(1)
+        get_values([1, 2])
+        eq_([1], calls)
+        registry.override('registry_test.get_values', bypass=True)
+        get_values([1, 2])
+        eq_([1, 1, 2], calls)
+        eq_({'bypass': True}, entry.overrides)
+
+        registry.clear_overrides()
+        get_value(1)
+        eq_(3, len(calls))
+
+        # Sampling
+        registry.override('registry_test.get_value', sample_rate=0.0)
+        get_value(1)
+        eq_(4, len(calls))
+        registry.clear_overrides('registry_test.get_value')
+
+        # Timeouts
+        registry.override('registry_test.get_value', timeout=1234)
+        get_value(2)
+        key = get_value.func_helper.build_wrapped_cache_key_with_generations((2,), {})
+        value, expires_at = backend._items[key]
+        ok_(1200 < expires_at - time() <= 1234)
+        registry.clear_overrides()
+
+        # Local tier
+        registry.override('registry_test.get_value', tier='local')
+        get_value(3)
+        eq_('value 3', entry.local_tier.get(get_value.func_helper.build_wrapped_cache_key_with_generations((3,), {})))
+        get_value.invalidate(3)
+        get_value(3)
+        eq_(7, len(calls))
+        registry.clear_overrides()
+        ok_(not entry.overridden)
+    finally:
+        registry.clear_overrides()
+        raw_cache.set_backend(previous)
+
+
+def test_publish_and_sync():
+    previous = raw_cache.set_backend(LocalLRUCache())
+    try:
+        registry.override('registry_test.get_value', timeout=42)
+        registry.publish_overrides()
+        registry.clear_overrides()
+        eq_({}, registry.get('registry_test.get_value').overrides)
+
+        middleware = registry.RegistrySyncMiddleware()
+        middleware.process_request(None)
+        eq_({'timeout': 42}, registry.get('registry_test.get_value').overrides)
+
+        # Not again until the interval passed
+        registry.clear_overrides()
+        middleware.process_request(None)
+        eq_({}, registry.get('registry_test.get_value').overrides)
+    finally:
+        registry.clear_overrides()
+        raw_cache.set_backend(previous)
+
+
+def test_unique_names():
+    # Same-named methods of different classes get their own entries
+    ok_(Contacts.get.registry_entry is not Companies.get.registry_entry)
+    eq_(['registry_test'], Contacts.get.registry_entry.generations)
+    eq_(120, Companies.get.registry_entry.timeout)
+
+    # Caches with the same generations but different timeouts too
+    ok_(CustomUseGenCache(['registry_test'], timeout=10).registry_entry is not
+        CustomUseGenCache(['registry_test'], timeout=20).registry_entry)
+    ok_(CustomUseGenCache(['registry_test'], timeout=10).registry_entry is
+        CustomUseGenCache(['registry_test'], timeout=10).registry_entry)
+
+
+@raises(DuplicateCacheEntry)
+def test_duplicate_names():
+    CustomUseGenCache(['registry_test'], name='registry_test.duplicate', timeout=10)
+    CustomUseGenCache(['registry_test'], name='registry_test.duplicate', timeout=20)
+
+
+def test_overrides_everywhere():
+    backend = LocalLRUCache()
+    previous = raw_cache.set_backend(backend)
+    custom_cache = CustomUseGenCache(['registry_test'], name='registry_test.sampled')
+    try:
+        # Sampled sets are skipped like sampled gets
+        registry.override('registry_test.sampled', sample_rate=0.0)
+        custom_cache.set('x', cache_key='a')
+        custom_cache.set_many([('b', 'y')])
+        registry.clear_overrides()
+        eq_([None, None], custom_cache.get_many(['a', 'b']))
+
+        # Prefetched calls count in the stats and use the overridden timeout
+        entry = registry.get('registry_test.get_value')
+        hits, misses = entry.hits, entry.misses
+        registry.override('registry_test.get_value', timeout=1234)
+        prefetcher = Prefetcher()
+        eq_('value 10', prefetcher.call(get_value, 10).get())
+        eq_(misses + 1, entry.misses)
+        key = get_value.func_helper.build_wrapped_cache_key_with_generations((10,), {})
+        ok_(1200 < backend._items[key][1] - time() <= 1234)
+        registry.clear_overrides()
+
+        eq_('value 10', Prefetcher().call(get_value, 10).get())
+        eq_(hits + 1, entry.hits)
+
+        # And bypasses
+        del calls[:]
+        registry.override('registry_test.get_value', bypass=True)
+        Prefetcher().call(get_value, 10).get()
+        eq_([10], calls)
+    finally:
+        registry.clear_overrides()
+        raw_cache.set_backend(previous)
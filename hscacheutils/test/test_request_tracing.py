@@ -0,0 +1,80 @@
+from time import time
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import request_tracing
+from hscacheutils.generational_cache import gen_cache, CustomUseGenCache
+from hscacheutils.request_tracing import CacheTracingProblem, traced_request
+
+
+@gen_cache.wrap("tracing_test", "tracing_test_contact:tracing_contact_id", timeout=60)
+def get_contact(tracing_contact_id):
+    return time() + random.randint(0, 10000000)
+
+
+def test_request_tracing():
+    previous_hook = request_tracing.set_hook(lambda summary: None)
+    custom_cache = CustomUseGenCache(['tracing_test'])
+
+    try:
+        get_contact(1)
+
+        with traced_request('/contact', size_sample_rate=1) as tracer:
+            get_contact(1)
+            custom_cache.set('value', cache_key='a')
+            eq_('value', custom_cache.get(cache_key='a'))
+
+        summary = tracer.summary
+        eq_(['get_many', 'get', 'get_many', 'set', 'get_many', 'get'], [round_trip.op for round_trip in summary.round_trips])
+        ok_(summary.bytes > 0)
+        ok_(all('test_request_tracing.py' in round_trip.call_site for round_trip in summary.round_trips))
+        eq_([], summary.batchable_call_sites)
+        ok_('~' not in str(summary))
+
+        # The generations of 'tracing_test' were fetched three times
+        eq_([('get_many', ('_gen_tracing_test',), 2)], summary.repeated_lookups)
+
+        # N+1
+        with traced_request('/contacts') as tracer:
+            for contact_id in range(10):
+                get_contact(contact_id)
+
+        eq_(1, len(tracer.summary.batchable_call_sites))
+        call_site, round_trips = tracer.summary.batchable_call_sites[0]
+        ok_('test_request_tracing.py' in call_site)
+        ok_(round_trips >= 20)
+        ok_('batch them' in str(tracer.summary))
+
+        # Only a sample of the round trips are sized
+        with traced_request('/unsized', size_sample_rate=0) as tracer:
+            get_contact(1)
+        ok_(all(round_trip.bytes is None for round_trip in tracer.summary.round_trips))
+        eq_(0, tracer.summary.bytes)
+        ok_('~0 bytes' in str(tracer.summary))
+
+        # Nothing is recorded outside of a traced request
+        ok_(request_tracing.current_tracer() is None)
+    finally:
+        request_tracing.set_hook(previous_hook)
+
+
+def test_raise_on_problems():
+    previous_hook = request_tracing.set_hook(request_tracing.raise_on_problems)
+    try:
+        with traced_request('/fine'):
+            get_contact(1)
+
+        try:
+            with traced_request('/n_plus_one'):
+                for contact_id in range(10):
+                    get_contact(contact_id)
+            ok_(False)
+        except CacheTracingProblem:
+            pass
+    finally:
+        request_tracing.set_hook(previous_hook)
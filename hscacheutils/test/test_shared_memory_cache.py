@@ -0,0 +1,189 @@
+from time import sleep, time
+import os
+import random
+import tempfile
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import raw_cache
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.shared_memory_cache import SLOT_SEQUENCE, SharedMemoryCache, _key_hash
+from hscacheutils.tiered_cache import TieredCache
+
+
+def _new_cache(**options):
+    path = tempfile.mktemp(prefix='hscacheutils-shm-test-')
+    return SharedMemoryCache(path, **options)
+
+
+def test_shared_memory_cache():
+    cache = _new_cache()
+    try:
+        eq_(None, cache.get('nope'))
+        cache.set('foo', {'a': [1, 2, 3]})
+        eq_({'a': [1, 2, 3]}, cache.get('foo'))
+
+        # Moves to a bigger slab class and back
+        cache.set('foo', 'x' * 2000)
+        eq_('x' * 2000, cache.get('foo'))
+        cache.set('foo', 'small')
+        eq_('small', cache.get('foo'))
+
+        ok_(not cache.add('foo', 'other'))
+        ok_(cache.add('bar', 1))
+        eq_(3, cache.incr('bar', 2))
+        eq_({'foo': 'small', 'bar': 3}, cache.get_many(['foo', 'bar', 'baz']))
+
+        cache.delete('foo')
+        eq_(None, cache.get('foo'))
+
+        try:
+            cache.incr('nope')
+            ok_(False)
+        except ValueError:
+            pass
+
+        # Too large for any slab class
+        ok_(not cache.set('huge', 'x' * 10000))
+        eq_(None, cache.get('huge'))
+
+        cache.set('expires', 1, timeout=0.01)
+        sleep(0.02)
+        eq_(None, cache.get('expires'))
+
+        cache.clear()
+        eq_(None, cache.get('bar'))
+    finally:
+        cache.close()
+        os.unlink(cache.path)
+
+
+class _WrittenWhileRead(bytearray):
+    """
+    Stands in for the mmap, calling on_read before every slice a reader takes (the lock free
+    reads only slice the key and the value).
+    """
+
+    def __init__(self, data, on_read):
+        super(_WrittenWhileRead, self).__init__(data)
+        self.on_read = on_read
+        self.reads = 0
+
+    def __getitem__(self, index):
+        self.reads += 1
+        self.on_read(self)
+        return str(bytearray.__getitem__(self, index))
+
+
+def test_readers_retry():
+    cache = _new_cache()
+    mmap = cache._mmap
+    try:
+        cache.set('foo', 'foo value')
+        offset, data = cache._find('foo', _key_hash('foo'))
+
+        # Being written
+        sequence = SLOT_SEQUENCE.unpack_from(mmap, offset)[0]
+        SLOT_SEQUENCE.pack_into(mmap, offset, sequence + 1)
+        eq_(None, cache.get('foo'))
+        SLOT_SEQUENCE.pack_into(mmap, offset, sequence)
+        eq_('foo value', cache.get('foo'))
+
+        # Rewritten with the same item while read
+        def rewrite(buf):
+            if buf.reads == 1:
+                SLOT_SEQUENCE.pack_into(buf, offset, SLOT_SEQUENCE.unpack_from(buf, offset)[0] + 2)
+        cache._mmap = _WrittenWhileRead(mmap, rewrite)
+        eq_('foo value', cache.get('foo'))
+        eq_(4, cache._mmap.reads)
+
+        # Replaced by another item while read
+        def replace(buf):
+            if buf.reads == 1:
+                cache._write_slot(offset, _key_hash('other'), 0, 'other', 'another value, a longer one')
+        cache._mmap = _WrittenWhileRead(mmap, replace)
+        eq_(None, cache.get('foo'))
+    finally:
+        cache._mmap = mmap
+        cache.close()
+        os.unlink(cache.path)
+
+
+def test_shared_memory_cache_eviction():
+    cache = _new_cache(slabs=((128, 8),), bucket_size=2, stripes=1)
+    try:
+        for i in range(100):
+            cache.set('key%s' % i, i)
+
+        found = cache.get_many(['key%s' % i for i in range(100)])
+        ok_(0 < len(found) <= 8)
+        eq_(99, cache.get('key99'))
+    finally:
+        cache.close()
+        os.unlink(cache.path)
+
+
+def test_shared_across_processes():
+    cache = _new_cache()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            # A separately opened cache in another process
+            child_cache = SharedMemoryCache(cache.path)
+            child_cache.set('from_child', 'hello')
+            os._exit(0)
+
+        os.waitpid(pid, 0)
+        eq_('hello', cache.get('from_child'))
+    finally:
+        cache.close()
+        os.unlink(cache.path)
+
+
+def test_tiered_cache():
+    backend = LocalLRUCache()
+    local = LocalLRUCache()
+    tiered = TieredCache(local, backend, local_timeout=60)
+
+    tiered.set('a', 1)
+    eq_(1, local.get('a'))
+    eq_(1, backend.get('a'))
+
+    backend.set('b', 2)
+    eq_({'a': 1, 'b': 2}, tiered.get_many(['a', 'b', 'c']))
+    eq_(2, local.get('b'))
+
+    backend.set('b', 3)
+    eq_(2, tiered.get('b'))   # stale for up to local_timeout
+
+    eq_(4, tiered.incr('b'))
+    eq_(4, local.get('b'))
+
+    tiered.delete('a')
+    eq_(None, local.get('a'))
+    eq_(None, backend.get('a'))
+
+
+def test_gen_cache_with_shared_memory_tier():
+    shm_cache = _new_cache()
+    previous = raw_cache.set_backend(TieredCache(shm_cache, raw_cache.get_backend()))
+
+    try:
+        @gen_cache.wrap("shm_test", "shm_test:portal_id", timeout=60)
+        def func(portal_id):
+            return time() + random.randint(0, 10000000)
+
+        first_result = func(1)
+        eq_(first_result, func(1))
+
+        gen_cache.invalidate('shm_test:portal_id', portal_id=1)
+        ok_(first_result != func(1))
+    finally:
+        raw_cache.set_backend(previous)
+        shm_cache.close()
+        os.unlink(shm_cache.path)
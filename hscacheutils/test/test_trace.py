@@ -0,0 +1,122 @@
+from time import sleep
+import os
+import tempfile
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import trace
+from hscacheutils.generational_cache import gen_cache
+from hscacheutils.simulator import SimulationPolicy, simulate, simulate_file, TINYLFU
+from hscacheutils.trace import TraceRecord, GET_HIT, GET_MISS, SET
+
+
+def test_trace_recording():
+    path = tempfile.mktemp(prefix='hscacheutils-trace-test-')
+    trace.start_tracing(path, sample_rate=1.0)
+
+    try:
+        @gen_cache.wrap("trace_test", "trace_test:trace_id", timeout=60)
+        def func(trace_id):
+            sleep(0.001)
+            return [trace_id] * 10
+
+        func(1)
+        func(1)
+        func(2)
+        gen_cache.invalidate('trace_test:trace_id', trace_id=1)
+        func(1)
+        trace.stop_tracing()
+
+        ops = [record.op for record in trace.read_trace(path)]
+        eq_([GET_MISS, GET_HIT, GET_MISS, trace.INVALIDATE, GET_MISS], ops)
+
+        first_miss = trace.read_trace(path).next()
+        ok_(first_miss.value_size > 0)
+        ok_(first_miss.compute_time >= 0.001)
+
+        reports = simulate_file(path, [SimulationPolicy('unbounded'), SimulationPolicy('local', local_size=10)])
+        eq_(4, reports[0].requests)
+        eq_(1, reports[0].hits)
+        eq_(3, reports[0].computes)
+    finally:
+        trace.stop_tracing()
+        os.unlink(path)
+
+
+def test_trace_sampling():
+    path = tempfile.mktemp(prefix='hscacheutils-trace-test-')
+    recorder = trace.TraceRecorder(path, sample_rate=0.1)
+    try:
+        keys = ['key%s' % i for i in range(1000)]
+        sampled = [key for key in keys if recorder.sampled_hash(key) is not None]
+        ok_(50 < len(sampled) < 150)
+
+        for key in keys:
+            recorder.record(SET, key, size=10)
+        recorder.close()
+
+        eq_(len(sampled), len(list(trace.read_trace(path))))
+    finally:
+        os.unlink(path)
+
+
+def test_sampled_across_invalidations():
+    path = tempfile.mktemp(prefix='hscacheutils-trace-test-')
+    trace.start_tracing(path, sample_rate=0.3)
+
+    try:
+        @gen_cache.wrap("trace_sampling_test", timeout=60)
+        def func(trace_id):
+            return trace_id
+
+        # The same calls are sampled after every bump
+        recorded = []
+        for bump in range(5):
+            gen_cache.invalidate('trace_sampling_test')
+            trace.recorder.flush()
+            before = list(trace.read_trace(path))
+            for trace_id in range(100):
+                func(trace_id)
+                gen_cache.set(trace_id, 'trace_sampling_test', add_to_key=trace_id)
+            trace.recorder.flush()
+            recorded.append(sorted(record.op for record in list(trace.read_trace(path))[len(before):]))
+
+        ok_(10 < recorded[0].count(GET_MISS) < 60)
+        ok_(10 < recorded[0].count(SET) < 60)
+        eq_([recorded[0]] * 5, recorded)
+    finally:
+        trace.stop_tracing()
+        os.unlink(path)
+
+
+def _records(*accesses):
+    return [TraceRecord(float(i), op, key_hash, 100, 0.01) for i, (op, key_hash) in enumerate(accesses)]
+
+
+def test_simulator_policies():
+    # One hot key read between scans of cold keys
+    accesses = []
+    for round in range(20):
+        accesses.append((GET_MISS if round == 0 else GET_HIT, 0))
+        for cold in range(10):
+            accesses.append((GET_MISS, 1000 + round * 10 + cold))
+
+    lru, tinylfu, ttl, small_backend = simulate(_records(*accesses), [
+        SimulationPolicy('lru', local_size=5),
+        SimulationPolicy('tinylfu', local_size=5, local_policy=TINYLFU),
+        SimulationPolicy('ttl', ttl=5),
+        SimulationPolicy('small backend', backend_size=500)])
+
+    # The scans flush the hot key out of a local LRU, not out of TinyLFU
+    eq_(0, lru.local_hits)
+    ok_(tinylfu.local_hits > 10)
+    ok_(tinylfu.backend_ops < lru.backend_ops)
+
+    eq_(19, lru.hits)
+    eq_(0, ttl.hits)
+    eq_(0, small_backend.hits)
+    ok_(abs(lru.saved_compute_time - 0.19) < 1e-6)
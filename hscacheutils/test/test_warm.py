@@ -0,0 +1,180 @@
+from StringIO import StringIO
+from time import time
+import random
+
+from nose.tools import ok_, eq_
+
+from django.conf import settings
+if not settings.configured:
+    settings.configure()
+
+from hscacheutils import raw_cache
+from hscacheutils.affinity import AffineCache
+from hscacheutils.generational_cache import gen_cache, CustomUseGenCache
+from hscacheutils.local_cache import LocalLRUCache
+from hscacheutils.paging import PagedList
+from hscacheutils.warm import warm, read_arg_sets, parse_arg_set
+
+
+calls = []
+
+@gen_cache.wrap("warm_test", "warm_test_portal:portal_id", timeout=60)
+def func_to_warm(portal_id, thing_id, flavor='vanilla'):
+    calls.append((portal_id, thing_id, flavor))
+    return time() + random.randint(0, 10000000)
+
+
+def test_warm_wrapped_function():
+    gen_cache.invalidate('warm_test')
+    del calls[:]
+
+    report = warm(func_to_warm, [[1, 2], [1, 3], {'portal_id': 2, 'thing_id': 2}, {'args': [1, 2], 'kwargs': {'flavor': 'mint'}}])
+    eq_(4, report.total)
+    eq_(4, report.computed)
+    eq_(0, report.already_cached)
+    eq_(4, len(calls))
+
+    # Everything is already cached, so calling the function doesn't compute anything
+    func_to_warm(1, 2)
+    func_to_warm(portal_id=2, thing_id=2)
+    func_to_warm(1, 2, flavor='mint')
+    eq_(4, len(calls))
+
+    # And warming again skips whatever is already there
+    report = warm(func_to_warm, [[1, 2], [1, 4]], batch_size=1)
+    eq_(1, report.already_cached)
+    eq_(1, report.computed)
+    eq_(5, len(calls))
+
+
+@gen_cache.wrap("warm_test_inner:warm_thing_id", timeout=60)
+def get_inner(warm_thing_id):
+    calls.append(('inner', warm_thing_id))
+    return 'inner %s' % warm_thing_id
+
+
+@gen_cache.wrap("warm_test", timeout=60, track_dependencies=True)
+def get_outer(warm_thing_id):
+    calls.append(('outer', warm_thing_id))
+    return [get_inner(warm_thing_id)]
+
+
+@gen_cache.wrap("warm_test", timeout=60, page_size=10)
+def get_paged(count):
+    calls.append(('paged', count))
+    return range(count)
+
+
+def test_warm_stores_like_misses():
+    previous = raw_cache.set_backend(LocalLRUCache())
+    del calls[:]
+    try:
+        warm(get_outer, [[1]])
+        warm(get_paged, [[25]])
+        eq_([('outer', 1), ('inner', 1), ('paged', 25)], calls)
+
+        # Dependencies are tracked for warmed values
+        eq_(['inner 1'], get_outer(1))
+        eq_(3, len(calls))
+        gen_cache.invalidate('warm_test_inner:warm_thing_id', warm_thing_id=1)
+        eq_(['inner 1'], get_outer(1))
+        eq_([('outer', 1), ('inner', 1)], calls[3:])
+
+        # Paged values are stored as pages
+        paged = get_paged(25)
+        ok_(isinstance(paged, PagedList))
+        eq_(range(25), list(paged))
+        eq_(5, len(calls))
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_warm_reports_failures():
+    @gen_cache.wrap("warm_test", timeout=60)
+    def sometimes_fails(thing_id):
+        if thing_id == 2:
+            raise ValueError("nope")
+        return thing_id
+
+    gen_cache.invalidate('warm_test')
+    progress = []
+    report = warm(sometimes_fails, [[1], [2], [3]], progress=progress.append)
+    eq_(2, report.computed)
+    eq_(1, report.failed)
+    ok_(progress)
+
+
+def test_warm_custom_use_gen_cache():
+    custom_cache = CustomUseGenCache(['warm_custom', 'warm_custom:portal_id'])
+    gen_cache.invalidate('warm_custom')
+
+    report = warm(custom_cache, [{'portal_id': 5, 'cache_key': 'a'}, {'portal_id': 5, 'cache_key': 'b'}],
+                  compute=lambda portal_id, cache_key: '%s-%s' % (portal_id, cache_key))
+    eq_(2, report.computed)
+    eq_('5-a', custom_cache.get(portal_id=5, cache_key='a'))
+    eq_('5-b', custom_cache.get(portal_id=5, cache_key='b'))
+
+
+class NoCasCache(LocalLRUCache):
+    """
+    A backend without gets/cas.
+    """
+
+    def __getattribute__(self, name):
+        if name in ('gets', 'cas'):
+            raise AttributeError(name)
+        return super(NoCasCache, self).__getattribute__(name)
+
+
+def test_warm_packed_custom_use_gen_cache():
+    packed_cache = CustomUseGenCache(['warm_packed', 'warm_packed:portal_id'], packed=True, packed_buckets=2)
+    compute = lambda portal_id, cache_key: cache_key * 1000 if cache_key == 'big' else '%s-%s' % (portal_id, cache_key)
+    cache_keys = ['a', 'b', 'c', 'big']
+
+    for backend in (NoCasCache(), LocalLRUCache()):
+        previous = raw_cache.set_backend(backend)
+        try:
+            gen_cache.invalidate('warm_packed')
+            report = warm(packed_cache, [{'portal_id': 5, 'cache_key': cache_key} for cache_key in cache_keys],
+                          compute=compute)
+            eq_(4, report.computed)
+            eq_([compute(5, cache_key) for cache_key in cache_keys],
+                [packed_cache.get(portal_id=5, cache_key=cache_key) for cache_key in cache_keys])
+
+            report = warm(packed_cache, [{'portal_id': 5, 'cache_key': cache_key} for cache_key in cache_keys + ['d']],
+                          compute=compute)
+            eq_(4, report.already_cached)
+            eq_(1, report.computed)
+            eq_('5-a', packed_cache.get(portal_id=5, cache_key='a'))
+        finally:
+            raw_cache.set_backend(previous)
+
+
+def test_warm_affine_keys():
+    previous = raw_cache.set_backend(AffineCache([LocalLRUCache() for i in range(4)]))
+    affine_calls = []
+    try:
+        @gen_cache.wrap("warm_affine", "warm_affine_portal:portal_id", affinity='portal_id', timeout=60)
+        def get_affine(portal_id, thing_id):
+            affine_calls.append((portal_id, thing_id))
+            return '%s-%s' % (portal_id, thing_id)
+
+        report = warm(get_affine, [[portal_id, 1] for portal_id in range(10)])
+        eq_(10, report.computed)
+        for portal_id in range(10):
+            eq_('%s-1' % portal_id, get_affine(portal_id, 1))
+        eq_(10, len(affine_calls))
+
+        custom_cache = CustomUseGenCache(['warm_affine', 'warm_affine_portal:portal_id'], affinity='portal_id')
+        warm(custom_cache, [{'portal_id': portal_id, 'cache_key': 'a'} for portal_id in range(10)],
+             compute=lambda portal_id, cache_key: '%s-%s' % (portal_id, cache_key))
+        eq_(['%s-a' % portal_id for portal_id in range(10)],
+            [custom_cache.get(portal_id=portal_id, cache_key='a') for portal_id in range(10)])
+    finally:
+        raw_cache.set_backend(previous)
+
+
+def test_read_arg_sets():
+    arg_sets = list(read_arg_sets(StringIO('[1, 2]\n\n{"portal_id": 3}\n{"args": [4], "kwargs": {"flavor": "mint"}}\n')))
+    eq_([([1, 2], {}), ([], {'portal_id': 3}), ([4], {'flavor': 'mint'})], arg_sets)
+    eq_(([7], {}), parse_arg_set(7))
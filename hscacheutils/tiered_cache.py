@@ -0,0 +1,134 @@
+"""
+Puts a local tier (a SharedMemoryCache shared by the processes on the host, or a per-process
+LocalLRUCache) in front of the raw cache backend.
+
+    from hscacheutils import raw_cache
+    from hscacheutils.shared_memory_cache import SharedMemoryCache
+    from hscacheutils.tiered_cache import TieredCache
+
+    raw_cache.set_backend(TieredCache(SharedMemoryCache('/dev/shm/hscacheutils'), raw_cache.get_backend(),
+                                      local_timeout=5))
+
+Or set RAW_CACHE_SHARED_MEMORY_TIER to a dict of SharedMemoryCache keyword arguments (plus an
+optional local_timeout) in your settings.
+
+Reads try the local tier first and fill it from the backend. Writes, deletes and increments
+go to the backend, and to (or out of) the local tier on this host. Other hosts don't see those
+local changes, so anything read from the local tier (generation values included) can be up to
+local_timeout seconds stale after a write made elsewhere.
+"""
+
+
+class TieredCache(object):
+
+    def __init__(self, local, backend, local_timeout=5):
+        self.local = local
+        self.backend = backend
+        self.local_timeout = local_timeout
+
+    def __getattr__(self, name):
+        # Anything we don't know about goes straight to the backend
+        return getattr(self.backend, name)
+
+    def _local_timeout(self, timeout):
+        if timeout is None or timeout <= 0:
+            return self.local_timeout
+        return min(timeout, self.local_timeout)
+
+    def get(self, key, default=None):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        value = self.backend.get(key)
+        if value is None:
+            return default
+
+        self.local.set(key, value, self.local_timeout)
+        return value
+
+    def get_many(self, keys):
+        result = self.local.get_many(keys)
+        missing = [key for key in keys if key not in result]
+
+        if missing:
+            from_backend = self.backend.get_many(missing)
+            for key, value in from_backend.items():
+                if value is not None:
+                    self.local.set(key, value, self.local_timeout)
+            result.update(from_backend)
+
+        return result
+
+    def set(self, key, value, timeout=None):
+        result = self.backend.set(key, value, timeout)
+        self.local.set(key, value, self._local_timeout(timeout))
+        return result
+
+    def set_many(self, vals_by_key, timeout=None):
+        result = self.backend.set_many(vals_by_key, timeout)
+        self.local.set_many(vals_by_key, self._local_timeout(timeout))
+        return result
+
+    def add(self, key, value, timeout=None):
+        added = self.backend.add(key, value, timeout)
+        if added:
+            self.local.set(key, value, self._local_timeout(timeout))
+        else:
+            # Somebody else's value won, don't keep serving our stale one
+            self.local.delete(key)
+        return added
+
+    def gets(self, key):
+        # Always from the backend, which is what cas checks against
+        return self.backend.gets(key)
+
+    def cas(self, key, value, token, timeout=None):
+        stored = self.backend.cas(key, value, token, timeout)
+        if stored:
+            self.local.set(key, value, self._local_timeout(timeout))
+        else:
+            self.local.delete(key)
+        return stored
+
+    def _incr(self, method, key, delta):
+        try:
+            value = method(key, delta)
+        except ValueError:
+            self.local.delete(key)
+            raise
+        self.local.set(key, value, self.local_timeout)
+        return value
+
+    def incr(self, key, delta=1):
+        return self._incr(self.backend.incr, key, delta)
+
+    def decr(self, key, delta=1):
+        return self._incr(self.backend.decr, key, delta)
+
+    # Only usable when the backend has them (eg. an AffineCache, a RedisCache), which gen_cache
+    # checks on the backend at the end of the chain of wrappers
+
+    def incr_everywhere(self, key, delta=1):
+        return self._incr(self.backend.incr_everywhere, key, delta)
+
+    def incr_many(self, keys, delta=1):
+        values = self.backend.incr_many(keys, delta)
+        for key, value in values.items():
+            if value is None:
+                self.local.delete(key)
+            else:
+                self.local.set(key, value, self.local_timeout)
+        return values
+
+    def delete(self, key):
+        self.local.delete(key)
+        return self.backend.delete(key)
+
+    def delete_many(self, keys):
+        self.local.delete_many(keys)
+        return self.backend.delete_many(keys)
+
+    def clear(self):
+        self.local.clear()
+        return self.backend.clear()
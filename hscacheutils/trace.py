@@ -0,0 +1,149 @@
+"""
+An opt-in recorder of compact cache access traces, to replay later against other cache
+policies (see hscacheutils.simulator) before changing TTLs, tiers or sizes.
+
+    from hscacheutils import trace
+
+    trace.start_tracing('/tmp/cache.trace', sample_rate=0.01)
+    ...
+    trace.stop_tracing()
+
+Or set GEN_CACHE_TRACE = {'path': '/tmp/cache.trace', 'sample_rate': 0.01} in your settings.
+
+Sampling is done on the hash of the key without its generation values (the call's arguments, or
+the generations and add_to_key of a gen_cache.get/set) rather than per operation, so that every
+sampled key has its complete history in the trace, across invalidations. Records still carry the
+hash of the full key, which changes when a generation is bumped. Each record is 25 bytes:
+timestamp, op, 64 bit key hash, value size and compute time (only known on misses and sets). Gets
+and sets come from gen_cache.wrap, gen_cache.get/set (and so CustomUseGenCache), invalidations
+from gen_cache.invalidate.
+"""
+
+import cPickle as pickle
+import os
+import struct
+import threading
+
+from collections import namedtuple
+from hashlib import md5
+from time import time
+
+try:
+    from hubspot.hsutils import get_setting_default
+except ImportError:
+    from hscacheutils.setting_wrappers import get_setting_default
+
+
+MAGIC = 'HSTRACE1'
+
+# timestamp, op, key hash, value size, compute time
+RECORD = struct.Struct('<dBQIf')
+
+GET_HIT = 1
+GET_MISS = 2
+SET = 3
+INVALIDATE = 4
+DELETE = 5
+
+OP_NAMES = {GET_HIT: 'get_hit', GET_MISS: 'get_miss', SET: 'set', INVALIDATE: 'invalidate', DELETE: 'delete'}
+
+# Sampling resolution
+SAMPLE_BUCKETS = 1000000
+
+TraceRecord = namedtuple('TraceRecord', ['timestamp', 'op', 'key_hash', 'value_size', 'compute_time'])
+
+
+def key_hash(key):
+    return struct.unpack('<Q', md5(key).digest()[:8])[0]
+
+
+def value_size(value):
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class TraceRecorder(object):
+
+    def __init__(self, path, sample_rate=0.01, buffer_size=64 * 1024):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.sample_threshold = int(sample_rate * SAMPLE_BUCKETS)
+        self._lock = threading.Lock()
+
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'ab', buffer_size)
+        if is_new:
+            self._file.write(MAGIC)
+
+    def sampled_hash(self, key, sample_key=None):
+        """
+        Returns the hash of key if it is sampled (on the hash of sample_key, if passed), else None.
+        """
+        sample_hash = key_hash(sample_key if sample_key is not None else key)
+        if sample_hash % SAMPLE_BUCKETS < self.sample_threshold:
+            return key_hash(key) if sample_key is not None else sample_hash
+        return None
+
+    def record(self, op, key, value=None, compute_time=0.0, size=None, sample_key=None):
+        """
+        Records an operation on key, if it is sampled. sample_key is what's sampled on, the key
+        without its generation values. The value (only needed for misses and sets) is only
+        serialized, to measure its size, when the key is sampled.
+        """
+        hashed = self.sampled_hash(key, sample_key)
+        if hashed is None:
+            return
+
+        if size is None:
+            size = value_size(value) if value is not None else 0
+
+        data = RECORD.pack(time(), op, hashed, min(size, 0xffffffff), compute_time)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(data)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_trace(path):
+    """
+    Yields the TraceRecords in a trace file.
+    """
+    with open(path, 'rb') as trace_file:
+        if trace_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a cache trace" % path)
+
+        while True:
+            data = trace_file.read(RECORD.size)
+            if len(data) < RECORD.size:
+                return
+            yield TraceRecord(*RECORD.unpack(data))
+
+
+# The active recorder (None when not tracing). Checked on every cache operation, so it's a
+# plain module attribute.
+recorder = None
+
+
+def start_tracing(path, sample_rate=0.01):
+    global recorder
+    stop_tracing()
+    recorder = TraceRecorder(path, sample_rate)
+    return recorder
+
+
+def stop_tracing():
+    global recorder
+    previous, recorder = recorder, None
+    if previous is not None:
+        previous.close()
+
+
+_trace_options = get_setting_default('GEN_CACHE_TRACE', None)
+if _trace_options:
+    start_tracing(**_trace_options)
@@ -0,0 +1,358 @@
+"""
+Pre-populates the generational cache for a gen_cache.wrap'd function (or a CustomUseGenCache)
+from a list of argument sets. Useful to get the hit ratio back up after a cold deploy or a flush.
+
+Usage from python:
+
+    from hscacheutils.warm import warm
+
+    report = warm('myapp.loaders.get_contact', [[53, 1], [53, 2], {'portal_id': 53, 'contact_id': 3}])
+
+    # A CustomUseGenCache has no function attached, so pass in what computes its values
+    report = warm(my_custom_cache, [{'portal_id': 53, 'cache_key': 'nav'}], compute=build_nav)
+
+Or from the command line, with one JSON argument set per line (a list is used as positional
+args, a dict with "args" and/or "kwargs" is used as-is, any other dict is used as kwargs):
+
+    python -m hscacheutils.warm myapp.loaders.get_contact args.jsonl --workers 8 --processes
+
+For every batch of argument sets the generations are fetched with a single get_many (one per
+affinity token, for targets placed by one), the value keys with another, and only the keys that
+missed are computed (in a thread or process pool). Values of wrapped functions are stored the
+way a miss stores them (dependencies, pages, registry overrides), those of CustomUseGenCaches
+with a single set_many. Packed CustomUseGenCaches are read and written through their buckets
+instead, one update per bucket.
+"""
+
+import json
+import logging
+import sys
+
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+from time import time
+
+from hscacheutils.affinity import affine_key
+from hscacheutils.generational_cache import gen_cache, CustomUseGenCache, generation_values_for_suffixes, \
+    build_affinity_token, build_generation_cache_key_suffixes
+from hscacheutils.raw_cache import cache as raw_cache
+
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_WORKERS = 4
+
+
+class WarmReport(object):
+    """
+    Progress and throughput of a warming run.
+    """
+
+    def __init__(self):
+        self.started_at = time()
+        self.finished_at = None
+        self.total = 0
+        self.already_cached = 0
+        self.computed = 0
+        self.failed = 0
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time()) - self.started_at
+
+    @property
+    def per_second(self):
+        elapsed = self.elapsed
+        if not elapsed:
+            return 0.0
+        return self.total / elapsed
+
+    def __str__(self):
+        return "%s arg sets (%s already cached, %s computed, %s failed) in %.1fs, %.1f/s" % (
+            self.total, self.already_cached, self.computed, self.failed, self.elapsed, self.per_second)
+
+
+def resolve_dotted_path(path):
+    """
+    Imports and returns the object at a dotted path such as "myapp.loaders.get_contact"
+    (or "myapp.loaders.SomeClass.some_classmethod").
+    """
+    parts = path.split('.')
+
+    for i in range(len(parts) - 1, 0, -1):
+        try:
+            obj = __import__('.'.join(parts[:i]), fromlist=[parts[i]])
+        except ImportError:
+            continue
+
+        for attr in parts[i:]:
+            obj = getattr(obj, attr)
+        return obj
+
+    raise ImportError("Could not import %s" % path)
+
+
+def parse_arg_set(arg_set):
+    """
+    Normalizes an argument set into an (args, kwargs) tuple.
+    """
+    if isinstance(arg_set, (list, tuple)):
+        return list(arg_set), {}
+    elif isinstance(arg_set, dict):
+        if set(arg_set.keys()) <= set(['args', 'kwargs']):
+            return list(arg_set.get('args', [])), dict(arg_set.get('kwargs', {}))
+        return [], dict(arg_set)
+    else:
+        return [arg_set], {}
+
+
+def read_arg_sets(file_obj):
+    """
+    Yields the (JSON encoded, one per line) argument sets in a file.
+    """
+    for line in file_obj:
+        line = line.strip()
+        if line:
+            # JSON gives unicode keys, which can't be used as **kwargs in older pythons
+            args, kwargs = parse_arg_set(json.loads(line))
+            yield args, dict((str(name), value) for name, value in kwargs.items())
+
+
+def _batches(iterable, batch_size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Target(object):
+    """
+    Reads and stores the values of a batch, by the keys built by the target.
+    """
+
+    def get_many(self, keys):
+        return raw_cache.get_many(keys)
+
+    def set_many(self, values):
+        raw_cache.set_many(values, self.timeout)
+
+
+class _WrappedFunctionTarget(_Target):
+    """
+    Knows how to build the keys of, and compute values for, a gen_cache.wrap'd function.
+    """
+
+    def __init__(self, wrapped):
+        if not hasattr(wrapped, 'store'):
+            raise TypeError("%r is not a gen_cache.wrap'd function" % wrapped)
+        self.wrapped = wrapped
+        self.func_helper = wrapped.func_helper
+
+    def compute(self, *args, **kwargs):
+        # The value, with its dependencies for track_dependencies functions (None for None values)
+        value, deps = self.wrapped.compute(args, kwargs)
+        return None if value is None else (value, deps)
+
+    def set_many(self, values):
+        for key, (value, deps) in values.items():
+            self.wrapped.store(key, value, deps)
+
+    def generation_suffixes(self, args, kwargs):
+        return self.func_helper.generation_suffixes(args, kwargs)
+
+    def affinity_token(self, args, kwargs):
+        return self.func_helper.affinity_token(args, kwargs)
+
+    def build_key(self, args, kwargs, gen_values):
+        return self.func_helper.build_wrapped_cache_key_with_generations(args, kwargs, gen_values)
+
+
+class _CustomUseGenCacheTarget(_Target):
+    """
+    Knows how to build the keys of a CustomUseGenCache. The values are computed by the
+    passed in compute function, called with the same kwargs as CustomUseGenCache.get.
+    Packed caches are read and stored through their buckets (see hscacheutils.packed_cache).
+    """
+
+    def __init__(self, custom_cache, compute):
+        if compute is None:
+            raise TypeError("Warming a CustomUseGenCache needs a compute function")
+        self.custom_cache = custom_cache
+        self.compute = compute
+        self.timeout = custom_cache.timeout
+
+    def _key_kwargs(self, kwargs):
+        kwargs = dict(kwargs)
+        self.custom_cache._adjust_kwargs(kwargs)
+        return kwargs
+
+    def generation_suffixes(self, args, kwargs):
+        return build_generation_cache_key_suffixes(self.custom_cache.generation_names, **self._key_kwargs(kwargs))
+
+    def affinity_token(self, args, kwargs):
+        kwargs = self._key_kwargs(kwargs)
+        affinity = kwargs.pop('affinity', None)
+        return build_affinity_token(affinity, kwargs) if affinity else None
+
+    def build_key(self, args, kwargs, gen_values):
+        kwargs = self._key_kwargs(kwargs)
+        if self.custom_cache.packed is not None:
+            return self.custom_cache.packed._keys(kwargs, gen_values)
+        return affine_key(gen_cache.build_key_with_generation_values(gen_values, kwargs.get('add_to_key')),
+                          self.affinity_token(args, kwargs))
+
+
+    def get_many(self, keys):
+        if self.custom_cache.packed is not None:
+            return self.custom_cache.packed.get_keys(keys)
+        return super(_CustomUseGenCacheTarget, self).get_many(keys)
+
+    def set_many(self, values):
+        if self.custom_cache.packed is not None:
+            return self.custom_cache.packed.set_keys(values, self.timeout)
+        super(_CustomUseGenCacheTarget, self).set_many(values)
+
+
+def _make_target(target, compute):
+    if isinstance(target, CustomUseGenCache):
+        return _CustomUseGenCacheTarget(target, compute)
+    return _WrappedFunctionTarget(target)
+
+
+def _compute_in_worker(job):
+    """
+    Runs in the pool. Targets and compute functions are passed around as dotted paths when
+    using processes, since they can't always be pickled.
+    """
+    target, compute, args, kwargs = job
+
+    if isinstance(target, basestring):
+        target = resolve_dotted_path(target)
+    if isinstance(compute, basestring):
+        compute = resolve_dotted_path(compute)
+
+    try:
+        return True, _make_target(target, compute).compute(*args, **kwargs)
+    except Exception:
+        logging.exception("Error warming %s with args=%r, kwargs=%r" % (target, args, kwargs))
+        return False, None
+
+
+def warm(target, arg_sets, compute=None, workers=DEFAULT_WORKERS, use_processes=False,
+         batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Computes and caches every argument set that isn't already cached for target.
+
+    target is a gen_cache.wrap'd function or a CustomUseGenCache, or a dotted path to one.
+    arg_sets is an iterable of argument sets (see parse_arg_set).
+    compute is only needed for a CustomUseGenCache target (a function or a dotted path).
+    use_processes=True computes in a process pool instead of a thread pool, in which case
+    target (and compute) must be dotted paths.
+    progress, if passed, is called with the WarmReport after every batch.
+
+    Returns a WarmReport.
+    """
+    if use_processes and not isinstance(target, basestring):
+        raise TypeError("target must be a dotted path when warming with processes")
+    if use_processes and compute is not None and not isinstance(compute, basestring):
+        raise TypeError("compute must be a dotted path when warming with processes")
+
+    target_path, compute_path = target, compute
+    if isinstance(target, basestring):
+        target = resolve_dotted_path(target)
+    if isinstance(compute, basestring):
+        compute = resolve_dotted_path(compute)
+
+    resolved = _make_target(target, compute)
+    report = WarmReport()
+    pool = Pool(workers) if use_processes else ThreadPool(workers)
+
+    try:
+        for batch in _batches((parse_arg_set(arg_set) for arg_set in arg_sets), batch_size):
+            _warm_batch(resolved, batch, pool, report, target_path if use_processes else target,
+                        compute_path if use_processes else compute)
+            if progress:
+                progress(report)
+    finally:
+        pool.close()
+        pool.join()
+
+    report.finished_at = time()
+    return report
+
+
+def _warm_batch(resolved, batch, pool, report, target, compute):
+    report.total += len(batch)
+
+    # A single get_many for all of the generations in this batch (one per affinity token, since
+    # keys placed by a token have their own copy of the generations, see hscacheutils.affinity)
+    resolved_arg_sets = [(resolved.generation_suffixes(args, kwargs), resolved.affinity_token(args, kwargs))
+                         for args, kwargs in batch]
+    suffixes_by_affinity = dict()
+    for suffixes, affinity_token in resolved_arg_sets:
+        suffixes_by_affinity.setdefault(affinity_token, set()).update(suffixes)
+    gen_values_by_affinity = dict((affinity_token, generation_values_for_suffixes(list(suffixes), affinity_token))
+                                  for affinity_token, suffixes in suffixes_by_affinity.items())
+
+    keys = []
+    for (args, kwargs), (suffixes, affinity_token) in zip(batch, resolved_arg_sets):
+        gen_values = dict((suffix, gen_values_by_affinity[affinity_token][suffix]) for suffix in suffixes)
+        keys.append(resolved.build_key(args, kwargs, gen_values))
+
+    # And another for all the values, skipping whatever is already there
+    cached = resolved.get_many(keys)
+    missing = [(key, args, kwargs) for key, (args, kwargs) in zip(keys, batch) if cached.get(key) is None]
+    report.already_cached += len(batch) - len(missing)
+
+    jobs = [(target, compute, args, kwargs) for key, args, kwargs in missing]
+    results = pool.map(_compute_in_worker, jobs)
+
+    to_set = dict()
+    for (key, args, kwargs), (succeeded, value) in zip(missing, results):
+        if not succeeded:
+            report.failed += 1
+            continue
+        report.computed += 1
+        if value is not None:
+            to_set[key] = value
+
+    if to_set:
+        resolved.set_many(to_set)
+
+
+def main(argv=None):
+    parser = OptionParser(usage="python -m hscacheutils.warm <dotted.path.to.target> <arg_sets.jsonl or - for stdin>")
+    parser.add_option('--compute', help="dotted path to the function computing values (only for a CustomUseGenCache)")
+    parser.add_option('--workers', type='int', default=DEFAULT_WORKERS)
+    parser.add_option('--batch-size', type='int', default=DEFAULT_BATCH_SIZE)
+    parser.add_option('--processes', action='store_true', default=False,
+                      help="compute in a process pool instead of a thread pool")
+    options, args = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("expected a target and an argument sets file")
+
+    target, arg_sets_path = args
+    arg_sets_file = sys.stdin if arg_sets_path == '-' else open(arg_sets_path)
+
+    def progress(report):
+        sys.stderr.write("%s\n" % report)
+
+    try:
+        report = warm(target, ({'args': a, 'kwargs': kw} for a, kw in read_arg_sets(arg_sets_file)),
+                      compute=options.compute, workers=options.workers, use_processes=options.processes,
+                      batch_size=options.batch_size, progress=progress)
+    finally:
+        if arg_sets_file is not sys.stdin:
+            arg_sets_file.close()
+
+    sys.stdout.write("Done: %s\n" % report)
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())